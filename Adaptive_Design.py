@@ -0,0 +1,107 @@
+# ------------------------------------------------------------------------
+#  Bayesian adaptive choice of set size
+#
+#  Keeps a posterior over capacity K and guess rate g on a fixed grid and
+#  picks each trial's number_of_stim (and, optionally, change condition) as
+#  the one whose answer is expected to tell us most about them.
+#
+#  Model (Cowan's K with guessing): with N items, the probed item is held
+#  with probability d = min(1, K/N). If it is held the answer is correct,
+#  otherwise the participant says "change" with probability g. A lapse
+#  rate mixes in a coin flip, so one odd answer can't rule a value out.
+#
+#  Answer probabilities and their log-likelihoods are precomputed for every
+#  (set size, change) design over the whole grid, so an update is one
+#  array addition and choosing a design is a few reductions over the grid.
+#  Trials with no answer leave the posterior as it is.
+#
+#  By default the change condition is drawn from a shuffled half-and-half
+#  sequence, so participants still see as many changes as non-changes, and
+#  only the set size is chosen; with choose_change=True both are chosen.
+
+import numpy as np
+
+default_set_sizes = [1, 2, 3, 4, 5, 6, 7, 8]
+default_k_values = np.linspace(0, 8, 81)
+default_guess_values = np.linspace(0.02, 0.98, 49)
+
+def entropy(p):
+    # Bernoulli entropy in nats, elementwise
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+    return -(p*np.log(p) + (1 - p)*np.log(1 - p))
+
+def change_probabilities(set_sizes, k_values, guess_values, lapse_rate):
+    # P(answer "change") with shape (set size, change, K, g)
+    n = np.asarray(set_sizes, dtype=float)[:, None, None, None]
+    held = np.minimum(1.0, np.asarray(k_values)[None, None, :, None] / n)
+    guess = np.asarray(guess_values)[None, None, None, :]
+    change = np.array([0.0, 1.0])[None, :, None, None]
+    p = change*held + (1 - held)*guess
+    return lapse_rate*0.5 + (1 - lapse_rate)*p
+
+class AdaptiveDesign:
+    def __init__(self, set_sizes=default_set_sizes, k_values=default_k_values, guess_values=default_guess_values,
+                 lapse_rate=0.02, choose_change=False, rng=None):
+        self.set_sizes = list(set_sizes)
+        self.k_values = np.asarray(k_values, dtype=float)
+        self.guess_values = np.asarray(guess_values, dtype=float)
+        self.choose_change = choose_change
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        # Flattened over the grid: (set size, change, grid point)
+        p = change_probabilities(self.set_sizes, self.k_values, self.guess_values, lapse_rate)
+        self.p_change = p.reshape(len(self.set_sizes), 2, -1)
+        self.log_likelihood = np.stack([np.log(1 - self.p_change), np.log(self.p_change)])  # Indexed by answer first
+        self.answer_entropy = entropy(self.p_change)
+        # Both get averaged over the posterior for every design, so they're stacked for one product
+        self.design_rows = np.ascontiguousarray(np.concatenate([self.p_change.reshape(-1, self.p_change.shape[-1]),
+                                                                self.answer_entropy.reshape(-1, self.p_change.shape[-1])]))
+        self.grid_k, self.grid_guess = [values.ravel() for values in
+                                        np.meshgrid(self.k_values, self.guess_values, indexing='ij')]
+
+        self.log_posterior = np.full(self.grid_k.shape, -np.log(self.grid_k.size))  # Flat prior
+        self.posterior = np.exp(self.log_posterior)
+        self.change_sequence = []
+        self.n_updates = 0
+
+    def information_gain(self):
+        # Expected information about (K, g) from one answer, for every (set size, change)
+        predicted, expected_entropy = np.split(self.design_rows @ self.posterior, 2)
+        return (entropy(predicted) - expected_entropy).reshape(len(self.set_sizes), 2)
+
+    def next_change(self):
+        if not self.change_sequence:
+            self.change_sequence = list(self.rng.permutation([0, 1]*5))
+        return int(self.change_sequence.pop())
+
+    def next_design(self):
+        # Returns (number_of_stim, change); ties are broken at random
+        gain = self.information_gain()
+        if self.choose_change:
+            best = np.flatnonzero(gain.ravel() >= gain.max() - 1e-12)
+            i, change = divmod(int(best[self.rng.integers(len(best))]), 2)
+        else:
+            change = self.next_change()
+            best = np.flatnonzero(gain[:, change] >= gain[:, change].max() - 1e-12)
+            i = int(best[self.rng.integers(len(best))])
+        return self.set_sizes[i], change
+
+    def update(self, set_size, change, choice):
+        # choice is run_trial's choice_number: 0 no change, 1 change, 2 no answer
+        if choice not in (0, 1):
+            return
+        i = self.set_sizes.index(set_size)
+        self.log_posterior += self.log_likelihood[choice, i, int(change)]
+        self.log_posterior -= self.log_posterior.max()  # Keeping it in range; normalised below
+        self.posterior = np.exp(self.log_posterior)
+        self.posterior /= self.posterior.sum()
+        self.n_updates += 1
+
+    def estimate(self):
+        # Posterior means and SDs of K and the guess rate
+        k_mean = float(self.posterior @ self.grid_k)
+        guess_mean = float(self.posterior @ self.grid_guess)
+        return {'K_mean': k_mean,
+                'K_sd': float(np.sqrt(max(self.posterior @ self.grid_k**2 - k_mean**2, 0))),
+                'guess_mean': guess_mean,
+                'guess_sd': float(np.sqrt(max(self.posterior @ self.grid_guess**2 - guess_mean**2, 0)))}
@@ -0,0 +1,221 @@
+# ------------------------------------------------------------------------
+#  Microbenchmarks for the per-trial hot paths
+#
+#  Times each piece of per-trial work call by call and reports latency
+#  percentiles, so the tail of the layout rejection loops shows up, not
+#  just the average:
+#    layout generation   create_up_to_2_pos / create_up_to_6_pos at their
+#                        set sizes, and create_n_pos at every set size
+#    colour sampling     a trial's colours plus the changed probe colour
+#    stimuli             create_new_stimulus and StimulusPool.set_trial, in
+#                        a real PsychoPy window
+#    trigger codes       computing and encoding a trial's EEG codes
+#    startup             importing Change_Detection in a fresh interpreter,
+#                        which must not open a window
+#
+#  Results are compared with a stored baseline for the same screen size and
+#  stim_size; the run fails if a benchmark's median or p99 got slower than
+#  the baseline by more than the tolerance, or if any p99 doesn't fit in
+#  the frame budget (time that would spill into the fixation window). The
+#  frame budget doesn't apply to startup, which only has the baseline.
+#  A run with no baseline for its configuration fails too, so a regression
+#  can't pass unnoticed on a machine that was never measured; record one
+#  with --update-baseline on the lab machine and commit the file.
+#
+#      python Benchmarks.py --update-baseline       # record this machine's baseline
+#      python Benchmarks.py --size 2560x1440 --stim-size 90
+#
+#  Stimuli are built in a real PsychoPy window on the lab display. On a
+#  machine without one, --stand-in-window runs everything else on
+#  Headless_Session's stand-ins and leaves the stimuli out, since timing
+#  stand-in objects says nothing about what a real stimulus costs; its
+#  baseline is kept apart from the real window's.
+
+import argparse, json, os, subprocess, sys, time
+# Headless_Session makes pyglet headless, which has to happen before PsychoPy is first
+# imported, so it's imported here, and only for --stand-in-window runs; a real-window
+# run keeps the lab display
+if __name__ == '__main__' and '--stand-in-window' in sys.argv[1:]:
+    import Headless_Session
+import numpy as np
+import Single_Trial_Change_Detection
+import Bilateral_Positions
+import Color_Palette
+import EEG_Triggers
+
+default_baseline = 'benchmark_baseline.json'
+percentiles = [50, 95, 99, 99.9]
+startup_module = 'Change_Detection'
+
+def time_calls(function, n_calls, warmup=20):
+    # Returns per-call times in microseconds
+    for i in range(warmup):
+        function()
+    times = np.empty(n_calls)
+    clock = time.perf_counter_ns
+    for i in range(n_calls):
+        started = clock()
+        function()
+        times[i] = clock() - started
+    return times / 1000.0
+
+def summarize(times):
+    summary = {'p%g' % p: float(value) for p, value in zip(percentiles, np.percentile(times, percentiles))}
+    summary['max'] = float(times.max())
+    return summary
+
+def set_stim_size(size):
+    # Bilateral_Positions and the trial module share stim_size; min_distance follows it
+    Bilateral_Positions.stim_size = size
+    Bilateral_Positions.min_distance = 2.5*size
+    Single_Trial_Change_Detection.stim_size = size
+
+def screen_limits(width, height, size):
+    # Same margins as Single_Trial_Change_Detection.setup_display
+    return int(width/1.35)/2 - size, int(height/1.35)/2 - size
+
+def feasible_set_sizes(x_axis_limit, y_axis_limit, largest):
+    # Set sizes create_n_pos can lay out on this screen. Larger ones are left out, and so
+    # are create_up_to_6_pos calls for them, since its retry loops might never finish.
+    rng = np.random.default_rng(0)
+    feasible = []
+    for n in range(1, largest + 1):
+        try:
+            for i in range(20):
+                Bilateral_Positions.create_n_pos(n, x_axis_limit, y_axis_limit, rng)
+        except ValueError:
+            break
+        feasible.append(n)
+    return feasible
+
+def benchmarks(x_axis_limit, y_axis_limit, stimuli=True):
+    # (name, function) pairs; each function does one trial's worth of that work.
+    # stimuli=False leaves out the stimulus cases, for runs without a real window.
+    rng = np.random.default_rng(0)
+    feasible = feasible_set_sizes(x_axis_limit, y_axis_limit, 8)
+    if len(feasible) < 8:
+        print('Layouts of more than %d stim don\'t fit this screen and stim_size' % len(feasible))
+    palette = Single_Trial_Change_Detection.palette
+    wheel = Color_Palette.ColorWheel()
+    pool = Single_Trial_Change_Detection.stimulus_pool
+    cases = []
+    for n in (1, 2):
+        cases.append(('layout/create_up_to_2_pos/%d' % n,
+                      lambda n=n: Bilateral_Positions.create_up_to_2_pos(n, x_axis_limit, y_axis_limit)))
+    for n in [n for n in (4, 5, 6) if n in feasible]:
+        cases.append(('layout/create_up_to_6_pos/%d' % n,
+                      lambda n=n: Bilateral_Positions.create_up_to_6_pos(n, x_axis_limit, y_axis_limit)))
+    for n in feasible:
+        cases.append(('layout/create_n_pos/%d' % n,
+                      lambda n=n: Bilateral_Positions.create_n_pos(n, x_axis_limit, y_axis_limit, rng)))
+    for n in (2, 6):
+        cases.append(('colors/palette/%d' % n,
+                      lambda n=n: palette.changed_index(palette.sample_indices(n, rng)[0], rng)))
+        cases.append(('colors/wheel/%d' % n,
+                      lambda n=n: wheel.changed_index(wheel.sample_indices(n, rng)[0], rng)))
+    if stimuli:
+        positions = Bilateral_Positions.create_n_pos(min(6, max(feasible)), x_axis_limit, y_axis_limit, rng)
+        colors = [palette.color(i) for i in range(len(positions))]
+        cases.append(('stimuli/create_new_stimulus/%d' % len(positions),
+                      lambda: [Single_Trial_Change_Detection.create_new_stimulus(p, c) for p, c in zip(positions, colors)]))
+        cases.append(('stimuli/pool_set_trial/%d' % len(positions), lambda: pool.set_trial(positions, colors)))
+    cases.append(('triggers/trial_codes',
+                  lambda: [EEG_Triggers.code_bytes(c) for c in EEG_Triggers.trial_codes(3, 30, 6, 1, 1)]))
+    return cases
+
+def time_startup(n_runs, module=startup_module):
+    # Returns import times in microseconds, and whether any import opened a window
+    script = ('import time\nstarted = time.perf_counter()\nimport %s\nimport Single_Trial_Change_Detection\n'
+              'print(time.perf_counter() - started, Single_Trial_Change_Detection.win is not None)' % module)
+    times, opened_window = [], False
+    for i in range(n_runs):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, window = output.split()[-2:]
+        times.append(1e6*float(seconds))
+        opened_window = opened_window or window == b'True'
+    return np.array(times), opened_window
+
+def run_benchmarks(width, height, size, n_calls, stimuli=True):
+    set_stim_size(size)
+    x_axis_limit, y_axis_limit = screen_limits(width, height, size)
+    Bilateral_Positions.get_geometry(x_axis_limit, y_axis_limit, size)  # Built once, as at session start
+    return {name: summarize(time_calls(function, n_calls))
+            for name, function in benchmarks(x_axis_limit, y_axis_limit, stimuli)}
+
+def compare(results, baseline, tolerance, floor_us):
+    # Returns a list of regressions, comparing p50 and p99 with the baseline
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        for stat in ('p50', 'p99'):
+            allowed = baseline[name][stat]*(1 + tolerance) + floor_us
+            if summary[stat] > allowed:
+                regressions.append('%s %s %.1f us > %.1f us allowed (baseline %.1f us)'
+                                   % (name, stat, summary[stat], allowed, baseline[name][stat]))
+    return regressions
+
+def over_budget(results, budget_us):
+    return ['%s p99 %.1f us is over the %.0f us frame budget' % (name, summary['p99'], budget_us)
+            for name, summary in results.items() if summary['p99'] > budget_us and not name.startswith('startup/')]
+
+def print_results(results):
+    print('%-34s' % 'benchmark' + ''.join('%11s' % key for key in ['p%g' % p for p in percentiles] + ['max']) + '  (us)')
+    for name, summary in results.items():
+        print('%-34s' % name + ''.join('%11.1f' % value for value in summary.values()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the per-trial hot paths and compare with a baseline.')
+    parser.add_argument('--size', default='1920x1080', help='screen size in pixels, WIDTHxHEIGHT')
+    parser.add_argument('--stim-size', type=int, default=72)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--update-baseline', '--save-baseline', dest='update_baseline', action='store_true',
+                        help='store this run as the baseline for its configuration')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, as a fraction of the baseline')
+    parser.add_argument('--floor-us', type=float, default=2.0, help='allowed slowdown in us, on top of the tolerance')
+    parser.add_argument('--budget-ms', type=float, default=1000/60.0, help='most any call may take (default one 60 Hz frame)')
+    parser.add_argument('--stand-in-window', action='store_true',
+                        help='run without a display, on Headless_Session\'s stand-ins, leaving out the stimuli')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh interpreters to time the import in (0 skips it)')
+    args = parser.parse_args()
+
+    width, height = [int(value) for value in args.size.lower().split('x')]
+    if args.stand_in_window:
+        Headless_Session.setup_headless(size=(width, height))
+    else:
+        Single_Trial_Change_Detection.setup_display()
+    results = run_benchmarks(width, height, args.stim_size, args.calls, stimuli=not args.stand_in_window)
+    problems = []
+    if args.startup_runs > 0:
+        startup_times, opened_window = time_startup(args.startup_runs)
+        results['startup/import_' + startup_module] = summarize(startup_times)
+        if opened_window:
+            problems.append('importing %s opened a window' % startup_module)
+    print_results(results)
+
+    # Baselines are kept per screen size and stim_size, and apart for stand-in runs
+    configuration = '%dx%d/%d' % (width, height, args.stim_size)
+    if args.stand_in_window:
+        configuration += '/stand-in'
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            stored = json.load(baseline_file)
+
+    if args.update_baseline:
+        stored[configuration] = results
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(stored, baseline_file, indent=1, sort_keys=True)
+        print('Saved baseline for %s to %s' % (configuration, args.baseline))
+        sys.exit(0)
+
+    problems += over_budget(results, 1000*args.budget_ms)
+    if configuration in stored:
+        problems += compare(results, stored[configuration], args.tolerance, args.floor_us)
+    else:
+        problems.append('no baseline for %s in %s; run with --update-baseline to record one' % (configuration, args.baseline))
+    for problem in problems:
+        print('FAIL: ' + problem)
+    sys.exit(1 if problems else 0)
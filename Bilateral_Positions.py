@@ -6,32 +6,48 @@
 #
 #  Rachel Klein, April 2016
 
-import random, math
+import random, math, functools
+import numpy as np
 
 stim_size = 72  # Size in pixels of the sides of the squares.
 
 min_distance = 2.5*stim_size  # Distance the center of each stimulus should be from others
 
+class ScreenGeometry:
+    # Candidate coordinates for one screen size, kept as read-only arrays so they
+    # are built once and then shared by every trial.
+    # Placements exclude being too close to fixation on x or y plane, also
+    # adjusting for the radius of the fixation (6 pixels).
+    def __init__(self, x_axis_limit, y_axis_limit, size=stim_size):
+        self.x_axis_limit = x_axis_limit
+        self.y_axis_limit = y_axis_limit
+        self.stim_size = size
+        self.fixation_buffer = int(1.5*size + 6)  # Minimum distance each stimulus should be from the fixation
+
+        self.left_x = self._frozen(np.arange(int(-x_axis_limit), int(-self.fixation_buffer-1)))
+        self.right_x = self._frozen(np.arange(int(self.fixation_buffer), int(x_axis_limit+1)))
+        self.top_y = self._frozen(np.arange(int(self.fixation_buffer), int(y_axis_limit+1)))
+        self.bottom_y = self._frozen(np.arange(int(-y_axis_limit), int(-self.fixation_buffer-1)))
+        self.possible_x = self._frozen(np.concatenate([self.left_x, self.right_x]))
+        self.possible_y = self._frozen(np.concatenate([self.top_y, self.bottom_y]))
+
+    @staticmethod
+    def _frozen(values):
+        values.setflags(write=False)
+        return values
+
+@functools.lru_cache(maxsize=None)
+def get_geometry(x_axis_limit, y_axis_limit, size=stim_size):
+    # Memoized per (x_axis_limit, y_axis_limit, stim_size); call once before the
+    # first trial so the arrays are never built inside the fixation period
+    return ScreenGeometry(x_axis_limit, y_axis_limit, size)
+
 def create_up_to_2_pos(stim_number, x_axis_limit, y_axis_limit):
-    # Creating lists of possible placements that exclude being too close to fixation on x or y plane
-    # Also adjusting for the radius of the fixation (6 pixels)
-    possible_x = []
-    possible_y = []
-    fixation_buffer = int(1.5*stim_size + 6)  # Minimum distance each stimulus should be from the fixation
-
-    left_x = range(int(-x_axis_limit), int(-fixation_buffer-1))
-    for x in left_x:
-        possible_x.append(x)
-    right_x = range(int(fixation_buffer), int(x_axis_limit+1))
-    for x in right_x:
-        possible_x.append(x)
-        
-    top_y = range(int(fixation_buffer), int(y_axis_limit+1))
-    for y in top_y:
-        possible_y.append(y)
-    bottom_y = range(int(-y_axis_limit), int(-fixation_buffer-1))
-    for y in bottom_y:
-        possible_y.append(y)
+    # Possible placements come from the cached geometry for this screen
+    geometry = get_geometry(x_axis_limit, y_axis_limit, stim_size)
+    possible_x, possible_y = geometry.possible_x, geometry.possible_y
+    left_x, right_x = geometry.left_x, geometry.right_x
+    top_y, bottom_y = geometry.top_y, geometry.bottom_y
 
     pos_list = []
     
@@ -51,25 +67,11 @@ def create_up_to_2_pos(stim_number, x_axis_limit, y_axis_limit):
     return pos_list
 
 def create_up_to_6_pos(stim_number, x_axis_limit, y_axis_limit):
-    # Creating lists of possible placements that exclude being too close to fixation on x or y plane
-    # Also adjusting for the radius of the fixation (6 pixels)
-    possible_x = []
-    possible_y = []
-    fixation_buffer = int(1.5*stim_size + 6)  # Minimum distance each stimulus should be from the fixation
-
-    left_x = range(int(-x_axis_limit), int(-fixation_buffer-1))
-    for x in left_x:
-        possible_x.append(x)
-    right_x = range(int(fixation_buffer), int(x_axis_limit+1))
-    for x in right_x:
-        possible_x.append(x)
-        
-    top_y = range(int(fixation_buffer), int(y_axis_limit+1))
-    for y in top_y:
-        possible_y.append(y)
-    bottom_y = range(int(-y_axis_limit), int(-fixation_buffer-1))
-    for y in bottom_y:
-        possible_y.append(y)
+    # Possible placements come from the cached geometry for this screen
+    geometry = get_geometry(x_axis_limit, y_axis_limit, stim_size)
+    possible_x, possible_y = geometry.possible_x, geometry.possible_y
+    left_x, right_x = geometry.left_x, geometry.right_x
+    top_y, bottom_y = geometry.top_y, geometry.bottom_y
     pos_list = []
 
     # First four stim get placed one in each quadrant of screen
@@ -314,4 +316,228 @@ def create_up_to_6_pos(stim_number, x_axis_limit, y_axis_limit):
                     break
             pos_list.append(pos)
 
-    return pos_list
\ No newline at end of file
+    return pos_list
+
+# ------------------------------------------------------------------------
+#  Batch layout generation
+#
+#  Same placement rules as create_up_to_2_pos and create_up_to_6_pos, but
+#  returns the layouts for many trials at once as an array of shape
+#  (n_trials, stim_number, 2). Rejection for the fifth and sixth stim is
+#  done in vectorized passes: every pass redraws only the rows that are
+#  still too close to the stim sharing their quadrant.
+
+# Quadrants are numbered in the order create_up_to_6_pos places the first four stim
+UPPER_LEFT, UPPER_RIGHT, LOWER_LEFT, LOWER_RIGHT = 0, 1, 2, 3
+
+# Quadrant pairs for the fifth and sixth stim, matching position_choice 1-6 in create_up_to_6_pos
+six_stim_quadrant_pairs = np.array([
+    [UPPER_LEFT, UPPER_RIGHT],  # 1 = both top
+    [LOWER_LEFT, LOWER_RIGHT],  # 2 = both bottom
+    [UPPER_LEFT, LOWER_LEFT],  # 3 = both left
+    [UPPER_RIGHT, LOWER_RIGHT],  # 4 = both right
+    [UPPER_RIGHT, LOWER_LEFT],  # 5 = upper right and lower left
+    [UPPER_LEFT, LOWER_RIGHT],  # 6 = upper left and lower right
+    ])
+
+def _sample_in_quadrants(rng, quadrants, ranges):
+    # Draws one position per entry of quadrants (an int array of quadrant numbers)
+    left_x, right_x, top_y, bottom_y = ranges
+    is_left = (quadrants == UPPER_LEFT) | (quadrants == LOWER_LEFT)
+    is_top = (quadrants == UPPER_LEFT) | (quadrants == UPPER_RIGHT)
+    n = len(quadrants)
+    x = np.where(is_left, rng.choice(left_x, n), rng.choice(right_x, n))
+    y = np.where(is_top, rng.choice(top_y, n), rng.choice(bottom_y, n))
+    return np.stack([x, y], axis=-1)
+
+def _place_away_from(rng, anchors, quadrants, ranges):
+    # Places one stim per row in the given quadrant, redrawing rows that are not
+    # more than min_distance from that row's anchor stim
+    pos = _sample_in_quadrants(rng, quadrants, ranges)
+    too_close = np.hypot(*(pos - anchors).T) <= min_distance
+    while too_close.any():
+        rows = np.flatnonzero(too_close)
+        pos[rows] = _sample_in_quadrants(rng, quadrants[rows], ranges)
+        too_close[rows] = np.hypot(*(pos[rows] - anchors[rows]).T) <= min_distance
+    return pos
+
+def create_pos_batch(stim_number, n_trials, x_axis_limit, y_axis_limit, rng=None):
+    # Returns an int array of shape (n_trials, stim_number, 2)
+    # rng is a numpy Generator; pass a seeded one to get reproducible layouts
+    if rng is None:
+        rng = np.random.default_rng()
+    geometry = get_geometry(x_axis_limit, y_axis_limit, stim_size)
+    ranges = geometry.left_x, geometry.right_x, geometry.top_y, geometry.bottom_y
+    left_x, right_x = geometry.left_x, geometry.right_x
+    possible_x, possible_y = geometry.possible_x, geometry.possible_y
+    pos_array = np.empty((n_trials, stim_number, 2), dtype=int)
+
+    if stim_number == 1 or stim_number == 2:
+        # First position can be in any quadrant
+        pos_array[:, 0, 0] = rng.choice(possible_x, n_trials)
+        pos_array[:, 0, 1] = rng.choice(possible_y, n_trials)
+        if stim_number == 2:
+            # Second stim goes on the other side, top/bottom chosen randomly
+            pos_array[:, 1, 0] = np.where(pos_array[:, 0, 0] < 0,
+                rng.choice(right_x, n_trials), rng.choice(left_x, n_trials))
+            pos_array[:, 1, 1] = rng.choice(possible_y, n_trials)
+        return pos_array
+
+    if stim_number not in (4, 5, 6):
+        raise ValueError('create_pos_batch supports 1, 2, 4, 5 or 6 stim, not %s' % stim_number)
+
+    # First four stim get placed one in each quadrant of screen
+    for quadrant in (UPPER_LEFT, UPPER_RIGHT, LOWER_LEFT, LOWER_RIGHT):
+        pos_array[:, quadrant] = _sample_in_quadrants(rng, np.full(n_trials, quadrant), ranges)
+
+    if stim_number == 5:
+        extra_quadrants = rng.integers(0, 4, size=(n_trials, 1))  # Quadrant chosen randomly for fifth stim
+    elif stim_number == 6:
+        extra_quadrants = six_stim_quadrant_pairs[rng.integers(0, 6, size=n_trials)]
+    else:
+        return pos_array
+
+    rows = np.arange(n_trials)
+    for i in range(extra_quadrants.shape[1]):
+        quadrants = extra_quadrants[:, i]
+        anchors = pos_array[rows, quadrants]  # The first-four stim sharing this quadrant
+        pos_array[:, 4 + i] = _place_away_from(rng, anchors, quadrants, ranges)
+
+    return pos_array
+
+
+# ------------------------------------------------------------------------
+#  General layout engine for any number of stim
+#
+#  Quadrants are filled in rounds: the first round places up to four stim
+#  bilaterally (one per quadrant, alternating sides), and every later round
+#  puts its stim in distinct, randomly chosen quadrants, as the fifth and
+#  sixth stim are in create_up_to_6_pos.
+#
+#  Each stim is drawn uniformly from the points of its quadrant that are
+#  more than min_distance from every stim already placed. Nearby stim are
+#  found through a uniform-grid spatial hash, and the feasible points are
+#  found with one masked pass over the quadrant, so a placement costs at
+#  most one pass over the quadrant's candidate points instead of an
+#  open-ended retry loop.
+
+layout_rng = np.random.default_rng()  # Used when no generator is passed in
+
+max_layout_attempts = 3  # Whole-layout restarts before giving up on a crowded screen
+
+class SpatialHash:
+    # Uniform grid with cells min_distance wide. Only stim in cells overlapping a
+    # box (grown by one cell) can be within min_distance of a point in that box.
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, x, y):
+        self.cells.setdefault(self._cell(x, y), []).append((x, y))
+
+    def near_box(self, x_min, x_max, y_min, y_max):
+        first_col, first_row = self._cell(x_min - self.cell_size, y_min - self.cell_size)
+        last_col, last_row = self._cell(x_max + self.cell_size, y_max + self.cell_size)
+        near = []
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                near.extend(self.cells.get((col, row), ()))
+        return near
+
+def quadrant_ranges(geometry, quadrant):
+    x_values = geometry.left_x if quadrant in (UPPER_LEFT, LOWER_LEFT) else geometry.right_x
+    y_values = geometry.top_y if quadrant in (UPPER_LEFT, UPPER_RIGHT) else geometry.bottom_y
+    return x_values, y_values
+
+def assign_quadrants(stim_number, rng):
+    quadrants = []
+    if stim_number >= 4:
+        quadrants.extend([UPPER_LEFT, UPPER_RIGHT, LOWER_LEFT, LOWER_RIGHT])
+    elif stim_number >= 1:
+        # First position can be in any quadrant, the rest alternate sides
+        quadrants.append(int(rng.integers(4)))
+        while len(quadrants) < stim_number:
+            was_left = quadrants[-1] in (UPPER_LEFT, LOWER_LEFT)
+            other_side = [UPPER_RIGHT, LOWER_RIGHT] if was_left else [UPPER_LEFT, LOWER_LEFT]
+            unused = [q for q in other_side if q not in quadrants]
+            quadrants.append(unused[int(rng.integers(len(unused)))])
+    while len(quadrants) < stim_number:
+        round_size = min(4, stim_number - len(quadrants))
+        quadrants.extend(int(q) for q in rng.permutation(4)[:round_size])
+    return quadrants
+
+def quadrant_capacity(geometry, quadrant):
+    # Upper bound on how many stim fit in one quadrant with min_distance between
+    # centres (densest circle packing of the quadrant grown by min_distance/2 on
+    # each side). Used to refuse impossible layouts before drawing anything.
+    x_values, y_values = quadrant_ranges(geometry, quadrant)
+    if len(x_values) == 0 or len(y_values) == 0:
+        return 0
+    width = x_values[-1] - x_values[0] + min_distance
+    height = y_values[-1] - y_values[0] + min_distance
+    return int(width*height / (math.sqrt(3)/2 * min_distance**2))
+
+def check_layout_feasible(stim_number, geometry, quadrants):
+    for quadrant in set(quadrants):
+        needed = quadrants.count(quadrant)
+        capacity = quadrant_capacity(geometry, quadrant)
+        if needed > capacity:
+            raise ValueError('Cannot fit %d stim in quadrant %d (at most %d) for a %s x %s screen with stim_size %s'
+                % (needed, quadrant, capacity, geometry.x_axis_limit, geometry.y_axis_limit, geometry.stim_size))
+
+def feasible_mask(x_values, y_values, near):
+    # (len(y_values), len(x_values)) mask of the points more than min_distance from every
+    # stim in near. Clears the points within min_distance of each stim, touching only the
+    # square around it (both edges of the square included).
+    feasible = np.ones((len(y_values), len(x_values)), dtype=bool)
+    for near_x, near_y in near:
+        first_col = np.searchsorted(x_values, near_x - min_distance, side='left')
+        last_col = np.searchsorted(x_values, near_x + min_distance, side='right')
+        first_row = np.searchsorted(y_values, near_y - min_distance, side='left')
+        last_row = np.searchsorted(y_values, near_y + min_distance, side='right')
+        dx = x_values[first_col:last_col] - near_x
+        dy = y_values[first_row:last_row] - near_y
+        feasible[first_row:last_row, first_col:last_col] &= dy[:, None]**2 + dx[None, :]**2 > min_distance**2
+    return feasible
+
+def _place_in_quadrant(rng, geometry, quadrant, placed):
+    x_values, y_values = quadrant_ranges(geometry, quadrant)
+    x_min, x_max, y_min, y_max = x_values[0], x_values[-1], y_values[0], y_values[-1]
+    near = [(x, y) for x, y in placed.near_box(x_min, x_max, y_min, y_max)
+        if math.hypot(x - min(max(x, x_min), x_max), y - min(max(y, y_min), y_max)) <= min_distance]
+    if not near:
+        return [int(rng.choice(x_values)), int(rng.choice(y_values))]
+
+    feasible = feasible_mask(x_values, y_values, near)
+    feasible_points = np.flatnonzero(feasible)
+    if len(feasible_points) == 0:
+        return None
+    point = feasible_points[rng.integers(len(feasible_points))]
+    return [int(x_values[point % len(x_values)]), int(y_values[point // len(x_values)])]
+
+def create_n_pos(stim_number, x_axis_limit, y_axis_limit, rng=None):
+    # Returns a list of stim_number [x, y] positions, or raises ValueError when the
+    # layout can't be made on this screen
+    if rng is None:
+        rng = layout_rng
+    geometry = get_geometry(x_axis_limit, y_axis_limit, stim_size)
+
+    for attempt in range(max_layout_attempts):
+        quadrants = assign_quadrants(stim_number, rng)
+        check_layout_feasible(stim_number, geometry, quadrants)
+        placed = SpatialHash(min_distance)
+        pos_list = []
+        for quadrant in quadrants:
+            pos = _place_in_quadrant(rng, geometry, quadrant, placed)
+            if pos is None:
+                break  # Earlier stim left no room here, start the layout over
+            placed.add(*pos)
+            pos_list.append(pos)
+        else:
+            return pos_list
+
+    raise ValueError('Could not place %d stim at least %s pixels apart after %d attempts'
+        % (stim_number, min_distance, max_layout_attempts))
@@ -0,0 +1,157 @@
+# ------------------------------------------------------------------------
+#  Capacity analysis across sessions
+#
+#  Reads the wide-text CSVs that ExperimentHandler writes under data/ID_*
+#  and computes, by participant, block and number_of_stim:
+#    hit rate         P(answered "change" | change trial)
+#    false alarms     P(answered "change" | no-change trial)
+#    Cowan's K        number_of_stim * (hit rate - false alarm rate)
+#    RT               mean and SD of answered trials
+#
+#  Each file is reduced to per-group counts and sums, which are cached in
+#  capacity_cache.json in the data folder together with the file's mtime
+#  and size. Re-running over a growing study only reads new or changed
+#  sessions. Practice trials (block 0) are left out.
+#
+#      python Capacity_Analysis.py data capacity.csv
+
+import csv, glob, json, os, sys
+import numpy as np
+
+cache_name = 'capacity_cache.json'
+cache_version = 2  # Entries from other versions are read again (version 1 read BOM-prefixed files as empty)
+
+# Per-group sums kept for each file; they add up across files
+stat_names = ['n_change', 'n_hits', 'n_same', 'n_false_alarms', 'n_answered', 'rt_sum', 'rt_sumsq']
+
+def find_data_files(data_folder):
+    # ExperimentHandler's wide-text files, not the timeline or recovered CSVs next to them
+    files = glob.glob(os.path.join(data_folder, 'ID_*', '*_Change_Detection_*.csv'))
+    return sorted(f for f in files if not f.endswith(('_flips.csv', '_phases.csv', '_recovered.csv')))
+
+def _as_int(value, default=-1):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+def read_trials(filename):
+    # Returns participant (str) and int/float arrays for the experimental trials
+    with open(filename, newline='', encoding='utf-8-sig') as data_file:  # ExperimentHandler starts the file with a BOM
+        rows = [row for row in csv.DictReader(data_file) if row.get('number_of_stim') not in (None, '')]
+    participant = rows[0].get('Participant_ID', '') if rows else ''
+    # block_loop.thisN counts blocks from 0 and is empty on practice rows
+    block = np.array([_as_int(row.get('block_loop.thisN')) + 1 for row in rows], dtype=np.int64)
+    trials = {
+        'block': block,
+        'set_size': np.array([_as_int(row['number_of_stim']) for row in rows], dtype=np.int64),
+        'change': np.array([_as_int(row['change']) for row in rows], dtype=np.int64),
+        'choice': np.array([_as_int(row.get('choice'), 2) for row in rows], dtype=np.int64),
+        'rt': np.array([float(row.get('rt') or 0) for row in rows]),
+        }
+    experimental = trials['block'] > 0
+    return str(participant), {name: values[experimental] for name, values in trials.items()}
+
+def file_aggregates(filename):
+    # One row per (block, set size): the sums in stat_names
+    participant, trials = read_trials(filename)
+    keys = np.stack([trials['block'], trials['set_size']], axis=1)
+    if len(keys) == 0:
+        return participant, []
+    groups, group_index = np.unique(keys, axis=0, return_inverse=True)
+    group_index = group_index.ravel()
+    n_groups = len(groups)
+
+    changed = trials['change'] == 1
+    said_change = trials['choice'] == 1
+    answered = trials['choice'] != 2
+    rt = np.where(answered, trials['rt'], 0.0)
+    sums = np.stack([
+        np.bincount(group_index, changed, n_groups),
+        np.bincount(group_index, changed & said_change, n_groups),
+        np.bincount(group_index, ~changed, n_groups),
+        np.bincount(group_index, ~changed & said_change, n_groups),
+        np.bincount(group_index, answered, n_groups),
+        np.bincount(group_index, rt, n_groups),
+        np.bincount(group_index, rt**2, n_groups),
+        ], axis=1)
+    return participant, [[int(b), int(n)] + row for (b, n), row in zip(groups.tolist(), sums.tolist())]
+
+def load_cache(data_folder):
+    try:
+        with open(os.path.join(data_folder, cache_name)) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def collect_aggregates(data_folder, use_cache=True):
+    # Returns {filename: (participant, rows)}, reading only files that changed since the cache was written
+    cache = load_cache(data_folder) if use_cache else {}
+    aggregates = {}
+    changed = False
+    for filename in find_data_files(data_folder):
+        info = os.stat(filename)
+        cached = cache.get(filename)
+        if (cached is None or cached.get('version') != cache_version
+                or cached['mtime'] != info.st_mtime or cached['size'] != info.st_size):
+            participant, rows = file_aggregates(filename)
+            cached = {'version': cache_version, 'mtime': info.st_mtime, 'size': info.st_size, 'participant': participant, 'rows': rows}
+            cache[filename] = cached
+            changed = True
+        aggregates[filename] = (cached['participant'], cached['rows'])
+    if len(cache) != len(aggregates):
+        cache = {filename: cache[filename] for filename in aggregates}  # Sessions that were removed
+        changed = True
+    if use_cache and changed:
+        with open(os.path.join(data_folder, cache_name), 'w') as cache_file:
+            json.dump(cache, cache_file)
+    return aggregates
+
+def summarize(aggregates, by_block=True):
+    # Combines the per-file sums by participant, (block,) and set size, and works out the metrics
+    participants, blocks, set_sizes, sums = [], [], [], []
+    for participant, rows in aggregates.values():
+        for row in rows:
+            participants.append(participant)
+            blocks.append(row[0] if by_block else 0)
+            set_sizes.append(row[1])
+            sums.append(row[2:])
+    if not sums:
+        return []
+    participant_names, participant_index = np.unique(np.array(participants), return_inverse=True)
+    keys = np.stack([participant_index.ravel(), blocks, set_sizes], axis=1)
+    groups, group_index = np.unique(keys, axis=0, return_inverse=True)
+    group_index = group_index.ravel()
+    totals = np.zeros((len(groups), len(stat_names)))
+    np.add.at(totals, group_index, np.array(sums, dtype=float))
+    n_change, n_hits, n_same, n_false_alarms, n_answered, rt_sum, rt_sumsq = totals.T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit_rate = n_hits / n_change
+        false_alarm_rate = n_false_alarms / n_same
+        rt_mean = rt_sum / n_answered
+        rt_sd = np.sqrt(np.maximum(rt_sumsq / n_answered - rt_mean**2, 0) * n_answered / (n_answered - 1))
+    k = groups[:, 2] * (hit_rate - false_alarm_rate)
+
+    summary = []
+    for i, (p, block, set_size) in enumerate(groups.tolist()):
+        row = {'Participant_ID': str(participant_names[p])}
+        if by_block:
+            row['block'] = block
+        row.update({'number_of_stim': set_size, 'n_trials': int(n_change[i] + n_same[i]),
+                    'hit_rate': float(hit_rate[i]), 'false_alarm_rate': float(false_alarm_rate[i]), 'K': float(k[i]),
+                    'rt_mean': float(rt_mean[i]), 'rt_sd': float(rt_sd[i]), 'n_answered': int(n_answered[i])})
+        summary.append(row)
+    return summary
+
+def write_summary(summary, filename):
+    with open(filename, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=list(summary[0]) if summary else [])
+        writer.writeheader()
+        writer.writerows(summary)
+
+if __name__ == '__main__':
+    data_folder = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    output_filename = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_folder, 'capacity_summary.csv')
+    write_summary(summarize(collect_aggregates(data_folder)), output_filename)
+    print(output_filename)
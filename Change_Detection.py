@@ -4,130 +4,339 @@
 #  Rachel Klein, January 2016
 
 from psychopy import visual, data, core, gui
-from random import random
+from random import random, SystemRandom
 import Single_Trial_Change_Detection
-import serial
+import Session_Schedule
+import EEG_Triggers
+import Frame_Timeline
+import Response_Devices
+import Trial_Writer
+import Session_Columns
+import Adaptive_Design
+import Study_Schedule
+import Trial_Prefetch
+import Realtime_Mode
+import numpy as np
 import os
+import atexit
 
 title = "Change_Detection"
-date = data.getDateStr()
-
-# Making the mouse show up at the beginning
-Single_Trial_Change_Detection.mouse.setVisible(1)
-
-# Create a data folder to save files to
-dataFolder = os.getcwd() + os.sep + 'data' + os.sep
-if not os.path.exists(dataFolder): 
-    os.makedirs(dataFolder)
-
-# Initial dialog box to collect info on study participant and year
-study_info = {'Participant_ID':0}
-study_info_dialog = gui.DlgFromDict(dictionary=study_info, title='Change Detection')
-if study_info_dialog.OK:
-    output_file_name = dataFolder + 'change_detection_' + str(study_info['Participant_ID'])
-else:
-    core.quit()  # If you click "cancel" instead of "OK", closes program
-
-IDfolder = dataFolder + os.sep + 'ID_' + str(study_info['Participant_ID'])
-if not os.path.exists(IDfolder):
-    os.makedirs(IDfolder)
-
-dataFileName = IDfolder + os.sep + u'%s_%s_%s' % (study_info['Participant_ID'], title, date)
-
-# Creating structure of whole experiment
-exp = data.ExperimentHandler(name='change_detection',
-                version='0.1',
-                extraInfo={'Participant_ID':study_info['Participant_ID']},
-                runtimeInfo=None,
-                originPath=None,
-                saveWideText=True,
-                dataFileName=dataFileName)
-
-# Making fullscreen for performance
-Single_Trial_Change_Detection.win.winHandle.minimize()
-Single_Trial_Change_Detection.win.fullscr = True
-Single_Trial_Change_Detection.mouse.setVisible(0)  # Mouse is invisible during trials
-Single_Trial_Change_Detection.win.winHandle.set_mouse_position(0,0)
-Single_Trial_Change_Detection.win.winHandle.maximize()
-Single_Trial_Change_Detection.win.winHandle.activate()
-Single_Trial_Change_Detection.win.flip()
-
-# Setting up serial port
-# Make sure the value below is correct for our computers - may be D010 or 037F or 0278
-# port = serial.Serial('COM4')
-
-# Loading external file of practice conditions (must be in same directory)
-# If you want different numbers of stimuli to appear you will need to change the possiblities in this file
-practice_conditions = data.importConditions('cd_practice_conditions.csv')
-practice = data.TrialHandler(trialList=practice_conditions, nReps=1,name='practice',
-                 method='sequential')
-practice.data.addDataType('choice')
-practice.data.addDataType('accuracy')
-practice.data.addDataType('rt')
-
-exp.addLoop(practice)
-
-# Showing instructions before practice
-image_list = ['imgs/instruct.png', 'imgs/fix1.png', 'imgs/stim1.png', 'imgs/fix2.png', 'imgs/resp1.png',
-              'imgs/fix3.png', 'imgs/stim2.png', 'imgs/fix4.png', 'imgs/resp2.png']
-                            
-for image in image_list:
-    Single_Trial_Change_Detection.display_instructions(image)
-    
-Single_Trial_Change_Detection.display_text_instructions(instructions_text = 'Now it\'s time to practice')
-
-# Running practice trials
-# block_number is 0 for practice trials currently - starts at 1 for real trials
-# (This shows up later in EEG code values.)
-block_number = 0
-for trial in practice:
-    trial_data = Single_Trial_Change_Detection.run_trial(int(trial['number_of_stim']), int(trial['change']), block_number, practice.thisTrialN+1)
-    practice.addData('choice', trial_data[0])
-    practice.addData('accuracy', trial_data[1]) 
-    practice.addData('rt', trial_data[2])
-    exp.nextEntry()
-    
-# Showing instructions after practice
-Single_Trial_Change_Detection.fixation.setAutoDraw(False)
-Single_Trial_Change_Detection.display_instructions('Instructions_CD.png')
-Single_Trial_Change_Detection.fixation.setAutoDraw(True)
-
-# Creating block structure
-
-block_loop=data.TrialHandler(trialList=[], nReps=3,name='block_loop',
-                 method='sequential')
-exp.addLoop(block_loop)
-
-# Creating trial structure for each block
-
-block_number = 1  # Keep track of what block we're on so we can inform the user
-for thisRep in block_loop:
-    
-    # Loading external file of trial conditions (must be in same directory)
-    # If you want different numbers of stimuli to appear you will need to change the possiblities in this file
-    trial_conditions = data.importConditions('cd_trial_conditions.csv')
-    
-    # nReps (below) sets how many repetitions of the list of trial conditions you want per block.
-    # Currently 5 repetitions * 3 possible number_of_stim values * 2 for change/no change = 30 trials per block
-    trials = data.TrialHandler(trialList=trial_conditions, nReps=5, method='fullRandom', extraInfo={'Participant_ID':0,'year':0})
-    trials.data.addDataType('choice')
-    trials.data.addDataType('accuracy')
-    trials.data.addDataType('rt')
-
-    exp.addLoop(trials)
-    
-    # Running trials
-    for trial in trials:
-        trial_data = Single_Trial_Change_Detection.run_trial(int(trial['number_of_stim']), int(trial['change']), block_number, trials.thisN+1)
-        trials.addData('choice', trial_data[0])
-        trials.addData('accuracy', trial_data[1])
-        trials.addData('rt', trial_data[2])
-        exp.nextEntry()
-    
-    if block_number < 3:
-        Single_Trial_Change_Detection.display_end_of_block_screen(block_number)
-        block_number += 1
+
+# Instruction screens shown before practice, and the one shown after it
+default_instruction_images = ['imgs/instruct.png', 'imgs/fix1.png', 'imgs/stim1.png', 'imgs/fix2.png', 'imgs/resp1.png',
+                      'imgs/fix3.png', 'imgs/stim2.png', 'imgs/fix4.png', 'imgs/resp2.png']
+after_practice_image = 'Instructions_CD.png'
+practice_text = 'Now it\'s time to practice'
+
+# Set adaptive to True to pick each block trial's number_of_stim from a running estimate of
+# capacity (see Adaptive_Design.py) instead of the fixed conditions in cd_trial_conditions.csv.
+# A block ends after adaptive_trials_per_block trials, or once the posterior SD of K is below
+# adaptive_target_sd (None never ends a block early).
+adaptive = False
+adaptive_trials_per_block = 30
+adaptive_target_sd = None
+
+# Set study_schedule_file to a file made by Study_Schedule.py (e.g. 'study_schedule.npz') to run
+# each participant's counterbalanced trials from it, looked up by Participant_ID. Its seed
+# replaces the one in the dialog box.
+study_schedule_file = None
+
+# Set realtime to True to keep garbage collection out of trials (a collection is made between
+# trials instead) and log pause and frame timing stats for every trial (see Realtime_Mode.py).
+# On Linux the thread running the trials can also get a higher priority and be pinned to one
+# CPU; these need root or CAP_SYS_NICE, and None leaves them as they are. Helper threads
+# started before the session (trigger dispatcher, gaze reader, prefetch worker) keep theirs.
+realtime = False
+realtime_nice = -10
+realtime_fifo_priority = None  # e.g. 50 to use the SCHED_FIFO real-time policy instead of nice
+realtime_cpu = None  # e.g. 3, for the trial thread only; ideally a CPU nothing else is pinned to
+
+def make_data_file_name(study_info, dataFolder):
+    date = data.getDateStr()
+    IDfolder = dataFolder + os.sep + 'ID_' + str(study_info['Participant_ID'])
+    if not os.path.exists(IDfolder):
+        os.makedirs(IDfolder)
+    return IDfolder + os.sep + u'%s_%s_%s' % (study_info['Participant_ID'], title, date)
+
+def open_fullscreen():
+    # The dialog box has closed by now, so the window can open fullscreen straight away
+    Single_Trial_Change_Detection.setup_display(Single_Trial_Change_Detection.open_window(fullscr=True))
+    Single_Trial_Change_Detection.mouse.setVisible(0)  # Mouse is invisible during trials
+    Single_Trial_Change_Detection.win.flip()
+
+def run_session(study_info, dataFolder, instruction_images=None):
+    # Runs the practice loop and all blocks for one participant and saves the data.
+    # study_info holds Participant_ID and Seed (0 picks a new seed).
+    # Returns the data file name (without extension).
+    dataFileName = make_data_file_name(study_info, dataFolder)
+    Single_Trial_Change_Detection.get_display()  # Opens a window if main() hasn't already
+
+    # Checking for every instruction image before anything runs, and decoding them in the background
+    if instruction_images is None:
+        instruction_images = default_instruction_images
+    missing = Single_Trial_Change_Detection.preload_screens(list(instruction_images) + [after_practice_image], [practice_text])
+    for filename in missing:
+        print('Missing instructions image: ' + filename + ' (a placeholder will be shown instead)')
+
+    # Compiling every trial of the session before the first one runs, and keeping a copy with the data
+    if study_schedule_file is not None:
+        schedule = Study_Schedule.load_participant(study_schedule_file, study_info['Participant_ID'],
+            Single_Trial_Change_Detection.x_axis_limit, Single_Trial_Change_Detection.y_axis_limit)
+        study_info['Seed'] = schedule.seed
     else:
-        Single_Trial_Change_Detection.display_end_of_experiment_screen()
-       
-# Data automatically gets saved by ExperimentHandler when we quit or when all blocks are done 
+        if int(study_info['Seed']) == 0:
+            study_info['Seed'] = SystemRandom().randrange(1, 2**31)
+        schedule = Session_Schedule.compile_session(int(study_info['Seed']),
+            Single_Trial_Change_Detection.x_axis_limit, Single_Trial_Change_Detection.y_axis_limit,
+            Single_Trial_Change_Detection.palette)
+    session_seed = int(study_info['Seed'])
+    schedule.save(dataFileName + '_schedule.npz')
+
+    # Flip times and phase durations of every trial, saved next to the data file
+    session_timeline = Frame_Timeline.SessionTimeline()
+
+    # In adaptive mode block trials are made one at a time between trials, from the same
+    # per-trial random streams as the schedule, and saved together at the end
+    max_set_size = int(schedule.set_size.max())
+    if adaptive:
+        # Block 0 (practice) has no shuffled order, so this stream isn't used for anything else
+        procedure = Adaptive_Design.AdaptiveDesign(rng=np.random.default_rng([session_seed, 0]))
+        adaptive_specs = []
+        max_set_size = max(max_set_size, max(procedure.set_sizes))
+
+    # Typed columns with each trial's layout and colours, saved as one .npy file per column
+    session_columns = Session_Columns.SessionColumns(max_set_size,
+        {'Participant_ID': study_info['Participant_ID'], 'Seed': session_seed})
+
+    # Making enough pooled squares for the largest set size now, rather than during a trial
+    Single_Trial_Change_Detection.stimulus_pool.grow(max_set_size)
+
+    # Each scheduled trial is looked up and loaded into a spare set of squares while the one
+    # before it runs (see Trial_Prefetch.py). Adaptive block trials depend on the answer just
+    # given, so they are made between trials instead.
+    prefetcher = Trial_Prefetch.TrialPrefetcher(Single_Trial_Change_Detection.stimulus_pool,
+        Single_Trial_Change_Detection.StimulusPool(max_set_size, batched=Single_Trial_Change_Detection.batched_memory_array))
+    Single_Trial_Change_Detection.idle_hooks.append(prefetcher.prepare)
+
+    # With an eye tracker, gaze samples are taken in during spare frame time too
+    gaze_monitor = Single_Trial_Change_Detection.gaze_monitor
+    if gaze_monitor is not None:
+        Single_Trial_Change_Detection.idle_hooks.append(gaze_monitor.update)
+
+    def prefetch(index):
+        if index < len(schedule) and not (adaptive and schedule.block[index] > 0):
+            prefetcher.request(index, lambda: schedule.spec(index))
+
+    prefetch(0)
+
+    # With realtime set, every trial runs with the garbage collector off (see Realtime_Mode.py).
+    # Priority and CPU settings only reach this thread; the prefetch worker started above keeps its own.
+    realtime_mode = None
+    if realtime:
+        realtime_mode = Realtime_Mode.RealtimeMode(realtime_nice, realtime_fifo_priority, realtime_cpu)
+        for problem in realtime_mode.start():
+            print('Real-time mode: ' + problem)
+
+    # Whatever happens from here on (an error, or escape quitting), the idle hooks come off and
+    # the collector and process priority are put back
+    try:
+        # Creating structure of whole experiment
+        exp = data.ExperimentHandler(name='change_detection',
+                        version='0.1',
+                        extraInfo={'Participant_ID':study_info['Participant_ID'], 'Seed':session_seed},
+                        runtimeInfo=None,
+                        originPath=None,
+                        saveWideText=True,
+                        dataFileName=dataFileName)
+
+        # Every trial is also appended to a log as soon as it ends, so a crash or an early quit
+        # doesn't lose the session. Trial_Writer.py can rebuild the wide-text file from it.
+        trial_writer = Trial_Writer.TrialWriter(dataFileName + '_trials.jsonl')
+        atexit.register(trial_writer.close)
+
+        # Practice trials come from the schedule, which was built from cd_practice_conditions.csv
+        # If you want different numbers of stimuli to appear you will need to change the possiblities in this file
+        practice = data.TrialHandler(trialList=schedule.block_trials(0), nReps=1,name='practice',
+                         method='sequential')
+        practice.data.addDataType('choice')
+        practice.data.addDataType('accuracy')
+        practice.data.addDataType('rt')
+
+        exp.addLoop(practice)
+
+        # Showing instructions before practice
+        for image in instruction_images:
+            Single_Trial_Change_Detection.display_instructions(image)
+
+        Single_Trial_Change_Detection.display_text_instructions(instructions_text = practice_text)
+
+        # Running practice trials
+        # block_number is 0 for practice trials currently - starts at 1 for real trials
+        # (This shows up later in EEG code values.)
+        block_number = 0
+        for trial in practice:
+            bundle = prefetcher.take(trial['schedule_index'])
+            prefetch(trial['schedule_index'] + 1)
+            trial_spec = bundle.spec
+            if realtime_mode is not None:
+                realtime_mode.before_trial()
+            trial_data = Single_Trial_Change_Detection.run_trial(int(trial['number_of_stim']), int(trial['change']), block_number, practice.thisTrialN+1, trial_spec, bundle)
+            if realtime_mode is not None:
+                for name, value in realtime_mode.after_trial(trial_data[3]).items():
+                    practice.addData(name, value)  # Pauses and frame timing during the trial
+            practice.addData('choice', trial_data[0])
+            practice.addData('accuracy', trial_data[1])
+            practice.addData('rt', trial_data[2])
+            session_columns.add(trial_spec, trial_data[0], trial_data[1], trial_data[2])
+            for name, value in session_timeline.add(block_number, practice.thisTrialN+1, trial_data[3]).items():
+                practice.addData(name, value)  # Intended and actual phase durations, and dropped frames
+            if gaze_monitor is not None:
+                for name, value in gaze_monitor.trial_flags(trial_data[3]).items():
+                    practice.addData(name, value)  # Eye movements during encoding and retention
+            exp.nextEntry()
+            trial_writer.add(exp.entries[-1], Trial_Writer.wide_text_columns(exp))
+            trial_writer.write()  # Between trials, never during one
+
+        # Showing instructions after practice
+        Single_Trial_Change_Detection.fixation.setAutoDraw(False)
+        Single_Trial_Change_Detection.display_instructions(after_practice_image)
+        Single_Trial_Change_Detection.fixation.setAutoDraw(True)
+
+        # Creating block structure
+
+        block_loop=data.TrialHandler(trialList=[], nReps=3,name='block_loop',
+                         method='sequential')
+        exp.addLoop(block_loop)
+
+        # Creating trial structure for each block
+
+        block_number = 1  # Keep track of what block we're on so we can inform the user
+        for thisRep in block_loop:
+
+            # Trial conditions come from the schedule, which was built from cd_trial_conditions.csv
+            # If you want different numbers of stimuli to appear you will need to change the possiblities in this file
+            # n_reps in Session_Schedule.compile_session sets how many repetitions of the list of trial conditions you want per block,
+            # already shuffled in full random order.
+            # Currently 5 repetitions * 3 possible number_of_stim values * 2 for change/no change = 30 trials per block
+            if adaptive:
+                trial_list = [{}] * adaptive_trials_per_block  # Conditions are chosen as the block runs
+            else:
+                trial_list = schedule.block_trials(block_number)
+            trials = data.TrialHandler(trialList=trial_list, nReps=1, method='sequential', extraInfo={'Participant_ID':0,'year':0})
+            trials.data.addDataType('choice')
+            trials.data.addDataType('accuracy')
+            trials.data.addDataType('rt')
+
+            exp.addLoop(trials)
+
+            # Running trials
+            for trial in trials:
+                if adaptive:
+                    number_of_stim, change = procedure.next_design()
+                    trial_spec = Session_Schedule.compile_trial(session_seed, block_number, trials.thisN+1, number_of_stim, change,
+                        Single_Trial_Change_Detection.x_axis_limit, Single_Trial_Change_Detection.y_axis_limit,
+                        Single_Trial_Change_Detection.palette)
+                    adaptive_specs.append(trial_spec)
+                    trials.addData('number_of_stim', number_of_stim)
+                    trials.addData('change', change)
+                    bundle = None
+                else:
+                    bundle = prefetcher.take(trial['schedule_index'])
+                    prefetch(trial['schedule_index'] + 1)
+                    trial_spec = bundle.spec
+                if realtime_mode is not None:
+                    realtime_mode.before_trial()
+                trial_data = Single_Trial_Change_Detection.run_trial(trial_spec.set_size, trial_spec.change, block_number, trials.thisN+1, trial_spec, bundle)
+                if realtime_mode is not None:
+                    for name, value in realtime_mode.after_trial(trial_data[3]).items():
+                        trials.addData(name, value)  # Pauses and frame timing during the trial
+                trials.addData('choice', trial_data[0])
+                trials.addData('accuracy', trial_data[1])
+                trials.addData('rt', trial_data[2])
+                if adaptive:
+                    procedure.update(trial_spec.set_size, trial_spec.change, trial_data[0])
+                    estimate = procedure.estimate()
+                    for name, value in estimate.items():
+                        trials.addData(name, value)  # Running estimates of K and the guess rate
+                session_columns.add(trial_spec, trial_data[0], trial_data[1], trial_data[2])
+                for name, value in session_timeline.add(block_number, trials.thisN+1, trial_data[3]).items():
+                    trials.addData(name, value)  # Intended and actual phase durations, and dropped frames
+                if gaze_monitor is not None:
+                    for name, value in gaze_monitor.trial_flags(trial_data[3]).items():
+                        trials.addData(name, value)  # Eye movements during encoding and retention
+                exp.nextEntry()
+                trial_writer.add(exp.entries[-1], Trial_Writer.wide_text_columns(exp))
+                trial_writer.write()  # Between trials, never during one
+                if adaptive and adaptive_target_sd is not None and estimate['K_sd'] < adaptive_target_sd:
+                    exp.loopEnded(trials)  # As the handler would at its last trial, so later entries don't read it
+                    break
+
+            if block_number < 3:
+                Single_Trial_Change_Detection.display_end_of_block_screen(block_number)
+                block_number += 1
+            else:
+                Single_Trial_Change_Detection.display_end_of_experiment_screen()
+    finally:
+        Single_Trial_Change_Detection.idle_hooks.remove(prefetcher.prepare)
+        if gaze_monitor is not None:
+            Single_Trial_Change_Detection.idle_hooks.remove(gaze_monitor.update)
+        prefetcher.close()
+        if realtime_mode is not None:
+            realtime_mode.stop()
+
+    # Making sure the last codes have gone out before closing
+    if Single_Trial_Change_Detection.triggers is not None:
+        Single_Trial_Change_Detection.triggers.close()
+
+    session_timeline.save(dataFileName + '_timeline')
+    if adaptive:
+        Session_Schedule.SessionSchedule.from_specs(session_seed, adaptive_specs).save(dataFileName + '_adaptive_schedule.npz')
+    session_columns.save(dataFileName + '_columns')
+    trial_writer.close()
+
+    # Saving the ExperimentHandler's wide-text file now, so several sessions can run in one process
+    exp.close()
+    return dataFileName
+
+def main():
+    # Create a data folder to save files to
+    dataFolder = os.getcwd() + os.sep + 'data' + os.sep
+    if not os.path.exists(dataFolder):
+        os.makedirs(dataFolder)
+
+    # Decoding the instruction images while the dialog is up
+    Single_Trial_Change_Detection.preload_screens(default_instruction_images + [after_practice_image], [practice_text])
+
+    # Initial dialog box to collect info on study participant and year
+    # Seed 0 picks a new seed; entering a previous session's seed replays that session exactly
+    study_info = {'Participant_ID':0, 'Seed':0}
+    study_info_dialog = gui.DlgFromDict(dictionary=study_info, title='Change Detection')
+    if not study_info_dialog.OK:
+        core.quit()  # If you click "cancel" instead of "OK", closes program
+
+    open_fullscreen()
+
+    # Setting up serial port
+    # Make sure the value below is correct for our computers - may be D010 or 037F or 0278
+    # import serial
+    # port = serial.Serial('COM4')
+    # Codes are written by a background thread, 100ms apart, so trials never wait on the port
+    # Single_Trial_Change_Detection.triggers = EEG_Triggers.TriggerDispatcher(port, pulse_duration=0.1)
+
+    # Responses come from the keyboard by default. To use a serial button box instead, map the bytes
+    # it sends to the response keys:
+    # Single_Trial_Change_Detection.response_device = Response_Devices.SerialButtonBox(
+    #     serial.Serial('COM3', 115200, timeout=0.01), {1: '3', 2: '4'})
+
+    # To hold each trial until the participant looks at the fixation point, and flag eye movements,
+    # stream gaze samples (time on core.monotonicClock, pixels from the centre) from the tracker:
+    # import Gaze_Gating
+    # gaze_buffer = Gaze_Gating.GazeRingBuffer(60*1000)  # A minute at 1000 Hz
+    # Single_Trial_Change_Detection.gaze_monitor = Gaze_Gating.GazeMonitor(
+    #     Gaze_Gating.SocketTracker(('127.0.0.1', 5555), gaze_buffer), gaze_buffer,
+    #     radius=Single_Trial_Change_Detection.stim_size, rate=1000)
+
+    run_session(study_info, dataFolder)
+
+if __name__ == '__main__':
+    main()
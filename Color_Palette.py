@@ -0,0 +1,116 @@
+# ------------------------------------------------------------------------
+#  Colour palettes for the memory array
+#
+#  A palette is a fixed table of colours. The k colours of a trial are the
+#  first k entries of one random permutation of the table (so they are
+#  always distinct), and the changed probe colour is one draw from the
+#  other entries, so neither needs a retry loop.
+#
+#  The table is also kept converted to the window's colour space (see
+#  lookup), and stimuli are given rows of that, so PsychoPy has nothing to
+#  convert when a square is recoloured.
+#
+#  ColorWheel is the 360-degree colour wheel used by previous versions of
+#  the task: evenly spaced hues on a circle in CIELAB space, converted once
+#  to RGB when the wheel is made.
+
+import numpy as np
+
+palette_rng = np.random.default_rng()  # Used when no generator is passed in
+
+# From rgb255 to the PsychoPy colour spaces a table can be converted to
+conversions = {
+    'rgb': lambda colors: colors / 127.5 - 1,
+    'rgb1': lambda colors: colors / 255.0,
+    }
+
+class Palette:
+    def __init__(self, colors):
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)  # rgb255
+        self.colors.setflags(write=False)
+        self._converted = {'rgb255': self.colors}
+        self._index = {color: i for i, color in enumerate(map(tuple, self.colors.tolist()))}  # By rgb255 value
+
+    def __len__(self):
+        return len(self.colors)
+
+    def sample_indices(self, k, rng=None):
+        if rng is None:
+            rng = palette_rng
+        if k > len(self.colors):
+            raise ValueError('Set size %d needs more than the %d available colours' % (k, len(self.colors)))
+        return rng.permutation(len(self.colors))[:k]
+
+    def changed_index(self, current_index, rng=None):
+        # Any entry except current_index, in one draw
+        if rng is None:
+            rng = palette_rng
+        index = int(rng.integers(len(self.colors) - 1))
+        if index >= current_index:
+            index += 1
+        return index
+
+    def color(self, index, color_space='rgb255'):
+        return tuple(self.lookup(color_space)[index].tolist())
+
+    def lookup(self, color_space='rgb255'):
+        # The whole table in the stimuli's colour space, converted on first use only
+        if color_space not in self._converted:
+            converted = convert(self.colors, color_space)
+            converted.setflags(write=False)
+            self._converted[color_space] = converted
+        return self._converted[color_space]
+
+    def rows(self, colors, color_space='rgb255'):
+        # (n, 3) array of lookup(color_space) rows for rgb255 colours (as in a TrialSpec),
+        # found by value. Colours that aren't in the table are converted instead.
+        try:
+            indices = [self._index[tuple(color)] for color in colors]
+        except KeyError:
+            return convert(np.asarray(colors, dtype=np.uint8).reshape(-1, 3), color_space)
+        return self.lookup(color_space)[indices]
+
+class ColorWheel(Palette):
+    # n_steps hues on a circle of the given radius around center (a*, b*) at a fixed
+    # lightness L*, as in Zhang & Luck (2008). With min_change_steps the changed
+    # probe colour is at least that many steps around the wheel from the original.
+    def __init__(self, n_steps=360, lightness=70, center=(20, 38), radius=60, min_change_steps=1):
+        angles = np.deg2rad(np.arange(n_steps) * 360.0 / n_steps)
+        lab = np.stack([np.full(n_steps, float(lightness)),
+                        center[0] + radius*np.cos(angles),
+                        center[1] + radius*np.sin(angles)], axis=-1)
+        Palette.__init__(self, np.round(lab_to_rgb255(lab)))
+        self.min_change_steps = min_change_steps
+
+    def changed_index(self, current_index, rng=None):
+        if rng is None:
+            rng = palette_rng
+        n_steps = len(self.colors)
+        offset = int(rng.integers(self.min_change_steps, n_steps - self.min_change_steps + 1))
+        return (current_index + offset) % n_steps
+
+def convert(colors, color_space):
+    # rgb255 colours in another PsychoPy colour space
+    if color_space == 'rgb255':
+        return colors
+    if color_space not in conversions:
+        raise ValueError('Palette colours can be given in rgb255, %s, not %s'
+                         % (', '.join(sorted(conversions)), color_space))
+    return conversions[color_space](colors)
+
+def lab_to_rgb255(lab):
+    # CIELAB (D65 white) to gamma-encoded sRGB, clipped to the displayable range
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116
+    fx = fy + lab[..., 1] / 500
+    fz = fy - lab[..., 2] / 200
+    f = np.stack([fx, fy, fz], axis=-1)
+    xyz = np.where(f > 6/29, f**3, 3*(6/29)**2 * (f - 4/29))
+    xyz *= np.array([0.95047, 1.0, 1.08883])
+
+    to_linear_rgb = np.array([[3.2406, -1.5372, -0.4986],
+                              [-0.9689, 1.8758, 0.0415],
+                              [0.0557, -0.2040, 1.0570]])
+    linear = np.clip(xyz @ to_linear_rgb.T, 0, 1)
+    rgb = np.where(linear <= 0.0031308, 12.92*linear, 1.055*linear**(1/2.4) - 0.055)
+    return rgb * 255
@@ -0,0 +1,120 @@
+# ------------------------------------------------------------------------
+#  Conditions files as typed design matrices, and constrained shuffling
+#
+#  load_design() parses a conditions file (the CSVs given to
+#  data.importConditions) once into a NumPy structured array, with an
+#  integer column per factor, and caches it until the file changes.
+#
+#  constrained_order() returns a random order of the design's rows
+#  repeated n_reps times in which no factor repeats the same value more
+#  than max_run[factor] times in a row, e.g.
+#
+#      order = constrained_order(design, 5, rng, {'change': 3, 'number_of_stim': 3})
+#
+#  Shuffling the whole list and checking it gets slower exponentially as
+#  the list grows, because a long list almost never passes. Instead the
+#  order is built a chunk at a time: for each chunk a batch of candidate
+#  draws from the trials still left is made and checked at once (runs
+#  that cross from the previous chunk are counted), and the first that
+#  passes is kept. Each chunk passes with about the same probability, and
+#  while many trials are left candidates are drawn with replacement (the
+#  few that pick a trial twice are thrown away) so a chunk costs the same
+#  however many trials there are. The work grows about linearly with the
+#  number of trials. If the last trials
+#  left can't be ordered at all (e.g. they're all change trials) the
+#  order is started again, up to max_attempts times.
+
+import csv, functools, os
+import numpy as np
+
+max_attempts = 20
+chunk_size = 16
+first_batch = 32  # Candidates per chunk; doubled for a chunk while none pass
+max_batch = 4096
+
+@functools.lru_cache(maxsize=None)
+def _load_design(filename, mtime, size):
+    with open(filename, newline='') as conditions_file:
+        rows = list(csv.DictReader(conditions_file))
+    names = list(rows[0]) if rows else []
+    dtype = [(name, np.int64) for name in names]
+    design = np.array([tuple(int(float(row[name])) for name in names) for row in rows], dtype=dtype)
+    design.setflags(write=False)
+    return design
+
+def load_design(filename):
+    # Structured array with one int column per factor; cached until the file changes
+    info = os.stat(filename)
+    return _load_design(os.path.abspath(filename), info.st_mtime, info.st_size)
+
+def run_violations(codes, max_run, previous=None):
+    # codes is (n_candidates, length). True for each candidate with a value repeated more than
+    # max_run times in a row, counting the run that previous (the trials before it) ends with.
+    if previous is not None and len(previous):
+        codes = np.concatenate([np.broadcast_to(previous[-max_run:], (len(codes), min(len(previous), max_run))), codes], axis=1)
+    if codes.shape[1] <= max_run:
+        return np.zeros(len(codes), dtype=bool)
+    same = codes[:, 1:] == codes[:, :-1]
+    # max_run + 1 equal values in a row are max_run equal neighbours in a row
+    return np.lib.stride_tricks.sliding_window_view(same, max_run, axis=1).all(axis=2).any(axis=1)
+
+def draw_chunks(rng, n_left, chunk, batch):
+    # batch random ordered draws of chunk of the n_left trials, without replacement.
+    # Returns (picks, bad), with bad marking draws that can't be used.
+    if n_left > 2 * chunk * chunk:
+        # With this many trials left, drawing with replacement seldom picks one twice, and
+        # costs batch*chunk instead of batch*n_left; draws that did are marked bad
+        picks = rng.integers(n_left, size=(batch, chunk))
+        ordered = np.sort(picks, axis=1)
+        return picks, (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+    keys = rng.random((batch, n_left))
+    if chunk < n_left:
+        # The chunk's trials are the ones with the smallest keys, in key order
+        picks = np.argpartition(keys, chunk - 1, axis=1)[:, :chunk]
+        picks = np.take_along_axis(picks, np.argsort(np.take_along_axis(keys, picks, axis=1), axis=1), axis=1)
+    else:
+        picks = np.argsort(keys, axis=1)
+    return picks, np.zeros(batch, dtype=bool)
+
+def constrained_order(design, n_reps, rng, max_run=None):
+    # Row indices into design, each row n_reps times
+    n_rows = len(design)
+    trials = np.repeat(np.arange(n_rows), n_reps)
+    max_run = {name: limit for name, limit in (max_run or {}).items() if limit}
+    if not max_run:
+        return trials[rng.permutation(len(trials))]
+    factors = {name: np.asarray(design[name]) for name in max_run}
+
+    for attempt in range(max_attempts):
+        order = np.empty(0, dtype=np.int64)
+        left = trials
+        while len(left):
+            chunk = min(chunk_size, len(left))
+            batch = first_batch
+            while True:
+                picks, bad = draw_chunks(rng, len(left), chunk, batch)
+                candidates = left[picks]
+                for name, limit in max_run.items():
+                    codes = factors[name]
+                    bad |= run_violations(codes[candidates], limit, codes[order])
+                passing = np.flatnonzero(~bad)
+                if len(passing) or batch >= max_batch:
+                    break
+                batch *= 2
+            if not len(passing):
+                break  # Starting again
+            chosen = picks[passing[0]]
+            order = np.concatenate([order, left[chosen]])
+            left = np.delete(left, chosen)
+        else:
+            return order
+    raise ValueError('Could not order %d trials with runs of at most %s after %d attempts'
+                     % (len(trials), max_run, max_attempts))
+
+def max_runs(values):
+    # Longest run of equal values, e.g. for checking an order
+    values = np.asarray(values)
+    if len(values) == 0:
+        return 0
+    breaks = np.flatnonzero(values[1:] != values[:-1])
+    return int(np.diff(np.concatenate([[-1], breaks, [len(values) - 1]])).max())
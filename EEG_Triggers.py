@@ -0,0 +1,144 @@
+# ------------------------------------------------------------------------
+#  EEG trigger codes and a non-blocking dispatcher
+#
+#  TriggerDispatcher queues codes to a background thread that writes them
+#  to the serial port, keeping pulse_duration between codes (and writing an
+#  optional reset code after each pulse). send() never blocks, so the trial
+#  loop doesn't wait on serial I/O.
+#
+#  FakeSerialDevice is a pseudo-terminal stand-in for the trigger port. It
+#  records every byte that arrives with its arrival time, so the code
+#  sequence of a trial can be checked for order and spacing without lab
+#  hardware (Linux/macOS only).
+#
+#  Codes, as sent by run_trial for every block except practice (block 0):
+#    98            trial start
+#    200 + block   just before the stimuli appear
+#    100 + trial   just before the stimuli appear
+#    40 + n        stimuli appear (n = number of stimuli)
+#    50 + n        stimuli disappear, retention starts
+#    99            probe appears
+#    10 + choice   participant's choice (0 = no change, 1 = change, 2 = no answer)
+#    80 + accuracy whether the choice was correct
+
+import os, queue, threading, time
+
+TRIAL_START_CODE = 98
+PROBE_CODE = 99
+
+def block_code(block_number):
+    return 200 + block_number
+
+def trial_code(trial_number):
+    return 100 + trial_number
+
+def stim_number_code(stim_number):
+    return 40 + stim_number
+
+def retention_code(stim_number):
+    return 50 + stim_number
+
+def choice_code(choice_number):
+    return 10 + choice_number
+
+def accuracy_code(accuracy):
+    return 80 + accuracy
+
+def trial_codes(block_number, trial_number, stim_number, choice_number, accuracy):
+    # Every code of one trial, in the order they are sent
+    return [TRIAL_START_CODE, block_code(block_number), trial_code(trial_number),
+            stim_number_code(stim_number), retention_code(stim_number), PROBE_CODE,
+            choice_code(choice_number), accuracy_code(accuracy)]
+
+def code_bytes(code):
+    return int(code).to_bytes(length = 1, byteorder = "little")
+
+class TriggerDispatcher:
+    # port is anything with a write(bytes) method, e.g. serial.Serial('COM4')
+    def __init__(self, port, pulse_duration=0.1, reset_code=None, reset_delay=0.01):
+        self.port = port
+        self.pulse_duration = pulse_duration  # Minimum time between codes so each one goes through
+        self.reset_code = reset_code  # Written reset_delay after each code, for ports that need it
+        self.reset_delay = reset_delay
+        self.sent = []  # (code, time written) for every code, for checking after the session
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='TriggerDispatcher', daemon=True)
+        self._thread.start()
+
+    def send(self, code):
+        # Safe to call from win.callOnFlip; returns immediately
+        self._queue.put(code)
+
+    def _run(self):
+        last_sent = None
+        while True:
+            code = self._queue.get()
+            if code is None:
+                self._queue.task_done()
+                break
+            if last_sent is not None:
+                remaining = self.pulse_duration - (time.perf_counter() - last_sent)
+                if remaining > 0:
+                    time.sleep(remaining)
+            last_sent = time.perf_counter()
+            self.port.write(code_bytes(code))
+            self.sent.append((code, last_sent))
+            if self.reset_code is not None:
+                time.sleep(self.reset_delay)
+                self.port.write(code_bytes(self.reset_code))
+            self._queue.task_done()
+
+    def wait_until_sent(self):
+        self._queue.join()
+
+    def close(self):
+        # Sends whatever is still queued, then stops the writer thread
+        self._queue.put(None)
+        self._thread.join()
+
+class FakeSerialDevice:
+    # Open port_name with serial.Serial (or use write() directly) and every byte
+    # written ends up in received as (code, arrival time)
+    def __init__(self):
+        import tty
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)  # Pass bytes through untouched (no newline translation)
+        tty.setraw(self._master)
+        self.port_name = os.ttyname(self._slave)
+        self.received = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._read, name='FakeSerialDevice', daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        return os.write(self._slave, data)
+
+    def _read(self):
+        while not self._closed:
+            try:
+                data = os.read(self._master, 64)
+            except OSError:
+                break
+            arrived = time.perf_counter()
+            self.received.extend((code, arrived) for code in data)
+
+    def codes(self):
+        return [code for code, arrived in self.received]
+
+    def close(self):
+        self._closed = True
+        os.close(self._slave)
+        os.close(self._master)
+
+def check_sequence(received, expected_codes, min_spacing, tolerance=0.005):
+    # Compares (code, time) pairs with the expected codes. Returns a list of
+    # problems; an empty list means order and spacing are right.
+    problems = []
+    codes = [code for code, arrived in received]
+    if codes != list(expected_codes):
+        problems.append('expected codes %s, received %s' % (list(expected_codes), codes))
+    for (previous, previous_time), (code, arrived) in zip(received, received[1:]):
+        if arrived - previous_time < min_spacing - tolerance:
+            problems.append('code %d arrived %.1f ms after code %d (minimum %.1f ms)'
+                % (code, 1000*(arrived - previous_time), previous, 1000*min_spacing))
+    return problems
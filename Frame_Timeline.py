@@ -0,0 +1,84 @@
+# ------------------------------------------------------------------------
+#  Flip timestamps for each trial
+#
+#  TrialTimeline wraps win.flip() so every flip of a trial is recorded with
+#  the time it returned and its frame index (refreshes since the trial's
+#  first flip, so a dropped frame shows up as a skipped index). From these
+#  it works out how long each phase of the trial was actually on screen,
+#  compared with how long it was meant to be.
+#
+#  SessionTimeline collects every trial's flips and phase summaries and
+#  saves them as CSV next to the ExperimentHandler data file.
+
+import csv
+
+class TrialTimeline:
+    # phases is a list of (phase name, start event, end event, intended duration in s)
+    def __init__(self, phases, frame_duration):
+        self.phases = phases
+        self.frame_duration = frame_duration
+        self.events = {}  # Event name -> time
+        self.flips = []  # (event name, flip time, frame index)
+
+    def mark(self, name, time):
+        # For events that aren't flips, e.g. the start of the fixation period
+        self.events[name] = time
+
+    def flip(self, win, name=None):
+        # name is given for flips that start something (e.g. 'stimuli'); other flips
+        # are still logged so dropped frames within a phase are caught
+        flip_time = win.flip()
+        if self.flips:
+            previous_time, previous_frame = self.flips[-1][1], self.flips[-1][2]
+            frame_index = previous_frame + max(1, int(round((flip_time - previous_time) / self.frame_duration)))
+        else:
+            frame_index = 0
+        self.flips.append((name or '', flip_time, frame_index))
+        if name is not None:
+            self.events[name] = flip_time
+        return flip_time
+
+    def phase_summary(self):
+        # {phase_intended, phase_actual, phase_dropped} for every phase whose events happened.
+        # Dropped frames are refreshes the phase ran over its intended length.
+        summary = {}
+        for phase, start, end, intended in self.phases:
+            if start not in self.events or end not in self.events:
+                continue
+            actual = self.events[end] - self.events[start]
+            dropped = int(round(actual / self.frame_duration)) - int(round(intended / self.frame_duration))
+            summary[phase + '_intended'] = intended
+            summary[phase + '_actual'] = actual
+            summary[phase + '_dropped'] = max(0, dropped)
+        return summary
+
+class SessionTimeline:
+    def __init__(self):
+        self.flip_rows = []
+        self.phase_rows = []
+
+    def add(self, block_number, trial_number, timeline):
+        # Returns the trial's phase summary, e.g. to add to the TrialHandler as well
+        for name, flip_time, frame_index in timeline.flips:
+            self.flip_rows.append({'block': block_number, 'trial': trial_number, 'event': name,
+                                   'flip_time': flip_time, 'frame_index': frame_index})
+        summary = timeline.phase_summary()
+        row = {'block': block_number, 'trial': trial_number}
+        row.update(summary)
+        row['any_dropped'] = int(any(summary[key] > 0 for key in summary if key.endswith('_dropped')))
+        self.phase_rows.append(row)
+        return summary
+
+    def save(self, file_stem):
+        # Writes file_stem_flips.csv and file_stem_phases.csv
+        _write_rows(file_stem + '_flips.csv', self.flip_rows)
+        _write_rows(file_stem + '_phases.csv', self.phase_rows)
+
+def _write_rows(filename, rows):
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    with open(filename, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,253 @@
+# ------------------------------------------------------------------------
+#  Gaze-contingent fixation gating
+#
+#  Gaze samples (time, x, y) go into a fixed-size ring buffer as they
+#  arrive. Times are on core.monotonicClock, like flip times, and x and y
+#  are in pixels from the centre of the screen with y up, like stimulus
+#  positions; lost samples (e.g. blinks) have NaN x and y.
+#
+#  Samples come from a tracker object with poll() and close():
+#    ReplayTracker   plays back a recording (an (n, 3) array, .npy or .csv
+#                    file) as if it were arriving now; poll() moves every
+#                    sample that's due into the buffer
+#    SocketTracker   reads little-endian float64 (t, x, y) records from a
+#                    socket on a background thread, e.g. from a tracker
+#                    bridge or from serve_replay(), which stamps a recording
+#                    with the clock it is given
+#
+#  GazeMonitor works on whole slices of the buffer at once:
+#    fixating()      gaze has stayed inside radius, with no saccade and no
+#                    lost samples, for the last gate_duration; run_trial
+#                    holds the trial on the fixation point until it has
+#    interval_flags  velocity-threshold (I-VT) saccades, time outside
+#                    radius and lost samples in a time range; trial_flags()
+#                    does this for encoding and retention from a trial's
+#                    Frame_Timeline events
+#  Samples are written to the buffer in blocks and read as slices, so the
+#  per-frame cost is a few array operations however fast the tracker runs.
+
+import csv, socket, threading, time
+import numpy as np
+
+def load_samples(filename):
+    # (n, 3) float array of time, x, y from .npy or from .csv with t, x, y columns
+    if filename.endswith('.npy'):
+        return np.load(filename).astype(float)
+    with open(filename, newline='') as samples_file:
+        rows = [(row['t'], row['x'], row['y']) for row in csv.DictReader(samples_file)]
+    return np.array(rows, dtype=float).reshape(-1, 3)
+
+class GazeRingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.full((capacity, 3), np.nan)
+        self.n_written = 0
+        self._lock = threading.Lock()  # SocketTracker writes from its own thread
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        with self._lock:
+            start = self.n_written % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = samples[:first]
+            self.data[:n - first] = samples[first:]
+            self.n_written += n
+
+    def between(self, t0, t1):
+        # Copy of the samples with t0 <= t < t1, oldest first
+        with self._lock:
+            if self.n_written < self.capacity:
+                segments = [self.data[:self.n_written]]
+            else:
+                end = self.n_written % self.capacity
+                segments = [self.data[end:], self.data[:end]]
+            parts = []
+            for segment in segments:  # Each one is in time order
+                i0, i1 = np.searchsorted(segment[:, 0], [t0, t1])
+                parts.append(segment[i0:i1])
+            return np.concatenate(parts)
+
+class ReplayTracker:
+    def __init__(self, samples, buffer, get_time, loop=True):
+        samples = np.asarray(samples, dtype=float)
+        self.times = samples[:, 0] - samples[0, 0]
+        self.positions = samples[:, 1:]
+        self.period = self.times[-1] + np.median(np.diff(self.times))  # Length of one pass when looping
+        self.buffer = buffer
+        self.get_time = get_time
+        self.loop = loop
+        self.start_time = get_time()
+        self.n_sent = 0
+
+    def poll(self):
+        elapsed = self.get_time() - self.start_time
+        n = len(self.times)
+        passes, within = divmod(elapsed, self.period)
+        if not self.loop and passes > 0:
+            due = n
+        else:
+            due = int(passes)*n + int(np.searchsorted(self.times, within, side='right'))
+        self.n_sent = max(self.n_sent, due - self.buffer.capacity)  # Older ones wouldn't fit after a long gap
+        if due > self.n_sent:
+            sent = np.arange(self.n_sent, due)
+            block = np.empty((len(sent), 3))
+            block[:, 0] = self.start_time + self.times[sent % n] + (sent // n)*self.period
+            block[:, 1:] = self.positions[sent % n]
+            self.buffer.write(block)
+            self.n_sent = due
+
+    def close(self):
+        pass
+
+class SocketTracker:
+    record_size = 24  # Three little-endian float64s
+
+    def __init__(self, address, buffer, chunk_records=256):
+        self.buffer = buffer
+        self.socket = socket.create_connection(address)
+        self._raw = bytearray(chunk_records * self.record_size)
+        self._running = True
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        view = memoryview(self._raw)
+        pending = 0
+        while self._running:
+            try:
+                n = self.socket.recv_into(view[pending:])
+            except OSError:
+                break
+            if n == 0:
+                break
+            pending += n
+            whole = pending - pending % self.record_size
+            if whole:
+                self.buffer.write(np.frombuffer(self._raw, '<f8', whole // 8).reshape(-1, 3))
+                view[:pending - whole] = view[whole:pending]
+                pending -= whole
+
+    def poll(self):
+        pass  # Samples arrive on the reading thread
+
+    def close(self):
+        self._running = False
+        self.socket.close()
+
+def serve_replay(samples, get_time, host='127.0.0.1', port=0, chunk_duration=0.002):
+    # Streams a recording to the first client that connects, in real time and stamped
+    # with get_time, as a SocketTracker would get it from a tracker. Returns the address.
+    # get_time has to be the clock the GazeMonitor is asked about, core.monotonicClock.getTime
+    # in a session; time.perf_counter is offset from it by when PsychoPy was imported.
+    samples = np.asarray(samples, dtype=float)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((host, port))
+    server.listen(1)
+
+    def send():
+        connection, _ = server.accept()
+        times = samples[:, 0] - samples[0, 0]
+        start = get_time()
+        sent = 0
+        try:
+            while sent < len(samples):
+                due = int(np.searchsorted(times, get_time() - start, side='right'))
+                if due > sent:
+                    block = samples[sent:due].copy()
+                    block[:, 0] = start + times[sent:due]
+                    connection.sendall(block.astype('<f8').tobytes())
+                    sent = due
+                time.sleep(chunk_duration)
+        except OSError:
+            pass
+        connection.close()
+        server.close()
+
+    threading.Thread(target=send, daemon=True).start()
+    return server.getsockname()
+
+def saccade_samples(samples, pixels_per_degree, velocity_threshold, span=1):
+    # True for each sample reached faster than velocity_threshold (degrees/s) from the one span
+    # samples before. A span of a few ms keeps tracker noise at high sampling rates from
+    # looking like eye movement.
+    fast = np.zeros(len(samples), dtype=bool)
+    if len(samples) <= span:
+        return fast
+    dt = samples[span:, 0] - samples[:-span, 0]
+    distance = np.hypot(samples[span:, 1] - samples[:-span, 1], samples[span:, 2] - samples[:-span, 2]) / pixels_per_degree
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fast[span:] = distance / dt > velocity_threshold
+    return fast
+
+def synthetic_gaze(duration, rate=1000.0, rng=None, noise=0.5, saccade_rate=0.2, amplitude=200.0,
+                   saccade_duration=0.04, dwell=0.3, start_time=0.0):
+    # A stand-in recording: fixation jitter at the centre, with saccades out to amplitude
+    # pixels at saccade_rate per second, each followed by dwell s away and a saccade back
+    rng = rng if rng is not None else np.random.default_rng()
+    t = start_time + np.arange(int(duration * rate)) / rate
+    xy = rng.normal(0, noise, (len(t), 2))
+    for onset in np.sort(rng.uniform(0, duration, rng.poisson(saccade_rate * duration))):
+        angle = rng.uniform(0, 2*np.pi)
+        target = amplitude * np.array([np.cos(angle), np.sin(angle)])
+        out = np.clip((t - start_time - onset) / saccade_duration, 0, 1)
+        back = np.clip((t - start_time - onset - saccade_duration - dwell) / saccade_duration, 0, 1)
+        xy += ((out - back)[:, None]) * target
+    return np.column_stack([t, xy])
+
+class GazeMonitor:
+    # radius is in pixels; pixels_per_degree depends on the monitor and viewing distance
+    # (about 40 for a 53 cm wide 1920 pixel screen at 60 cm)
+    def __init__(self, tracker, buffer, radius, pixels_per_degree=40.0, velocity_threshold=30.0,
+                 gate_duration=0.3, gate_timeout=5.0, rate=1000.0, velocity_window=0.006):
+        self.tracker = tracker
+        self.buffer = buffer
+        self.radius = radius
+        self.pixels_per_degree = pixels_per_degree
+        self.velocity_threshold = velocity_threshold
+        self.gate_duration = gate_duration
+        self.gate_timeout = gate_timeout  # run_trial starts anyway after this long, and flags it
+        self.rate = rate
+        self.span = max(1, int(round(velocity_window * rate)))  # Samples between velocity measurements
+        self.min_coverage = 0.8  # Share of the expected samples that must have arrived
+
+    def update(self, deadline=None):
+        # Idle hook: moves new samples into the buffer
+        self.tracker.poll()
+
+    def fixating(self, now):
+        self.update()
+        samples = self.buffer.between(now - self.gate_duration, np.inf)
+        if len(samples) < self.min_coverage * self.gate_duration * self.rate:
+            return False
+        x, y = samples[:, 1], samples[:, 2]
+        inside = x*x + y*y <= self.radius**2  # False for lost samples too
+        return bool(inside.all()) and not saccade_samples(samples, self.pixels_per_degree,
+                                                          self.velocity_threshold, self.span).any()
+
+    def interval_flags(self, t0, t1):
+        samples = self.buffer.between(t0, t1)
+        lost = np.isnan(samples[:, 1]) | np.isnan(samples[:, 2])
+        distance = np.hypot(samples[:, 1], samples[:, 2])
+        expected = max((t1 - t0) * self.rate, 1)
+        return {'saccade': int(saccade_samples(samples, self.pixels_per_degree, self.velocity_threshold, self.span).any()),
+                'outside': int((distance[~lost] > self.radius).any()),
+                'max_deviation': float(distance[~lost].max()) if (~lost).any() else float('nan'),
+                'lost': float(lost.sum() + max(expected - len(samples), 0)) / expected}
+
+    def trial_flags(self, timeline):
+        # gaze_<phase>_<flag> for encoding and retention, and how the gate went
+        self.update()
+        events = timeline.events
+        flags = {}
+        for phase, start, end in [('encoding', 'stimuli', 'retention'), ('retention', 'retention', 'probe')]:
+            if start in events and end in events:
+                for name, value in self.interval_flags(events[start], events[end]).items():
+                    flags['gaze_%s_%s' % (phase, name)] = value
+        if 'gate_start' in events and 'trial_start' in events:
+            flags['gaze_gate_wait'] = events['trial_start'] - events['gate_start']
+        flags['gaze_gate_timeout'] = int('gate_timeout' in events)
+        return flags
+
+    def close(self):
+        self.tracker.close()
@@ -0,0 +1,217 @@
+# ------------------------------------------------------------------------
+#  Headless sessions with a simulated observer
+#
+#  Runs the real session flow in Change_Detection.run_session (practice
+#  loop, blocks, run_trial, data files) without a display, dialog or
+#  participant. Drawing goes to stand-in stimuli, and time is virtual: each
+#  flip moves a virtual clock on by one frame, and waits move it on
+#  without sleeping, unless speedup asks for a scaled-down real pace.
+#
+#  Responses come from KSlotObserver: on each trial it holds min(K, N) of
+#  the N items, answers correctly when the probed item is one of them,
+#  otherwise guesses "change" at guess_rate, and responds after an
+#  ex-Gaussian RT.
+#
+#  Because waits cost nothing, the wall time of each run_trial call is the
+#  code's own per-trial overhead, which is reported for every session.
+#
+#  PsychoPy is still imported (Single_Trial_Change_Detection imports
+#  psychopy.visual and event), and pyglet needs an X display for that
+#  unless it runs headless. PYGLET_HEADLESS is set to 1 before the first
+#  PsychoPy import, so no display is needed; set it to 0 beforehand to
+#  keep pyglet's normal display.
+#
+#      python Headless_Session.py --sessions 100 --data-folder simulated_data --k 3
+
+import argparse, os, time
+os.environ.setdefault('PYGLET_HEADLESS', '1')  # Before anything imports PsychoPy (and with it pyglet)
+import numpy as np
+import Single_Trial_Change_Detection
+import Change_Detection
+import Response_Devices
+
+class VirtualClock:
+    # Stands in for core.monotonicClock
+    def __init__(self, speedup=None):
+        self.now = 0.0
+        self.speedup = speedup  # None runs as fast as possible, e.g. 10 runs ten times faster than real time
+
+    def getTime(self):
+        return self.now
+
+    def getLastResetTime(self):
+        return 0.0
+
+    def advance(self, seconds):
+        self.now += seconds
+        if self.speedup:
+            time.sleep(seconds / self.speedup)
+
+class HeadlessCore:
+    # The parts of psychopy.core that Single_Trial_Change_Detection uses
+    def __init__(self, clock):
+        self.monotonicClock = clock
+
+    def getTime(self):
+        return self.monotonicClock.getTime()
+
+    def wait(self, seconds, hogCPUperiod=0):
+        self.monotonicClock.advance(seconds)
+
+    def quit(self):
+        raise SystemExit
+
+class HeadlessStim:
+    # Accepts any stimulus arguments and draws nothing
+    def __init__(self, win=None, **kwargs):
+        self.__dict__.update(kwargs)
+        self.autoDraw = False
+        self.n_draws = 0
+
+    def draw(self):
+        self.n_draws += 1
+
+    def setAutoDraw(self, value):
+        self.autoDraw = value
+
+class HeadlessVisual:
+    Rect = Circle = TextStim = ImageStim = SimpleImageStim = ElementArrayStim = HeadlessStim
+
+class HeadlessWindowHandle:
+    def minimize(self): pass
+    def maximize(self): pass
+    def activate(self): pass
+    def set_mouse_position(self, x, y): pass
+
+class HeadlessWindow:
+    def __init__(self, clock, size=(1920, 1080), frame_rate=60.0):
+        self.clock = clock
+        self.size = np.array(size)
+        self.monitorFramePeriod = 1.0 / frame_rate
+        self.colorSpace = 'rgb'  # PsychoPy's default
+        self.fullscr = False
+        self.winHandle = HeadlessWindowHandle()
+        self.n_flips = 0
+        self._on_flip = []
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+    def flip(self):
+        self.clock.advance(self.monitorFramePeriod)
+        self.n_flips += 1
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args, kwargs in on_flip:
+            function(*args, **kwargs)
+        return self.clock.getTime()
+
+    def close(self):
+        pass
+
+class HeadlessMouse:
+    def __init__(self, *args, **kwargs): pass
+    def setVisible(self, visible): pass
+
+class HeadlessEvent:
+    # Instruction and break screens continue straight away
+    Mouse = HeadlessMouse
+
+    def waitKeys(self, **kwargs):
+        return ['space']
+
+    def clearEvents(self):
+        pass
+
+    def getKeys(self, **kwargs):
+        return []
+
+class KSlotObserver(Response_Devices.SimulatedDevice):
+    # Decides its response when the probe appears (the device is cleared on the probe's flip)
+    def __init__(self, get_time, k=3.0, guess_rate=0.5, lapse_rate=0.02,
+                 rt_mu=0.55, rt_sigma=0.08, rt_tau=0.15, max_rt=2.0, rng=None):
+        Response_Devices.SimulatedDevice.__init__(self, get_time)
+        self.k = k
+        self.guess_rate = guess_rate
+        self.lapse_rate = lapse_rate  # Trials with no response
+        self.rt_mu, self.rt_sigma, self.rt_tau = rt_mu, rt_sigma, rt_tau
+        self.max_rt = max_rt
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.trial = None
+
+    def next_trial(self, stim_number, is_changed):
+        self.trial = (stim_number, is_changed)
+
+    def clear(self):
+        Response_Devices.SimulatedDevice.clear(self)
+        if self.trial is None:
+            return
+        stim_number, is_changed = self.trial
+        self.trial = None
+        if self.rng.random() < self.lapse_rate:
+            return
+        if self.rng.random() < min(1.0, self.k / stim_number):
+            said_change = bool(is_changed)
+        else:
+            said_change = self.rng.random() < self.guess_rate
+        rt = self.rt_mu + self.rt_sigma*self.rng.standard_normal() + self.rng.exponential(self.rt_tau)
+        if 0 < rt < self.max_rt:
+            self.press('4' if said_change else '3', self.get_time() + rt)
+
+def setup_headless(speedup=None, size=(1920, 1080), frame_rate=60.0, observer_options=None, seed=None):
+    # Points Single_Trial_Change_Detection at the stand-ins and returns (window, observer)
+    clock = VirtualClock(speedup)
+    Single_Trial_Change_Detection.core = HeadlessCore(clock)
+    Single_Trial_Change_Detection.visual = HeadlessVisual()
+    Single_Trial_Change_Detection.event = HeadlessEvent()
+    window = HeadlessWindow(clock, size, frame_rate)
+    observer = KSlotObserver(clock.getTime, rng=np.random.default_rng(seed), **(observer_options or {}))
+    Single_Trial_Change_Detection.setup_display(window, observer)
+    return window, observer
+
+def run_headless_session(participant_id, seed, data_folder, observer, instruction_images=()):
+    # Runs one full session; returns the data file name and the wall time of every run_trial call
+    real_run_trial = Single_Trial_Change_Detection.run_trial
+    overheads = []
+
+    def observed_run_trial(trial_stim_number, is_changed, *args, **kwargs):
+        observer.next_trial(trial_stim_number, is_changed)
+        started = time.perf_counter()
+        result = real_run_trial(trial_stim_number, is_changed, *args, **kwargs)
+        overheads.append(time.perf_counter() - started)
+        return result
+
+    Single_Trial_Change_Detection.run_trial = observed_run_trial
+    try:
+        data_file_name = Change_Detection.run_session({'Participant_ID': participant_id, 'Seed': seed},
+                                                      data_folder, list(instruction_images))
+    finally:
+        Single_Trial_Change_Detection.run_trial = real_run_trial
+    return data_file_name, np.array(overheads)
+
+def overhead_summary(overheads, n_flips):
+    return {'trials': len(overheads), 'flips': n_flips,
+            'median_ms': 1000*float(np.median(overheads)),
+            'p95_ms': 1000*float(np.percentile(overheads, 95)),
+            'max_ms': 1000*float(np.max(overheads)),
+            'per_flip_us': 1e6*float(np.sum(overheads)) / max(n_flips, 1)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run change detection sessions with a simulated observer.')
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--data-folder', default='simulated_data')
+    parser.add_argument('--first-id', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1, help='session i uses seed + i')
+    parser.add_argument('--k', type=float, default=3.0)
+    parser.add_argument('--guess-rate', type=float, default=0.5)
+    parser.add_argument('--speedup', type=float, default=None, help='run at this multiple of real time instead of flat out')
+    args = parser.parse_args()
+
+    window, observer = setup_headless(args.speedup, seed=args.seed,
+                                      observer_options={'k': args.k, 'guess_rate': args.guess_rate})
+    for i in range(args.sessions):
+        flips_before = window.n_flips
+        data_file_name, overheads = run_headless_session(args.first_id + i, args.seed + i, args.data_folder, observer)
+        summary = overhead_summary(overheads, window.n_flips - flips_before)
+        print('%s: %d trials, median %.2f ms, p95 %.2f ms, max %.2f ms per trial, %.1f us per flip'
+              % (data_file_name, summary['trials'], summary['median_ms'], summary['p95_ms'],
+                 summary['max_ms'], summary['per_flip_us']))
@@ -0,0 +1,143 @@
+# ------------------------------------------------------------------------
+#  Offline rendering of logged trials
+#
+#  Redraws what the participant saw on each trial from a session's column
+#  folder (see Session_Columns), without a display or GPU:
+#    block<b>_trial<ttt>_memory.png   the memory array with the fixation point
+#    block<b>_trial<ttt>_probe.png    the first square, in the probe colour on
+#                                     change trials, with the '?' marker
+#  e.g. block1_trial007_memory.png (trial numbers are zero padded to 3 digits)
+#
+#  Geometry follows Single_Trial_Change_Detection: positions are in pixels
+#  from the centre of the screen with y up, squares are stim_size wide with
+#  no outline, the fixation point is a black circle of radius 6 and the
+#  probe marker is a black '?' 20 pixels high, on the window's grey.
+#  Screen size isn't logged, so it defaults to the lab's 1920x1080.
+#
+#  Images are drawn with PIL. Trials are split into chunks across a process
+#  pool, and each worker reads the memory-mapped columns itself.
+#
+#      python Offline_Renderer.py data renders             # every session in data/ID_*
+#      python Offline_Renderer.py data/ID_1/1_Change_Detection_<date>_columns renders
+
+import argparse, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+import Bilateral_Positions
+import Session_Columns
+
+screen_size = (1920, 1080)
+background_color = (128, 128, 128)  # PsychoPy's default window colour, [0, 0, 0] in rgb
+stim_size = Bilateral_Positions.stim_size
+fixation_radius = 6
+probe_marker_height = 20
+probe_marker_fonts = ['OpenSans-Regular.ttf', 'DejaVuSans.ttf', 'Arial.ttf', 'arial.ttf']
+render_columns = ['block', 'trial', 'set_size', 'change', 'positions', 'colors', 'probe_color']
+
+def load_marker_font(height=probe_marker_height):
+    for name in probe_marker_fonts:
+        try:
+            return ImageFont.truetype(name, height)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(height)
+    except TypeError:  # Pillow before 10.1 has one fixed-size default font
+        return ImageFont.load_default()
+
+def to_image_xy(pos, size):
+    # From pixels around the screen centre with y up to image pixels with y down
+    return size[0] / 2.0 + pos[0], size[1] / 2.0 - pos[1]
+
+def draw_square(draw, pos, color, size):
+    x, y = to_image_xy(pos, size)
+    half = stim_size / 2.0
+    draw.rectangle([x - half, y - half, x + half - 1, y + half - 1], fill=tuple(color))
+
+def blank_screen(size, with_fixation):
+    image = Image.new('RGB', size, background_color)
+    if with_fixation:
+        x, y = to_image_xy((0, 0), size)
+        ImageDraw.Draw(image).ellipse([x - fixation_radius, y - fixation_radius,
+                                       x + fixation_radius, y + fixation_radius], fill=(0, 0, 0))
+    return image
+
+def render_memory(blank, positions, colors, set_size):
+    image = blank.copy()
+    draw = ImageDraw.Draw(image)
+    for i in range(set_size):
+        draw_square(draw, positions[i], colors[i], image.size)
+    return image
+
+def render_probe(blank, position, color, font):
+    image = blank.copy()
+    draw = ImageDraw.Draw(image)
+    draw_square(draw, position, color, image.size)
+    draw.text(to_image_xy((0, 0), image.size), '?', fill=(0, 0, 0), font=font, anchor='mm')
+    return image
+
+def trial_stem(block, trial):
+    return 'block%d_trial%03d' % (block, trial)
+
+def render_rows(column_folder, output_folder, rows, size=screen_size, compress_level=1):
+    # Worker: renders the given rows of one session. Returns the number of images written.
+    columns = Session_Columns.load_columns(column_folder, render_columns)
+    memory_blank = blank_screen(size, with_fixation=True)
+    probe_blank = blank_screen(size, with_fixation=False)  # The '?' replaces the fixation point
+    font = load_marker_font()
+    for i in rows:
+        set_size = int(columns['set_size'][i])
+        positions = columns['positions'][i].tolist()
+        colors = columns['colors'][i].tolist()
+        # Same rule as run_trial: the first square changes colour only on change trials
+        probe_color = columns['probe_color'][i].tolist() if columns['change'][i] else colors[0]
+        stem = os.path.join(output_folder, trial_stem(int(columns['block'][i]), int(columns['trial'][i])))
+        render_memory(memory_blank, positions, colors, set_size).save(stem + '_memory.png', compress_level=compress_level)
+        render_probe(probe_blank, positions[0], probe_color, font).save(stem + '_probe.png', compress_level=compress_level)
+    return 2 * len(rows)
+
+def session_jobs(column_folder, output_folder, chunk_size):
+    n_trials = Session_Columns.read_description(column_folder)['n_trials']
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    return [(column_folder, output_folder, list(range(start, min(start + chunk_size, n_trials))))
+            for start in range(0, n_trials, chunk_size)]
+
+def output_folder_for(column_folder, output_root):
+    # renders/ID_1/1_Change_Detection_<date>/ for data/ID_1/1_Change_Detection_<date>_columns
+    session = os.path.basename(os.path.normpath(column_folder))
+    if session.endswith('_columns'):
+        session = session[:-len('_columns')]
+    participant = os.path.basename(os.path.dirname(os.path.normpath(column_folder)))
+    return os.path.join(output_root, participant, session)
+
+def render_sessions(column_folders, output_root, workers=None, chunk_size=16, size=screen_size):
+    # Returns the number of images written
+    jobs = []
+    for column_folder in column_folders:
+        jobs += session_jobs(column_folder, output_folder_for(column_folder, output_root), chunk_size)
+    if not jobs:
+        return 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_rows, column_folder, output_folder, rows, size)
+                   for column_folder, output_folder, rows in jobs]
+        return sum(future.result() for future in futures)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render logged trials to PNG images.')
+    parser.add_argument('source', help='a data folder (every session under ID_*) or one session\'s _columns folder')
+    parser.add_argument('output', help='folder for the images')
+    parser.add_argument('--size', default='%dx%d' % screen_size, help='screen size in pixels, WIDTHxHEIGHT')
+    parser.add_argument('--workers', type=int, default=None, help='processes to use (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, default=16, help='trials per job')
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.source, 'columns.json')):
+        column_folders = [args.source]
+    else:
+        column_folders = Session_Columns.find_sessions(args.source)
+    if not column_folders:
+        sys.exit('No session columns found in ' + args.source)
+    size = tuple(int(value) for value in args.size.lower().split('x'))
+    n_images = render_sessions(column_folders, args.output, args.workers, args.chunk_size, size)
+    print('%d images from %d sessions in %s' % (n_images, len(column_folders), args.output))
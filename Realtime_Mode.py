@@ -0,0 +1,133 @@
+# ------------------------------------------------------------------------
+#  Real-time session mode
+#
+#  Keeps Python and the OS from pausing the process in the middle of a
+#  trial, and measures how well that worked:
+#    - automatic garbage collection is off while a trial runs, and a full
+#      collection is made just before each trial instead. Everything alive
+#      when the session starts (PsychoPy, the window, the schedule) is
+#      moved out of the collector's way with gc.freeze(), so those
+#      collections only look at what the session has made since.
+#    - optionally (Linux) the main thread gets a higher priority, either a
+#      lower nice value or the SCHED_FIFO real-time policy, and is pinned
+#      to one CPU. These need root or CAP_SYS_NICE; if the OS refuses, the
+#      session runs without them and says so. On Linux they are per thread:
+#      they apply to the thread that calls start(), and to threads it starts
+#      afterwards, but not to threads already running. Change_Detection
+#      calls start() after the trigger dispatcher, the gaze reader and the
+#      prefetch worker are up, so those keep the normal priority and can
+#      run on any CPU, and stay out of the trial thread's way.
+#  after_trial() returns, for the data file:
+#    realtime_collect_ms      the collection before the trial
+#    realtime_gc_count/_ms    collections during the trial anyway (should be 0)
+#    realtime_preempted       times the OS switched the main thread out
+#                             involuntarily during the trial
+#    realtime_page_faults     major page faults during the trial (waiting on disk)
+#    realtime_frame_sd_ms     SD of the time between consecutive flips
+#    realtime_frame_max_ms    longest time between flips
+#    realtime_missed_frames   refreshes with no flip, from the trial's Frame_Timeline
+#
+#  Change_Detection wraps every trial in before_trial() and after_trial()
+#  when realtime is set.
+
+import gc, os, sys, time
+import numpy as np
+
+try:
+    import resource
+    usage_scope = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)  # Main thread only, on Linux
+except ImportError:  # Windows
+    resource = None
+
+class RealtimeMode:
+    def __init__(self, nice=None, fifo_priority=None, cpu=None):
+        # nice is a nice value (e.g. -10); fifo_priority (1-99) uses SCHED_FIFO instead;
+        # cpu is the CPU to pin the calling thread to
+        self.nice = nice
+        self.fifo_priority = fifo_priority
+        self.cpu = cpu
+        self.problems = []  # Settings the OS refused, as messages
+        self._saved = {}
+        self._gc_started = None
+        self._gc_pauses = []
+        self._started = False
+
+    def start(self):
+        # Call from the thread that runs the trials once the session is set up, before the
+        # first trial; the priority and CPU settings only reach that thread (see above)
+        if sys.platform.startswith('linux'):
+            if self.cpu is not None:
+                self._apply('affinity', os.sched_getaffinity(0),
+                            lambda: os.sched_setaffinity(0, {self.cpu}), 'pin to CPU %s' % self.cpu)
+            if self.fifo_priority is not None:
+                self._apply('scheduler', (os.sched_getscheduler(0), os.sched_getparam(0)),
+                            lambda: os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.fifo_priority)),
+                            'use SCHED_FIFO priority %s' % self.fifo_priority)
+            elif self.nice is not None:
+                self._apply('nice', os.getpriority(os.PRIO_PROCESS, 0),
+                            lambda: os.setpriority(os.PRIO_PROCESS, 0, self.nice), 'set nice %s' % self.nice)
+        elif self.cpu is not None or self.fifo_priority is not None or self.nice is not None:
+            self.problems.append('priority and CPU settings are only made on Linux')
+        gc.collect()
+        gc.freeze()
+        gc.callbacks.append(self._on_gc)
+        self._started = True
+        return self.problems
+
+    def _apply(self, name, previous, change, description):
+        try:
+            change()
+        except (OSError, ValueError) as error:
+            self.problems.append('could not %s: %s' % (description, error))
+        else:
+            self._saved[name] = previous
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self._gc_pauses.append(time.perf_counter() - self._gc_started)
+            self._gc_started = None
+
+    def before_trial(self):
+        # Collecting now, between trials, then keeping the collector off until after_trial()
+        started = time.perf_counter()
+        gc.collect()
+        self._collect_time = time.perf_counter() - started
+        self._gc_pauses = []
+        gc.disable()
+        self._usage = resource.getrusage(usage_scope) if resource else None
+
+    def after_trial(self, timeline):
+        # Pause and flip timing stats for the trial, for addData
+        usage = resource.getrusage(usage_scope) if resource else None
+        gc.enable()
+        stats = {'realtime_collect_ms': 1000*self._collect_time,
+                 'realtime_gc_count': len(self._gc_pauses),
+                 'realtime_gc_ms': 1000*sum(self._gc_pauses)}
+        if usage is not None:
+            stats['realtime_preempted'] = usage.ru_nivcsw - self._usage.ru_nivcsw
+            stats['realtime_page_faults'] = usage.ru_majflt - self._usage.ru_majflt
+        flips = np.array([(flip_time, frame_index) for name, flip_time, frame_index in timeline.flips]).reshape(-1, 2)
+        intervals = np.diff(flips[:, 0])
+        stats['realtime_frame_sd_ms'] = 1000*float(intervals.std()) if len(intervals) else 0.0
+        stats['realtime_frame_max_ms'] = 1000*float(intervals.max()) if len(intervals) else 0.0
+        stats['realtime_missed_frames'] = int((np.diff(flips[:, 1]) - 1).sum())
+        return stats
+
+    def stop(self):
+        # Puts the collector and the process settings back as they were
+        if not self._started:
+            return
+        gc.enable()
+        gc.callbacks.remove(self._on_gc)
+        gc.unfreeze()
+        if 'scheduler' in self._saved:
+            policy, param = self._saved['scheduler']
+            os.sched_setscheduler(0, policy, param)
+        if 'nice' in self._saved:
+            os.setpriority(os.PRIO_PROCESS, 0, self._saved['nice'])  # Going back up needs no permission
+        if 'affinity' in self._saved:
+            os.sched_setaffinity(0, self._saved['affinity'])
+        self._saved = {}
+        self._started = False
@@ -0,0 +1,103 @@
+# ------------------------------------------------------------------------
+#  Response devices
+#
+#  Every device collects responses in the background and hands them over,
+#  without blocking, as (key name, timestamp) pairs. Timestamps are on the
+#  core.monotonicClock timebase, the same one win.flip() returns, so RT can
+#  be measured from the probe's actual flip time.
+#
+#    KeyboardDevice    PsychoPy's hardware keyboard (psychtoolbox backend:
+#                      keys are queued by a background thread with their
+#                      own hardware timestamps)
+#    SerialButtonBox   a button box on a serial port, read by a thread
+#    SimulatedDevice   scripted responses, for testing without a person
+
+import abc, collections, threading
+from psychopy import core
+
+class ResponseDevice(abc.ABC):
+    # A device missing clear() or get_responses() can't be created, so it fails at setup
+    # rather than on the first probe
+    @abc.abstractmethod
+    def clear(self):
+        # Drops anything collected so far, e.g. on the probe's flip
+        pass
+
+    @abc.abstractmethod
+    def get_responses(self):
+        # Returns (and removes) the responses collected since the last call
+        pass
+
+    def close(self):
+        pass
+
+class KeyboardDevice(ResponseDevice):
+    def __init__(self, key_list):
+        from psychopy.hardware import keyboard
+        self.key_list = key_list
+        self.keyboard = keyboard.Keyboard()
+
+    def clear(self):
+        self.keyboard.clearEvents()
+
+    def get_responses(self):
+        # tDown is on the psychtoolbox clock; monotonicClock counts from its last reset on that clock
+        offset = core.monotonicClock.getLastResetTime()
+        keys = self.keyboard.getKeys(keyList=self.key_list, waitRelease=False, clear=True)
+        return [(key.name, key.tDown - offset) for key in keys]
+
+class SerialButtonBox(ResponseDevice):
+    # port is an open serial.Serial with a read timeout set, e.g.
+    # serial.Serial('COM3', 115200, timeout=0.01). button_map maps each byte the
+    # box sends to a key name, e.g. {1: '3', 2: '4'}.
+    def __init__(self, port, button_map):
+        self.port = port
+        self.button_map = button_map
+        self._responses = collections.deque()
+        self._running = True
+        self._thread = threading.Thread(target=self._read, name='SerialButtonBox', daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        while self._running:
+            data = self.port.read(1)
+            if not data:
+                continue
+            pressed = core.monotonicClock.getTime()
+            if data[0] in self.button_map:
+                self._responses.append((self.button_map[data[0]], pressed))
+
+    def clear(self):
+        self._responses.clear()
+
+    def get_responses(self):
+        responses = []
+        while self._responses:
+            responses.append(self._responses.popleft())
+        return responses
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+
+class SimulatedDevice(ResponseDevice):
+    # Responses are scheduled with press(key, time) and handed over once the
+    # clock passes their time. get_time defaults to core.monotonicClock.getTime
+    # and can be replaced by a simulated clock.
+    def __init__(self, get_time=None):
+        self.get_time = get_time or core.monotonicClock.getTime
+        self._scheduled = []
+
+    def press(self, key, time):
+        self._scheduled.append((key, time))
+        self._scheduled.sort(key=lambda response: response[1])
+
+    def clear(self):
+        now = self.get_time()
+        self._scheduled = [response for response in self._scheduled if response[1] > now]
+
+    def get_responses(self):
+        now = self.get_time()
+        due = [response for response in self._scheduled if response[1] <= now]
+        self._scheduled = self._scheduled[len(due):]
+        return due
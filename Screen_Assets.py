@@ -0,0 +1,142 @@
+# ------------------------------------------------------------------------
+#  Cache for instruction images and text screens
+#
+#  preload() checks that every image exists, returning the missing ones
+#  straight away, and starts a background thread that decodes the rest
+#  with PIL in order. Decoding is the slow part of showing an image, and
+#  it runs while the dialog and earlier screens are up.
+#
+#  Textures have to be made on the thread that owns the window, so images
+#  are turned into ImageStims on the main thread, once there is a window: by upload(), which can be
+#  called between screens or added to Single_Trial_Change_Detection's
+#  idle_hooks, or by image() when a screen is shown. Text screens are laid
+#  out once by text() and reused.
+#
+#  Decoded images and textures together are kept under max_bytes. When a
+#  new image doesn't fit, the least recently shown ones are dropped and are
+#  decoded again if they come up later.
+
+import os, threading, time
+from collections import OrderedDict
+from PIL import Image
+
+default_max_bytes = 256 * 2**20  # An RGBA 1920x1080 image is about 8 MB
+
+def find_missing(filenames):
+    return [filename for filename in filenames if not os.path.isfile(filename)]
+
+def image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+def decode_image(filename):
+    image = Image.open(filename)
+    image.load()  # PIL decodes lazily; this does the work here rather than at upload
+    return image
+
+class ScreenAssets:
+    def __init__(self, win, visual, max_bytes=default_max_bytes):
+        self.win = win
+        self.visual = visual  # psychopy.visual, or a stand-in (see Headless_Session)
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.missing = []
+        self._lock = threading.Lock()
+        self._decoded = OrderedDict()  # filename: (PIL image, bytes), waiting to be uploaded
+        self._done = {}  # filename: threading.Event, set once decoding has finished or given up
+        self._stims = OrderedDict()  # filename: (ImageStim, bytes), least recently shown first
+        self._texts = {}
+        self._thread = None
+
+    def set_window(self, win, visual=None):
+        # Textures and text made for another window can't be drawn in this one
+        if win is not self.win:
+            self.n_bytes -= sum(size for stim, size in self._stims.values())
+            self._stims.clear()
+            self._texts.clear()
+            self.win = win
+        if visual is not None:
+            self.visual = visual
+
+    def preload(self, filenames):
+        # Returns the filenames that don't exist. Files already preloaded are skipped.
+        missing = find_missing(filenames)
+        self.missing += [filename for filename in missing if filename not in self.missing]
+        queue = [filename for filename in filenames
+                 if filename not in missing and filename not in self._done and filename not in self._stims]
+        for filename in queue:
+            self._done[filename] = threading.Event()
+        if queue:
+            previous = self._thread
+            self._thread = threading.Thread(target=self._decode_all, args=(queue, previous), daemon=True)
+            self._thread.start()
+        return missing
+
+    def _decode_all(self, filenames, previous):
+        if previous is not None:
+            previous.join()  # Keeping decodes in the order they were asked for
+        for filename in filenames:
+            try:
+                image = decode_image(filename)
+                size = image_bytes(image)
+                with self._lock:
+                    if self.n_bytes + size > self.max_bytes:
+                        image = None  # No room; image() decodes it when it's needed
+                    else:
+                        self._decoded[filename] = (image, size)
+                        self.n_bytes += size
+            except (OSError, ValueError):
+                pass  # Reported again by image(), where the error can be raised on the main thread
+            self._done[filename].set()
+
+    def _make_stim(self, filename, image, size):
+        self._evict(size)
+        stim = self.visual.ImageStim(self.win, image=image, units='pix')
+        self._stims[filename] = (stim, size)
+        self.n_bytes += size
+        return stim
+
+    def _evict(self, size):
+        # Dropping textures until size more bytes fit, keeping at least the newest one
+        while self._stims and self.n_bytes + size > self.max_bytes:
+            filename, (stim, stim_size) = self._stims.popitem(last=False)
+            self.n_bytes -= stim_size
+
+    def upload(self, deadline=None, clock=time.perf_counter):
+        # Makes textures from decoded images until deadline (in clock's time) passes.
+        # Main thread only. Returns the number still waiting.
+        while self._decoded and (deadline is None or clock() < deadline):
+            with self._lock:
+                filename, (image, size) = self._decoded.popitem(last=False)
+                self.n_bytes -= size
+            self._make_stim(filename, image, size)
+        return len(self._decoded)
+
+    def image(self, filename):
+        # The ImageStim for filename, or None if the file doesn't exist
+        if filename in self._stims:
+            self._stims.move_to_end(filename)
+            return self._stims[filename][0]
+        if filename in find_missing([filename]):
+            return None
+        if filename in self._done:
+            self._done[filename].wait()
+        with self._lock:
+            image, size = self._decoded.pop(filename, (None, 0))
+            self.n_bytes -= size
+        if image is None:
+            image = decode_image(filename)
+            size = image_bytes(image)
+        return self._make_stim(filename, image, size)
+
+    def text(self, text, pos=(0, 0), height=None):
+        # Laid out on first use (or by preloading it) and reused after that
+        key = (text, tuple(pos), height)
+        if key not in self._texts:
+            options = {} if height is None else {'height': height}
+            self._texts[key] = self.visual.TextStim(self.win, text=text, pos=list(pos), **options)
+        return self._texts[key]
+
+    def wait(self, timeout=None):
+        # Waits for the background decodes to finish, e.g. before the first instruction screen
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,119 @@
+# ------------------------------------------------------------------------
+#  Columnar session output
+#
+#  Saves a session as a folder with one .npy file per column, plus
+#  columns.json describing them. Every column has a fixed-width type, and
+#  layouts and colours are stored as arrays padded to the session's largest
+#  set size, so any column can be memory-mapped and read on its own:
+#
+#      columns = Session_Columns.load_columns(folder, ['set_size', 'accuracy'])
+#      study = Session_Columns.load_study('data', ['set_size', 'change', 'choice'])
+#
+#  Columns:
+#    block, trial, set_size   int16
+#    change, choice, accuracy int8
+#    rt                       float32 (0 when there was no answer)
+#    positions                int16 (n_trials, max_set_size, 2), zero padded
+#    colors                   uint8 (n_trials, max_set_size, 3), zero padded
+#    probe_color              uint8 (n_trials, 3)
+
+import glob, json, os
+import numpy as np
+
+column_types = {
+    'block': np.int16,
+    'trial': np.int16,
+    'set_size': np.int16,
+    'change': np.int8,
+    'choice': np.int8,
+    'accuracy': np.int8,
+    'rt': np.float32,
+    'positions': np.int16,
+    'colors': np.uint8,
+    'probe_color': np.uint8,
+    }
+
+class SessionColumns:
+    def __init__(self, max_set_size, info=None):
+        self.max_set_size = max_set_size
+        self.info = dict(info or {})  # e.g. Participant_ID and Seed, saved in columns.json
+        self.rows = []
+
+    def add(self, trial_spec, choice, accuracy, rt):
+        # trial_spec is the trial's Session_Schedule.TrialSpec
+        self.rows.append((trial_spec, choice, accuracy, rt))
+
+    def to_arrays(self):
+        n_trials = len(self.rows)
+        arrays = {name: np.zeros(n_trials, dtype=dtype) for name, dtype in column_types.items()}
+        arrays['positions'] = np.zeros((n_trials, self.max_set_size, 2), dtype=column_types['positions'])
+        arrays['colors'] = np.zeros((n_trials, self.max_set_size, 3), dtype=column_types['colors'])
+        arrays['probe_color'] = np.zeros((n_trials, 3), dtype=column_types['probe_color'])
+        for i, (spec, choice, accuracy, rt) in enumerate(self.rows):
+            arrays['block'][i] = spec.block
+            arrays['trial'][i] = spec.trial
+            arrays['set_size'][i] = spec.set_size
+            arrays['change'][i] = spec.change
+            arrays['choice'][i] = choice
+            arrays['accuracy'][i] = accuracy
+            arrays['rt'][i] = rt
+            arrays['positions'][i, :spec.set_size] = spec.positions
+            arrays['colors'][i, :spec.set_size] = spec.colors
+            arrays['probe_color'][i] = spec.probe_color
+        return arrays
+
+    def save(self, folder):
+        save_columns(folder, self.to_arrays(), self.info)
+
+def save_columns(folder, arrays, info=None):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    for name, values in arrays.items():
+        np.save(os.path.join(folder, name + '.npy'), values)
+    description = {'info': dict(info or {}), 'n_trials': len(arrays['block']),
+                   'columns': {name: {'dtype': values.dtype.str, 'shape': list(values.shape)}
+                               for name, values in arrays.items()}}
+    with open(os.path.join(folder, 'columns.json'), 'w') as description_file:
+        json.dump(description, description_file, indent=1, default=str)
+
+def read_description(folder):
+    with open(os.path.join(folder, 'columns.json')) as description_file:
+        return json.load(description_file)
+
+def load_columns(folder, columns=None, mmap=True):
+    # Only the requested columns are opened; with mmap they are read from disk on access
+    if columns is None:
+        columns = list(read_description(folder)['columns'])
+    mmap_mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(folder, name + '.npy'), mmap_mode=mmap_mode) for name in columns}
+
+def find_sessions(data_folder):
+    # Column folders saved by Change_Detection under data/ID_*
+    return sorted(glob.glob(os.path.join(data_folder, 'ID_*', '*_columns')))
+
+def load_study(data_folder, columns):
+    # Concatenates the requested columns of every session, with a 'session' column
+    # giving each row's index into the returned 'folders' list. Padded columns
+    # (positions, colors) are padded again to the largest max_set_size in the study,
+    # e.g. when adaptive and fixed sessions are loaded together.
+    folders = find_sessions(data_folder)
+    parts = {name: [] for name in columns}
+    session = []
+    for i, folder in enumerate(folders):
+        loaded = load_columns(folder, columns)
+        for name in columns:
+            parts[name].append(loaded[name])
+        session.append(np.full(len(loaded[columns[0]]), i, dtype=np.int32))
+    study = {}
+    for name, values in parts.items():
+        if not values:
+            study[name] = np.zeros(0, column_types.get(name, float))
+            continue
+        if values[0].ndim == 3:
+            width = max(v.shape[1] for v in values)
+            values = [np.pad(v, [(0, 0), (0, width - v.shape[1]), (0, 0)]) if v.shape[1] < width else v
+                      for v in values]
+        study[name] = np.concatenate(values)
+    study['session'] = np.concatenate(session) if session else np.zeros(0, np.int32)
+    study['folders'] = folders
+    return study
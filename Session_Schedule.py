@@ -0,0 +1,162 @@
+# ------------------------------------------------------------------------
+#  Precompiled session schedule
+#
+#  Resolves every trial of the practice loop and the experimental blocks
+#  (set size, change flag, positions, colours and probe colour) before the
+#  first trial, and stores them in one compressed .npz file. run_trial then
+#  only looks trials up, so no random generation happens during stimulus
+#  timing, and a session can be replayed exactly from its seed or its file.
+#
+#  Block 0 is the practice block, as in Change_Detection.py. Experimental
+#  blocks are shuffled with Design_Compiler.constrained_order, so no factor
+#  repeats more than max_run[factor] trials in a row.
+
+from collections import namedtuple
+import numpy as np
+import Bilateral_Positions
+import Color_Palette
+import Design_Compiler
+
+max_run = {'change': 3, 'number_of_stim': 3}
+
+TrialSpec = namedtuple('TrialSpec', ['block', 'trial', 'set_size', 'change', 'positions', 'colors', 'probe_color'])
+
+def read_conditions(filename):
+    # Same columns as the files loaded with data.importConditions
+    design = Design_Compiler.load_design(filename)
+    return list(zip(design['number_of_stim'].tolist(), design['change'].tolist()))
+
+def trial_rng(seed, block, trial):
+    # Every trial gets its own stream, so one trial can be regenerated on its own
+    return np.random.default_rng([seed, block, trial])
+
+def as_palette(colors):
+    # Accepts a Color_Palette palette or a plain list of rgb255 colours
+    if isinstance(colors, Color_Palette.Palette):
+        return colors
+    return Color_Palette.Palette(colors)
+
+def quadrant_of(pos):
+    # Bilateral_Positions quadrant of a position (y is up)
+    if pos[1] > 0:
+        return Bilateral_Positions.UPPER_LEFT if pos[0] < 0 else Bilateral_Positions.UPPER_RIGHT
+    return Bilateral_Positions.LOWER_LEFT if pos[0] < 0 else Bilateral_Positions.LOWER_RIGHT
+
+def mirror_to_quadrant(positions, quadrant):
+    # Reflects a layout across the screen's axes so its first position lands in quadrant.
+    # Distances between squares and from the fixation point don't change.
+    left = quadrant in (Bilateral_Positions.UPPER_LEFT, Bilateral_Positions.LOWER_LEFT)
+    upper = quadrant in (Bilateral_Positions.UPPER_LEFT, Bilateral_Positions.UPPER_RIGHT)
+    x_sign = 1 if (positions[0][0] < 0) == left else -1
+    y_sign = 1 if (positions[0][1] > 0) == upper else -1
+    return [[x_sign*x, y_sign*y] for x, y in positions]
+
+def compile_trial(seed, block, trial, set_size, change, x_axis_limit, y_axis_limit, palette,
+        probe_quadrant=None, probe_color_index=None):
+    # probe_quadrant and probe_color_index (see Study_Schedule) put the first square, the one
+    # that gets probed, in a given quadrant and colour, by mirroring the layout and turning
+    # the palette. The random draws are the same either way.
+    palette = as_palette(palette)
+    rng = trial_rng(seed, block, trial)
+    positions = Bilateral_Positions.create_n_pos(set_size, x_axis_limit, y_axis_limit, rng)
+    if probe_quadrant is not None:
+        positions = mirror_to_quadrant(positions, probe_quadrant)
+    color_indices = palette.sample_indices(set_size, rng)
+    probe_index = color_indices[0]
+    if change:
+        probe_index = palette.changed_index(color_indices[0], rng)  # Any colour other than the first square's
+    if probe_color_index is not None:
+        # Every index moves by the same step, so colours stay distinct (and as far apart on a colour wheel)
+        shift = probe_color_index - color_indices[0]
+        color_indices = (color_indices + shift) % len(palette)
+        probe_index = (probe_index + shift) % len(palette)
+    colors = [palette.color(i) for i in color_indices]
+    return TrialSpec(block, trial, set_size, change, positions, colors, palette.color(probe_index))
+
+def session_conditions(seed, practice_file='cd_practice_conditions.csv', trial_file='cd_trial_conditions.csv',
+        n_blocks=3, n_reps=5):
+    # (set size, change) of every trial, by block. Practice trials run in file order; each block
+    # is n_reps copies of the trial conditions in a random order with runs limited by max_run
+    block_conditions = [read_conditions(practice_file)]
+    design = Design_Compiler.load_design(trial_file)
+    trial_conditions = read_conditions(trial_file)
+    for block in range(1, n_blocks + 1):
+        order = Design_Compiler.constrained_order(design, n_reps, np.random.default_rng([seed, block]), max_run)
+        block_conditions.append([trial_conditions[i] for i in order])
+    return block_conditions
+
+def compile_session(seed, x_axis_limit, y_axis_limit, palette,
+        practice_file='cd_practice_conditions.csv', trial_file='cd_trial_conditions.csv',
+        n_blocks=3, n_reps=5):
+    palette = as_palette(palette)
+    block_conditions = session_conditions(seed, practice_file, trial_file, n_blocks, n_reps)
+
+    specs = []
+    for block, conditions in enumerate(block_conditions):
+        for trial, (set_size, change) in enumerate(conditions, start=1):
+            specs.append(compile_trial(seed, block, trial, set_size, change, x_axis_limit, y_axis_limit, palette))
+    return SessionSchedule.from_specs(seed, specs)
+
+class SessionSchedule:
+    # Column arrays for every trial of a session. Positions and colours are padded
+    # to the largest set size; set_size says how many entries of a row are real.
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.seed = int(arrays['seed'])
+        self.block = arrays['block']
+        self.trial = arrays['trial']
+        self.set_size = arrays['set_size']
+        self.change = arrays['change']
+        self.positions = arrays['positions']
+        self.colors = arrays['colors']
+        self.probe_color = arrays['probe_color']
+        # Row where each block starts, so lookups by (block, trial) don't search
+        self.block_starts = {int(b): int(np.argmax(self.block == b)) for b in np.unique(self.block)}
+
+    @classmethod
+    def from_specs(cls, seed, specs):
+        n_trials = len(specs)
+        max_set_size = max(spec.set_size for spec in specs)
+        positions = np.zeros((n_trials, max_set_size, 2), dtype=np.int16)
+        colors = np.zeros((n_trials, max_set_size, 3), dtype=np.uint8)
+        for i, spec in enumerate(specs):
+            positions[i, :spec.set_size] = spec.positions
+            colors[i, :spec.set_size] = spec.colors
+        return cls({
+            'seed': np.int64(seed),
+            'block': np.array([spec.block for spec in specs], dtype=np.int16),
+            'trial': np.array([spec.trial for spec in specs], dtype=np.int16),
+            'set_size': np.array([spec.set_size for spec in specs], dtype=np.int16),
+            'change': np.array([spec.change for spec in specs], dtype=np.int8),
+            'positions': positions,
+            'colors': colors,
+            'probe_color': np.array([spec.probe_color for spec in specs], dtype=np.uint8),
+            })
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as saved:
+            return cls({name: saved[name] for name in saved.files})
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.arrays)
+
+    def __len__(self):
+        return len(self.block)
+
+    def index(self, block, trial):
+        # trial is numbered from 1, as in the EEG codes
+        return self.block_starts[block] + trial - 1
+
+    def spec(self, index):
+        n = int(self.set_size[index])
+        return TrialSpec(int(self.block[index]), int(self.trial[index]), n, int(self.change[index]),
+            self.positions[index, :n].tolist(), [tuple(c) for c in self.colors[index, :n].tolist()],
+            tuple(self.probe_color[index].tolist()))
+
+    def block_trials(self, block):
+        # Trial list for a TrialHandler running this block in schedule order
+        start = self.block_starts[block]
+        stop = start + int(np.count_nonzero(self.block == block))
+        return [{'number_of_stim': int(self.set_size[i]), 'change': int(self.change[i]), 'schedule_index': i}
+            for i in range(start, stop)]
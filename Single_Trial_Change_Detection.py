@@ -1,7 +1,12 @@
 from psychopy import visual, core, event, colors
-import serial
 import random
+import numpy as np
 import Bilateral_Positions
+import Color_Palette
+import EEG_Triggers
+import Frame_Timeline
+import Response_Devices
+import Screen_Assets
 
 # 'z' key signifies no change, '/' (slash) signifies change
 
@@ -16,10 +21,15 @@ random.seed()#Setting current time as seed for random number generation
 # Go to Tools > Monitor Center and enter a name for the current monitor.
 # After saving there, in the next line of code change monitor='currentMonitorName' (must be in single quotes)
 
-# Make sure fullscr=False. Otherwise intial dialog box will not appear. Program switches to fullscreen after
-# information is entered in dialog box.
-win = visual.Window(size=[1920, 1080], monitor='labMonitor', fullscr=False, units='pix', allowGUI=False)
-mouse = event.Mouse()
+# The window is only opened once the initial dialog box has closed, so Change_Detection opens it
+# with fullscr=True.
+def open_window(fullscr=False):
+    return visual.Window(size=[1920, 1080], monitor='labMonitor', fullscr=fullscr, units='pix', allowGUI=False)
+
+# The window and everything drawn in it are made by setup_display, below, the first time
+# they're needed (see get_display). Importing this module doesn't open a window.
+win = None
+mouse = None
 
 # Preference variables
 
@@ -35,49 +45,176 @@ color_values = [
     (1, 1, 1), # Black 
     (255, 128, 0)  # Orange
     ]
-color_values_used = []  # Checks potential colors against this list so none are repeated
+# Set use_color_wheel to True to draw colours from the 360-degree wheel instead of color_values
+use_color_wheel = False
+if use_color_wheel:
+    palette = Color_Palette.ColorWheel()
+else:
+    palette = Color_Palette.Palette(color_values)
 stim_size = 72  # Size in pixels of the sides of the squares.
 
-# Making sure stimuli don't appear too close to edge of screen
-x_axis_limit = int(win.size[0]/1.35)/2 - stim_size
-y_axis_limit = int(win.size[1]/1.35)/2 - stim_size
-
-fixation = visual.Circle(win, units = 'pix', radius = 6, fillColor = 'black', lineColor = 'black')
-fixation2 = visual.TextStim(win=win, name='fix2',
-    text='?',
-    font='Open Sans',
-    units = 'pix',
-    pos=(0, 0), height=20, wrapWidth=None, ori=0.0, 
-    color='black', colorSpace='rgb', opacity=None, 
-    languageStyle='LTR',
-    depth=0.0);
-
-# Creating a buffer zone for the fixation point so stimuli will always appear their own length away
-# from center point of the screen
-fixation_buffer = visual.Circle(win, units='pix', radius = (stim_size), fillColor = None, lineColor = None)
-
-def create_new_stimulus(chosen_pos):
-    color = random.choice(color_values)
-    while color in color_values_used:
-        color = random.choice(color_values)
-    color_values_used.append(color)
+# Responses come from a background-polled device with its own timestamps, so waiting
+# for a key never holds up drawing. Change_Detection can swap in a SerialButtonBox
+# with the same key names.
+response_keys = ['escape', '3', '4']
+response_device = None
+
+# EEG codes go through an EEG_Triggers.TriggerDispatcher, set up in Change_Detection.
+# While this is None no codes are sent.
+triggers = None
+
+def send_trigger(code, block_number):
+    # No sending codes if block is 0 because that's the practice block
+    # Queues the code and returns straight away; the dispatcher handles spacing between codes
+    if triggers is not None and block_number != 0:
+        triggers.send(code)
+
+def stimulus_colors(color_list):
+    # rgb255 colours (as trial specs and data files have them) as rows of the palette's
+    # table in the window's colour space, which the squares are made in, so setting
+    # them costs PsychoPy no conversion
+    return palette.rows(color_list, win.colorSpace)
+
+def create_new_stimulus(chosen_pos, color=None):
+    if color is None:  # Colours come from the session schedule when one is being played back
+        color = palette.color(palette.sample_indices(1)[0])
     
     stim = visual.Rect(win, units = 'pix', width = stim_size, height = stim_size, pos = chosen_pos,
-        fillColor = color, lineColor = None, colorSpace = 'rgb255')
+        fillColor = stimulus_colors([color])[0], lineColor = None, colorSpace = win.colorSpace)
 
     return stim
+
+class StimulusPool:
+    # Squares made once and reused on every trial by moving and recolouring them.
+    # With batched=True the memory array is drawn as a single ElementArrayStim
+    # (one draw call for any set size); the Rects are still kept for the probe.
+    def __init__(self, size, batched=False):
+        self.batched = batched
+        self.squares = []
+        self.n_active = 0
+        self.element_array = None
+        self.grow(size)
+
+    def grow(self, size):
+        # Only called between trials, when a set size bigger than the pool comes up
+        while len(self.squares) < size:
+            self.squares.append(create_new_stimulus((0, 0), palette.color(0)))
+        self.squares[0].name = 1  # Creating a name for this stim so we can judge accuracy of choices later
+        if self.batched and (self.element_array is None or self.element_array.nElements < size):
+            self.element_array = visual.ElementArrayStim(win, units='pix', nElements=size,
+                elementTex=None, elementMask=None, sizes=stim_size,
+                xys=[(0, 0)] * size, colors=stimulus_colors([palette.color(0)] * size), colorSpace=win.colorSpace,
+                opacities=[0] * size)
+
+    def set_trial(self, pos_list, color_list):
+        self.grow(len(pos_list))
+        colors = stimulus_colors(color_list)
+        for square, pos, color in zip(self.squares, pos_list, colors):
+            square.pos = pos
+            square.fillColor = color
+        self.n_active = len(pos_list)
+
+        if self.batched:
+            # Unused elements stay in the array but are fully transparent
+            n_elements = self.element_array.nElements
+            padding = n_elements - self.n_active
+            self.element_array.xys = list(pos_list) + [(0, 0)] * padding
+            self.element_array.colors = np.concatenate([colors, np.repeat(colors[:1], padding, axis=0)])
+            self.element_array.opacities = [1] * self.n_active + [0] * padding
+
+    def draw(self):
+        if self.batched:
+            self.element_array.draw()
+        else:
+            for square in self.squares[:self.n_active]:
+                square.draw()
+       
+# Squares for the memory array are made once in setup_display and reused on every trial.
+# Set batched_memory_array to True to draw the whole array with one draw call.
+batched_memory_array = False
+stimulus_pool = None
+
+# Instruction images and text screens are decoded and laid out ahead of time by
+# preload_screens, so moving between screens doesn't stall. Images can start decoding
+# before there's a window; textures are made once setup_display has opened one.
+screen_assets = Screen_Assets.ScreenAssets(None, visual)
+
+def setup_display(window=None, responses=None):
+    # Makes the window (unless one is passed in, e.g. by Headless_Session), the fixation
+    # stimuli, the pooled squares and the response device
+    global win, mouse, x_axis_limit, y_axis_limit, fixation, fixation2, fixation_buffer
+    global stimulus_pool, response_device
+    win = window if window is not None else open_window()
+    mouse = event.Mouse()
+
+    # Making sure stimuli don't appear too close to edge of screen
+    x_axis_limit = int(win.size[0]/1.35)/2 - stim_size
+    y_axis_limit = int(win.size[1]/1.35)/2 - stim_size
+
+    # Building the candidate coordinates for this screen now, so it doesn't happen during a trial
+    Bilateral_Positions.get_geometry(x_axis_limit, y_axis_limit, stim_size)
+
+    fixation = visual.Circle(win, units = 'pix', radius = 6, fillColor = 'black', lineColor = 'black')
+    fixation2 = visual.TextStim(win=win, name='fix2',
+        text='?',
+        font='Open Sans',
+        units = 'pix',
+        pos=(0, 0), height=20, wrapWidth=None, ori=0.0, 
+        color='black', colorSpace='rgb', opacity=None, 
+        languageStyle='LTR',
+        depth=0.0);
+
+    # Creating a buffer zone for the fixation point so stimuli will always appear their own length away
+    # from center point of the screen
+    fixation_buffer = visual.Circle(win, units='pix', radius = (stim_size), fillColor = None, lineColor = None)
+
+    stimulus_pool = StimulusPool(6, batched=batched_memory_array)
+    response_device = responses if responses is not None else Response_Devices.KeyboardDevice(response_keys)
+    screen_assets.set_window(win, visual)
+    return win
+
+def get_display():
+    # Returns the window, opening it (and making everything drawn in it) on first use
+    if win is None:
+        setup_display()
+    return win
        
+def end_of_block_text(block_number):
+    return """You have finished block number """ + str(block_number) + """ of 3.
+When you are ready, press any key to continue."""
+
+experiment_end_message_text = 'Finished! Please see the experimenter.'
+
+def preload_screens(image_filenames, texts=()):
+    # Starts decoding the instruction images in the background and lays out the fixed
+    # text screens. Returns the images that don't exist, so they can be reported up front.
+    missing = screen_assets.preload(image_filenames)
+    if win is None:
+        return missing  # Texts are laid out when preload_screens is called again with a window
+    for text in texts:
+        screen_assets.text(text, pos=[0, 0], height=40)
+    for block_number in (1, 2):
+        screen_assets.text(end_of_block_text(block_number), pos=[0, 100])
+    screen_assets.text(experiment_end_message_text, pos=[0, 100])
+    return missing
+
 def display_instructions(image_filename):
-    instruction_image = visual.SimpleImageStim(win, image=image_filename)
+    get_display()
+    instruction_image = screen_assets.image(image_filename)
+    if instruction_image is None:
+        # Missing images are reported when the session starts; this keeps the session going
+        instruction_image = screen_assets.text('(Missing instructions image: ' + image_filename + ')\n\nPress space to continue.')
     instruction_image.draw()
     win.flip()
+    screen_assets.upload()  # Making textures for the images still to come while this one is up
     core.wait(1)  # Prevents subject from clicking through instructions by accident
     event.waitKeys(keyList = ['space']) # Waits for space key to continue
     fixation.draw()
     win.flip()
     
 def display_text_instructions(instructions_text):
-    instruction_text = visual.TextStim(win, text=instructions_text, pos = [0, 0], height = 40)
+    get_display()
+    instruction_text = screen_assets.text(instructions_text, pos = [0, 0], height = 40)
     instruction_text.draw()
     win.flip()
     core.wait(1)  # Prevents subject from clicking through instructions by accident
@@ -87,9 +224,8 @@ def display_text_instructions(instructions_text):
     win.flip()
 
 def display_end_of_block_screen(block_number):
-    block_end_message_text = """You have finished block number """ + str(block_number) + """ of 3.
-When you are ready, press any key to continue."""
-    block_end_message = visual.TextStim(win, text=block_end_message_text, pos = [0, 100])
+    get_display()
+    block_end_message = screen_assets.text(end_of_block_text(block_number), pos = [0, 100])
     block_end_message.draw()
     win.flip()    
     core.wait(3)  # Prevents subject from clicking through by accident, encourages them to take break
@@ -98,154 +234,179 @@ When you are ready, press any key to continue."""
     win.flip()
 
 def display_end_of_experiment_screen():
-    experiment_end_message_text = 'Finished! Please see the experimenter.'
-    experiment_end_message = visual.TextStim(win, text=experiment_end_message_text, pos = [0, 100])
+    get_display()
+    experiment_end_message = screen_assets.text(experiment_end_message_text, pos = [0, 100])
     experiment_end_message.draw()
     win.flip()
     core.wait(3)
 
-def run_trial(trial_stim_number, is_changed, block_number, trial_number):
+# Trial phase lengths in seconds. Each one is run as a whole number of screen refreshes.
+fixation_duration = 1  # Fixation before the stimuli appear
+encoding_duration = 0.500  # Stimuli on screen
+retention_duration = 1  # Fixation only, before the probe
+max_wait = 2  # Time participants have to answer
+
+# Phases checked in each trial's timeline: (name, starting event, ending event, intended duration)
+trial_phases = [
+    ('fixation', 'trial_start', 'stimuli', fixation_duration),
+    ('encoding', 'stimuli', 'retention', encoding_duration),
+    ('retention', 'retention', 'probe', retention_duration),
+    ('probe', 'probe', 'end', max_wait),
+    ]
+
+# Functions called after a flip when the frame has time to spare, e.g. to prepare
+# the next trial or write data. Each one is called as hook(deadline) and should do
+# a small piece of work and return before core.monotonicClock reaches deadline.
+idle_hooks = []
+idle_fraction = 0.5  # Share of each frame, after the flip, that idle hooks may use
+
+# Set to a Gaze_Gating.GazeMonitor to hold each trial on the fixation point until the participant
+# is looking at it, and to flag eye movements during encoding and retention (see Change_Detection).
+# While this is None trials run without an eye tracker.
+gaze_monitor = None
+
+def frames_for(duration):
+    return max(1, int(round(duration / win.monitorFramePeriod)))
+
+def run_idle_hooks(flip_time):
+    deadline = flip_time + idle_fraction*win.monitorFramePeriod
+    for hook in idle_hooks:
+        if core.monotonicClock.getTime() >= deadline:
+            break
+        hook(deadline)
+
+def run_trial(trial_stim_number, is_changed, block_number, trial_number, trial_spec=None, bundle=None):
     stim_number = trial_stim_number  # This value comes in from a list generated by ExperimentHandler
+    # trial_spec is this trial's entry from Session_Schedule; with it, nothing is generated here
+    # bundle is a Trial_Prefetch.TrialBundle, with the spec already loaded into a stimulus pool
+    get_display()
     
-    #if block_number != 0:  # No sending codes if block is 0 because that's the practice block
-        #port.write(int(98).to_bytes(length = 1, byteorder = "little"))  # Sending EEG code just after user clicks to continue to this trial
-    fixation_time_period = core.StaticPeriod()
-    fixation_time_period.start(1)  # Making sure there's 1 second exactly between now and stim appearing
-    
-    # Setting up EEG codes for this trial
-    stim_appear_block_code = block_number + 200
-    stim_appear_trial_code = trial_number + 100
-    stim_number_code = 40 + stim_number
-    retention_code = 50 + stim_number
-    pulse_duration = 0.1  # Time (in seconds) we will pause after sending certain trigger codes so signal goes through
-
-    # Generating list of positions for stimuli
-    if stim_number <= 2:
-        pos_list = Bilateral_Positions.create_up_to_2_pos(stim_number, x_axis_limit, y_axis_limit)
-    elif stim_number >= 5:
-        pos_list = Bilateral_Positions.create_up_to_6_pos(stim_number, x_axis_limit, y_axis_limit)
-
-    # Generating stimuli  
-    square1 = create_new_stimulus(pos_list[0])
-    square1.name = 1  # Creating a name for this stim so we can judge accuracy of choices later
-
-    if stim_number >= 2:
-        square2 = create_new_stimulus(pos_list[1])
-    if stim_number >= 3:
-        square3 = create_new_stimulus(pos_list[2])
-    if stim_number >= 4:
-        square4 = create_new_stimulus(pos_list[3])
-        square5 = create_new_stimulus(pos_list[4])
-    if stim_number == 6:
-        square6 = create_new_stimulus(pos_list[5])
-
-    color_values_used[:] = []  # Resetting list of color values used for next time
-
-    # Drawing initial screen with stimuli
-    fixation.setAutoDraw(True)
-    
-    square1.draw()
-    if stim_number >= 2:
-        square2.draw()
-    if stim_number >= 3:
-        square3.draw()
-    if stim_number >= 4:
-        square4.draw()
-        square5.draw()
-    if stim_number == 6:
-        square6.draw()
-
-    fixation_time_period.complete()  # Moving on once fixation period is over
-
-    # Sending EEG codes with block and trial numbers just before stim appear
-    if block_number != 0:
-        #port.write(stim_appear_block_code.to_bytes(length = 1, byteorder = "little"))
-        core.wait(pulse_duration)  # Waiting 100ms to make sure previous code is received
-        #port.write(stim_appear_trial_code.to_bytes(length = 1, byteorder = "little"))
-        core.wait(pulse_duration)  # Waiting 100ms to make sure previous code is received
-        
-    win.flip()  # Displaying fixation and stimuli
-    
-    #reaction_time_clock = core.MonotonicClock()  # Starting to measure RT
-    #if block_number != 0:
-        #port.write(stim_number_code.to_bytes(length = 1, byteorder = "little"))  # Sending EEG code with number of stim just after stim appear
-    core.wait(0.500, hogCPUperiod=0.1) # Holding this screen for 500ms
-    win.flip() # Displaying fixation only
-    
-    #if block_number != 0:
-        #port.write(retention_code.to_bytes(length = 1, byteorder = "little"))  # Sending EEG code when stim disappear
-    core.wait(1, hogCPUperiod=0.2) # Holding this screen for 1s retention period
-
-    fixation.setAutoDraw(False)
-    fixation2.setAutoDraw(True)
-
-    # Redrawing Stim 1
-    # Color will be same or different depending on value of is_changed
-    if not is_changed:
-        square1.draw()
-        win.flip()
-        reaction_time_clock = core.MonotonicClock()  # Starting to measure RT
+    send_trigger(EEG_Triggers.TRIAL_START_CODE, block_number)  # Sending EEG code just after user clicks to continue to this trial
+    # Sending EEG codes with block and trial numbers during fixation, well before stim appear
+    # (they go out pulse_duration apart in the background, so no waiting here)
+    send_trigger(EEG_Triggers.block_code(block_number), block_number)
+    send_trigger(EEG_Triggers.trial_code(trial_number), block_number)
+
+    # Every flip of this trial is timestamped, so phase durations and dropped frames can be checked later
+    timeline = Frame_Timeline.TrialTimeline(trial_phases, win.monitorFramePeriod)
+
+    # Generating list of positions for stimuli (any set size)
+    if bundle is not None:
+        trial_spec = bundle.spec
+    if trial_spec is not None:
+        pos_list = trial_spec.positions
+        color_list = trial_spec.colors
+        probe_color = trial_spec.probe_color
     else:
-        previous_color = square1.fillColor
-        new_color = random.choice(color_values)
-        while list(new_color) == list(previous_color):
-            new_color = random.choice(color_values)
-        square1.fillColor = new_color
-        square1.draw()
-        win.flip()
-        reaction_time_clock = core.MonotonicClock()  # Starting to measure RT
-    #if block_number != 0:
-        #port.write(int(99).to_bytes(length = 1, byteorder = "little"))  # Sending EEG code just after single stim appears
+        pos_list = Bilateral_Positions.create_n_pos(stim_number, x_axis_limit, y_axis_limit)
+        color_indices = palette.sample_indices(stim_number)  # All different, in one draw
+        color_list = [palette.color(i) for i in color_indices]
+        probe_color = palette.color(palette.changed_index(color_indices[0]))
+
+    # Moving and recolouring the pooled stimuli for this trial, unless that was done ahead of time
+    if bundle is not None:
+        pool = bundle.pool
+    else:
+        pool = stimulus_pool
+        pool.set_trial(pos_list, color_list)
+    square1 = pool.squares[0]
+    probe_fill = stimulus_colors([probe_color])[0]
+
+    # The trial runs as a sequence of phases, each a fixed number of frames, advanced
+    # one flip at a time. The first frame of each phase is logged under the event name,
+    # with its EEG code sent on that flip.
+    # (phase, event at first frame, number of frames, EEG code or None)
+    phases = [
+        ('fixation', 'trial_start', frames_for(fixation_duration), None),
+        ('encoding', 'stimuli', frames_for(encoding_duration), EEG_Triggers.stim_number_code(stim_number)),
+        ('retention', 'retention', frames_for(retention_duration), EEG_Triggers.retention_code(stim_number)),
+        ('probe', 'probe', frames_for(max_wait), EEG_Triggers.PROBE_CODE),
+        ]
 
     # If no answer is made, accuracy and reaction_time values will remain at 0
     # choice_number will be 2
     accuracy = 0
     reaction_time = 0
     choice_number = 2
+    key_pressed = None
 
-    # 'z' key signifies no change, '/' (slash) signifies change
-    # Participant can also press escape key to exit experiment prematurely
-    # Participant has 2000ms to answer before trial moves on
-    # To change how much time they have to answer, change value of max_wait in next line
-    # Time is in seconds
-    max_wait = 2
-    key_pressed = event.waitKeys(maxWait=max_wait, keyList=['escape', '3', '4'])
-    rt = reaction_time_clock.getTime()
-    wait_time = max_wait - rt
-    
-    if key_pressed in [['3'], ['4'], ['escape']]:
-        if key_pressed == ['escape']:
-            win.close()
-            core.quit()
-        elif key_pressed == ['3']:
-            fixation2.setAutoDraw(False)
-            reaction_time = rt
-            choice_number = 0
-            if is_changed:
-                accuracy = 0
-            else:
-                accuracy = 1
-        elif key_pressed == ['4']:
-            fixation2.setAutoDraw(False)
-            reaction_time = rt
-            choice_number = 1
+    fixation.setAutoDraw(True)
+    if gaze_monitor is not None:
+        # Holding the trial until gaze has stayed within fixation_buffer's radius for the gate duration,
+        # or starting it anyway (and logging that) after the timeout
+        # Escape still exits while the trial is held; other keys are dropped when the probe appears
+        gate_start = core.monotonicClock.getTime()
+        timeline.mark('gate_start', gate_start)
+        while not gaze_monitor.fixating(core.monotonicClock.getTime()):
+            if any(key == 'escape' for key, pressed_time in response_device.get_responses()):
+                win.close()
+                core.quit()
+            if core.monotonicClock.getTime() - gate_start >= gaze_monitor.gate_timeout:
+                timeline.mark('gate_timeout', core.monotonicClock.getTime())
+                break
+            run_idle_hooks(timeline.flip(win))
+
+    for phase, event_name, n_frames, code in phases:
+        if phase == 'probe':
+            # Redrawing Stim 1
+            # Color will be same or different depending on value of is_changed
+            fixation.setAutoDraw(False)
+            fixation2.setAutoDraw(True)
             if is_changed:
-                accuracy = 1
+                square1.fillColor = probe_fill
+            win.callOnFlip(response_device.clear)  # Only keys pressed after the probe appears count
+
+        for frame in range(n_frames):
+            if phase == 'encoding':
+                pool.draw()
+            elif phase == 'probe':
+                square1.draw()
+
+            if frame == 0:
+                if code is not None:
+                    win.callOnFlip(send_trigger, code, block_number)
+                flip_time = timeline.flip(win, event_name)
+                if phase == 'probe':
+                    probe_time = flip_time  # RT is measured from the probe's flip
             else:
-                accuracy = 0
-    
-    core.wait(wait_time)
+                flip_time = timeline.flip(win)
+
+            # 'z' key signifies no change, '/' (slash) signifies change
+            # Participant can also press escape key to exit experiment prematurely
+            # Participant has 2000ms to answer before trial moves on; the probe stays up for all of it
+            # To change how much time they have to answer, change value of max_wait at the top of this file
+            if phase == 'probe' and key_pressed is None:
+                responses = response_device.get_responses()
+                if responses:
+                    key_pressed, pressed_time = responses[0]
+                    rt = pressed_time - probe_time
+                    if key_pressed == 'escape':
+                        win.close()
+                        core.quit()
+                    elif key_pressed == '3':
+                        reaction_time = rt
+                        choice_number = 0
+                        if is_changed:
+                            accuracy = 0
+                        else:
+                            accuracy = 1
+                    elif key_pressed == '4':
+                        reaction_time = rt
+                        choice_number = 1
+                        if is_changed:
+                            accuracy = 1
+                        else:
+                            accuracy = 0
+
+            run_idle_hooks(flip_time)
 
-    choice_code = 10 + choice_number  # Sending code with choice of particpant
-    if block_number != 0:
-        #port.write(choice_code.to_bytes(length = 1, byteorder = "little"))
-        core.wait(pulse_duration)
-        accuracy_code = 80 + accuracy
-        #port.write(accuracy_code.to_bytes(length = 1, byteorder = "little"))  # Sending code showing whether choice was correct or incorrect
-        core.wait(pulse_duration) #need this delay otherwise the accuracy code is sent at the same time as the fixation code and doesn't show up
+    send_trigger(EEG_Triggers.choice_code(choice_number), block_number)  # Sending code with choice of particpant
+    # Sending code showing whether choice was correct or incorrect
+    # The dispatcher keeps it pulse_duration away from the next trial's start code, so they don't merge
+    send_trigger(EEG_Triggers.accuracy_code(accuracy), block_number)
 
     fixation2.setAutoDraw(False)
     fixation.setAutoDraw(True)
-    win.flip()  # Displaying fixation only
+    timeline.flip(win, 'end')  # Displaying fixation only
 
-    return choice_number, accuracy, reaction_time
+    return choice_number, accuracy, reaction_time, timeline
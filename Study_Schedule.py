@@ -0,0 +1,171 @@
+# ------------------------------------------------------------------------
+#  Counterbalanced schedules for a whole study
+#
+#  Compiles every participant's session (see Session_Schedule) ahead of
+#  time into one indexed file. Each participant gets an independent random
+#  stream spawned from the study seed, and sessions are compiled in a
+#  process pool.
+#
+#  Balance across the study comes from the probed square (square1):
+#    quadrant   within each (block, number_of_stim, change) cell, square1's
+#               quadrants are as even as the cell allows, and the quadrant
+#               that gets the extra trials rotates with the participant, so
+#               every cell is exactly balanced over each 4 participants
+#    colour     within each block, square1's colours are a run of
+#               consecutive palette indices that continues from block to
+#               block and from participant to participant (practice has a
+#               run of its own), so over the study's experimental trials
+#               colours come up as evenly as the number of trials allows,
+#               exactly evenly when it divides by the palette size
+#  Layouts are mirrored and palettes turned to hit these targets (see
+#  Session_Schedule.compile_trial), so the random draws are unchanged.
+#  The layout generator's left and lower ranges stop 2 pixels further from
+#  the midline than its right and upper ones, so a mirrored square can be
+#  up to 2 pixels nearer the midline than a generated one; it is still at
+#  least the fixation buffer away.
+#
+#      python Study_Schedule.py 40 --study-seed 2024 --output study_schedule.npz
+#
+#  Change_Detection loads a participant's trials from the file when
+#  study_schedule_file is set.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import Bilateral_Positions
+import Session_Schedule
+
+def participant_seeds(study_seed, n_participants):
+    # One independent stream per participant, as the integer seed Session_Schedule expects
+    children = np.random.SeedSequence(study_seed).spawn(n_participants)
+    return [int(child.generate_state(1, np.uint32)[0]) for child in children]
+
+def quadrant_targets(participant, cell, count, rng):
+    base = np.roll(np.arange(4), participant + cell)
+    return rng.permutation(np.resize(base, count))
+
+def color_run_starts(participant, block_sizes):
+    # Where each block's run of colours starts. Experimental blocks continue one run through
+    # all participants' blocks in order; practice (block 0) runs through participants on its own.
+    experimental = int(sum(block_sizes[1:]))
+    starts = [participant * block_sizes[0]]
+    for block in range(1, len(block_sizes)):
+        starts.append(participant * experimental + int(sum(block_sizes[1:block])))
+    return starts
+
+def color_targets(start, count, n_colors, rng):
+    # count consecutive palette indices from start, in random order
+    return rng.permutation((start + np.arange(count)) % n_colors)
+
+def compile_participant(participant, seed, x_axis_limit, y_axis_limit, palette, stim_size,
+        practice_file='cd_practice_conditions.csv', trial_file='cd_trial_conditions.csv', n_blocks=3, n_reps=5):
+    # Worker: returns the participant's SessionSchedule arrays
+    Bilateral_Positions.stim_size = stim_size
+    Bilateral_Positions.min_distance = 2.5*stim_size
+    palette = Session_Schedule.as_palette(palette)
+    block_conditions = Session_Schedule.session_conditions(seed, practice_file, trial_file, n_blocks, n_reps)
+    color_starts = color_run_starts(participant, [len(conditions) for conditions in block_conditions])
+    specs = []
+    for block, conditions in enumerate(block_conditions):
+        rng = np.random.default_rng([seed, block, 0])  # Trials are numbered from 1, so this stream is free
+        quadrants = np.zeros(len(conditions), dtype=int)
+        cells = sorted(set(conditions))
+        for cell, condition in enumerate(cells):
+            rows = [i for i, c in enumerate(conditions) if c == condition]
+            quadrants[rows] = quadrant_targets(participant, cell + block*len(cells), len(rows), rng)
+        colors = color_targets(color_starts[block], len(conditions), len(palette), rng)
+        for trial, (set_size, change) in enumerate(conditions, start=1):
+            specs.append(Session_Schedule.compile_trial(seed, block, trial, set_size, change,
+                x_axis_limit, y_axis_limit, palette, int(quadrants[trial - 1]), int(colors[trial - 1])))
+    return Session_Schedule.SessionSchedule.from_specs(seed, specs).arrays
+
+def compile_study(n_participants, study_seed, x_axis_limit, y_axis_limit, palette,
+        first_id=1, workers=None, stim_size=Bilateral_Positions.stim_size, **session_options):
+    # Returns the arrays of the study file; participants are numbered from first_id
+    seeds = participant_seeds(study_seed, n_participants)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(compile_participant, p, seed, x_axis_limit, y_axis_limit, palette, stim_size, **session_options)
+                   for p, seed in enumerate(seeds)]
+        sessions = [future.result() for future in futures]
+
+    max_set_size = max(session['positions'].shape[1] for session in sessions)
+    study = {name: [] for name in ['block', 'trial', 'set_size', 'change', 'positions', 'colors', 'probe_color']}
+    for session in sessions:
+        for name in study:
+            values = session[name]
+            if name in ('positions', 'colors'):
+                values = np.pad(values, [(0, 0), (0, max_set_size - values.shape[1]), (0, 0)])
+            study[name].append(values)
+    study = {name: np.concatenate(values) for name, values in study.items()}
+    study.update({
+        'study_seed': np.int64(study_seed),
+        'x_axis_limit': np.float64(x_axis_limit),
+        'y_axis_limit': np.float64(y_axis_limit),
+        'stim_size': np.int64(stim_size),
+        'participant_ids': np.arange(first_id, first_id + n_participants, dtype=np.int64),
+        'participant_seeds': np.array(seeds, dtype=np.int64),
+        'participant_starts': np.cumsum([0] + [len(session['block']) for session in sessions]).astype(np.int64),
+        'palette_size': np.int64(len(Session_Schedule.as_palette(palette))),
+        })
+    return study
+
+def save_study(filename, study):
+    np.savez_compressed(filename, **study)
+
+def load_participant(filename, participant_id, x_axis_limit=None, y_axis_limit=None):
+    # Returns the participant's SessionSchedule. With axis limits given, the file must
+    # have been compiled for the same screen.
+    with np.load(filename) as study:
+        if x_axis_limit is not None and (float(study['x_axis_limit']) != x_axis_limit
+                                         or float(study['y_axis_limit']) != y_axis_limit):
+            raise ValueError('%s was compiled for axis limits %g x %g, not %g x %g' % (filename,
+                float(study['x_axis_limit']), float(study['y_axis_limit']), x_axis_limit, y_axis_limit))
+        ids = study['participant_ids']
+        matches = np.flatnonzero(ids == int(participant_id))
+        if len(matches) == 0:
+            raise ValueError('Participant_ID %s is not in %s (it has %d to %d)'
+                             % (participant_id, filename, ids.min(), ids.max()))
+        p = int(matches[0])
+        start, stop = study['participant_starts'][p], study['participant_starts'][p + 1]
+        arrays = {name: study[name][start:stop] for name in ['block', 'trial', 'set_size', 'change', 'colors', 'probe_color']}
+        n = int(arrays['set_size'].max())
+        arrays['positions'] = study['positions'][start:stop, :n]
+        arrays['colors'] = arrays['colors'][:, :n]
+        arrays['seed'] = study['participant_seeds'][p]
+    return Session_Schedule.SessionSchedule(arrays)
+
+def balance_report(study, palette):
+    # Counts of square1's quadrant by (set size, change) and of its colour, over the study's experimental trials
+    experimental = study['block'] > 0
+    quadrants = np.array([Session_Schedule.quadrant_of(pos) for pos in study['positions'][experimental, 0]])
+    lookup = {tuple(color): i for i, color in enumerate(Session_Schedule.as_palette(palette).lookup('rgb255').tolist())}
+    colors = np.array([lookup.get(tuple(color), -1) for color in study['colors'][experimental, 0].tolist()])
+    report = {}
+    for set_size, change in sorted(set(zip(study['set_size'][experimental].tolist(), study['change'][experimental].tolist()))):
+        cell = (study['set_size'][experimental] == set_size) & (study['change'][experimental] == change)
+        report['quadrants N=%d change=%d' % (set_size, change)] = np.bincount(quadrants[cell], minlength=4).tolist()
+    report['colors'] = np.bincount(colors[colors >= 0], minlength=int(study['palette_size'])).tolist()
+    return report
+
+if __name__ == '__main__':
+    import Single_Trial_Change_Detection  # For the palette and screen margins; doesn't open a window
+    parser = argparse.ArgumentParser(description='Compile counterbalanced schedules for a whole study.')
+    parser.add_argument('participants', type=int)
+    parser.add_argument('--study-seed', type=int, required=True)
+    parser.add_argument('--first-id', type=int, default=1)
+    parser.add_argument('--size', default='1920x1080', help='screen size in pixels, WIDTHxHEIGHT')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='study_schedule.npz')
+    args = parser.parse_args()
+
+    width, height = [int(value) for value in args.size.lower().split('x')]
+    stim_size = Single_Trial_Change_Detection.stim_size
+    # Same margins as Single_Trial_Change_Detection.setup_display
+    x_axis_limit, y_axis_limit = int(width/1.35)/2 - stim_size, int(height/1.35)/2 - stim_size
+    palette = Single_Trial_Change_Detection.palette
+    study = compile_study(args.participants, args.study_seed, x_axis_limit, y_axis_limit, palette,
+                          args.first_id, args.workers, stim_size)
+    save_study(args.output, study)
+    for name, counts in balance_report(study, palette).items():
+        print('%-26s %s' % (name, counts))
+    print(args.output)
@@ -0,0 +1,65 @@
+# ------------------------------------------------------------------------
+#  Next-trial prefetch
+#
+#  While trial N runs, trial N+1 is made ready so its fixation starts on
+#  time however long its setup takes:
+#    1. request() hands the work of building N+1's TrialSpec (looking it up
+#       in the schedule, or compiling its layout and colours) to a worker
+#       thread. This is plain Python and NumPy, so it can run off the main
+#       thread.
+#    2. prepare() loads the finished spec into the spare of two stimulus
+#       pools. Stimuli belong to the window's thread, so this runs on the
+#       main thread: it is added to Single_Trial_Change_Detection's
+#       idle_hooks, and runs in the spare time after trial N's flips.
+#    3. take() returns the ready TrialBundle for run_trial, and the pools
+#       swap roles for the next request.
+#  If a bundle isn't ready when it's taken (e.g. the last frames had no
+#  spare time), take() finishes it straight away and counts it as late.
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+TrialBundle = namedtuple('TrialBundle', ['key', 'spec', 'pool'])
+
+class TrialPrefetcher:
+    def __init__(self, pool, spare_pool):
+        # pool is the one trials are using now; both must already be big enough for any trial
+        self.pools = [pool, spare_pool]
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.key = None
+        self.future = None
+        self.bundle = None
+        self.n_taken = 0
+        self.n_late = 0
+
+    def request(self, key, make_spec):
+        # Starts building the next trial; key (e.g. its schedule index) identifies it in take()
+        self.key = key
+        self.bundle = None
+        self.future = self.executor.submit(make_spec)
+
+    def prepare(self, deadline=None):
+        # Idle hook: loads the next trial's stimuli once its spec is ready. Main thread only.
+        if self.bundle is not None or self.future is None or not self.future.done():
+            return
+        spec = self.future.result()
+        pool = self.pools[1]
+        pool.set_trial(spec.positions, spec.colors)
+        self.bundle = TrialBundle(self.key, spec, pool)
+
+    def take(self, key):
+        # Returns the bundle for key, finishing it now if it isn't ready
+        if self.future is None or self.key != key:
+            raise ValueError('Trial %r was taken but %r was requested' % (key, self.key))
+        if self.bundle is None:
+            self.n_late += 1
+            self.future.result()
+            self.prepare()
+        bundle = self.bundle
+        self.pools.reverse()  # The pool this trial uses is the one that must not change while it runs
+        self.future = self.bundle = self.key = None
+        self.n_taken += 1
+        return bundle
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,98 @@
+# ------------------------------------------------------------------------
+#  Crash-safe trial log
+#
+#  TrialWriter appends one JSON line per trial to a log next to the data
+#  file. Rows are only queued while a trial runs; write() is called in the
+#  inter-trial interval, and the file is fsynced every fsync_every trials,
+#  so a crash or an early quit loses at most the trial that was running.
+#  Whenever the handler's set of columns changes, a {"__columns__": [...]}
+#  line with them in ExperimentHandler's order is logged before the row.
+#
+#  If a session ends before ExperimentHandler writes its wide-text file,
+#  rebuild it from the log, with the same columns in the same order, with:
+#
+#      python Trial_Writer.py data/ID_1/1_Change_Detection_<date>_trials.jsonl
+
+import csv, json, os, sys
+
+columns_key = '__columns__'
+
+class TrialWriter:
+    def __init__(self, filename, fsync_every=5):
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self._file = open(filename, 'a', encoding='utf-8')
+        self._pending = []
+        self._unsynced = 0
+        self._columns = None
+
+    def add(self, row, columns=None):
+        # Only queues the row, so this is safe to call at any point of a trial. columns
+        # (see wide_text_columns) is logged too when it has changed.
+        if columns is not None and columns != self._columns:
+            self._columns = list(columns)
+            self._pending.append({columns_key: self._columns})
+        self._pending.append(row)
+
+    def write(self, sync=False):
+        # Call between trials. Rows reach the OS on every call, and the disk every fsync_every rows.
+        for row in self._pending:
+            self._file.write(json.dumps(row, default=str) + '\n')
+        self._unsynced += len(self._pending)
+        self._pending = []
+        self._file.flush()
+        if self._unsynced and (sync or self._unsynced >= self.fsync_every):
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.write(sync=True)
+            self._file.close()
+
+def wide_text_columns(exp):
+    # The columns an ExperimentHandler's wide-text file would have now, in the order
+    # saveAsWideText writes them: the loops' trial parameters and counters, the data
+    # names, then extraInfo
+    names = exp._getAllParamNames()
+    for name in exp.dataNames:
+        if name not in names:
+            names.append(name)
+    if isinstance(exp.extraInfo, dict):
+        names.extend(exp.extraInfo)
+    return names
+
+def read_log(filename):
+    # Rows of a trial log and the last columns logged (None if there are none), skipping a
+    # last line cut off by a crash
+    rows, columns = [], None
+    with open(filename, encoding='utf-8') as log:
+        for line in log:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                break
+            if columns_key in row:
+                columns = row[columns_key]
+            else:
+                rows.append(row)
+    return rows, columns
+
+def recover_wide_text(log_filename, output_filename=None):
+    # Writes the rows as a wide-text CSV like ExperimentHandler's: its columns in its order,
+    # then any other keys in the order they first appear (all of them, for logs with no columns)
+    if output_filename is None:
+        output_filename = os.path.splitext(log_filename)[0] + '_recovered.csv'
+    rows, columns = read_log(log_filename)
+    fieldnames = list(columns or [])
+    for row in rows:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    with open(output_filename, 'w', newline='', encoding='utf-8-sig') as output:
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return output_filename
+
+if __name__ == '__main__':
+    for log_filename in sys.argv[1:]:
+        print(recover_wide_text(log_filename))
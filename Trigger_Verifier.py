@@ -0,0 +1,407 @@
+# ------------------------------------------------------------------------
+#  Checking recorded EEG triggers against the behavioural data
+#
+#  Reads the trigger channel the amplifier recorded (or an exported event
+#  list), turns it into trials, and lines them up with the session's
+#  behavioural columns (see Session_Columns) and flip times (see
+#  Frame_Timeline). The report gives:
+#    - trials in the behaviour with no codes, recorded trials with no
+#      behaviour, and trials recorded more than once
+#    - codes missing from a trial, by kind (see EEG_Triggers)
+#    - codes outside the scheme, and which of them are two of a trial's
+#      codes merged (ORed together, as on a parallel port when two pulses
+#      overlap), and codes closer together than min_spacing
+#    - trials whose set size, choice or accuracy codes disagree with the
+#      behaviour
+#    - with flip times, the EEG clock against the experiment clock: a
+#      straight-line fit of when the stimulus, retention and probe codes
+#      were recorded on when their flips happened gives the offset and
+#      the drift (in parts per million), and what is left over is each
+#      code's jitter, and how much later one kind of code arrives than
+#      the others (relative_latency_<kind>_ms, around 0 when all are alike)
+#  A latency that every code shares (serial port, trigger box, amplifier)
+#  is not estimated: the two clocks' zero points are unknown, so it can't
+#  be told apart from their offset and ends up in clock_offset. Measuring
+#  it needs a photodiode or similar on the EEG side.
+#
+#  Raw channels are read through a memory map in chunks of chunk_samples,
+#  so multi-hour recordings don't have to fit in memory. Each chunk is
+#  decoded with array comparisons: a code starts wherever the channel
+#  changes to a value other than reset_code. Trials are found with one
+#  pass over the decoded codes too: every code has a kind with a fixed
+#  place in the trial (start, block, trial, ..., accuracy), and a new
+#  trial starts wherever a code's place isn't after the previous one's.
+#
+#      python Trigger_Verifier.py recording.dat data/ID_1/1_Change_Detection_<date> \
+#          --sample-rate 1000 --dtype int16 --channels 33 --channel 32
+#      python Trigger_Verifier.py events.csv data/ID_1/1_Change_Detection_<date> --sample-rate 1000
+#      python Trigger_Verifier.py --synthetic /tmp/triggers --hours 3
+#
+#  The session is given by its file stem, as Change_Detection saves it;
+#  <stem>_columns and <stem>_timeline_flips.csv are read from next to it.
+#  Event lists are CSVs with a code column and a sample or time (s) column.
+#  --synthetic writes a made-up session and recording with known drift,
+#  latency, dropped and merged codes, then checks it.
+
+import argparse, csv, os
+import numpy as np
+import EEG_Triggers
+import Session_Columns
+
+chunk_samples = 1 << 22
+min_spacing = 0.05  # Codes closer together than this (s) may have merged on the way
+
+# Kinds of code in the order run_trial sends them; a code's kind is its place in the trial
+code_kinds = ['start', 'block', 'trial', 'stimuli', 'retention', 'probe', 'choice', 'accuracy']
+flip_kinds = ['stimuli', 'retention', 'probe']  # Sent on a flip, so they can be lined up with flip times
+kind_of_code = np.full(256, -1, dtype=np.int8)
+kind_of_code[EEG_Triggers.TRIAL_START_CODE] = 0
+kind_of_code[EEG_Triggers.block_code(1):256] = 1
+kind_of_code[EEG_Triggers.trial_code(1):EEG_Triggers.block_code(0)] = 2
+kind_of_code[EEG_Triggers.stim_number_code(1):EEG_Triggers.stim_number_code(10)] = 3
+kind_of_code[EEG_Triggers.retention_code(1):EEG_Triggers.retention_code(10)] = 4
+kind_of_code[EEG_Triggers.PROBE_CODE] = 5
+kind_of_code[EEG_Triggers.choice_code(0):EEG_Triggers.choice_code(3)] = 6
+kind_of_code[EEG_Triggers.accuracy_code(0):EEG_Triggers.accuracy_code(2)] = 7
+code_bases = np.array([0, EEG_Triggers.block_code(0), EEG_Triggers.trial_code(0), EEG_Triggers.stim_number_code(0),
+                       EEG_Triggers.retention_code(0), 0, EEG_Triggers.choice_code(0), EEG_Triggers.accuracy_code(0)])
+
+def open_channel(filename, dtype='int16', n_channels=1, channel=0, header_bytes=0):
+    # Memory-mapped view of one channel: a .npy file (1-D, or samples x channels) or a raw
+    # file of interleaved samples of dtype after header_bytes
+    if filename.endswith('.npy'):
+        data = np.load(filename, mmap_mode='r')
+        return data if data.ndim == 1 else data[:, channel]
+    data = np.memmap(filename, dtype=dtype, mode='r', offset=header_bytes)
+    n_samples = len(data) // n_channels
+    return data[:n_samples * n_channels].reshape(n_samples, n_channels)[:, channel]
+
+def decode_channel(channel, reset_code=0, mask=None):
+    # (onset sample, code) of every code on the channel, read a chunk at a time.
+    # mask keeps only the trigger bits, e.g. 0xFF for a status channel with other bits set.
+    onsets, codes = [], []
+    previous = reset_code
+    for start in range(0, len(channel), chunk_samples):
+        values = np.asarray(channel[start:start + chunk_samples]).astype(np.int64)
+        if mask is not None:
+            values &= mask
+        starts = np.empty(len(values), dtype=bool)
+        starts[0] = values[0] != previous
+        np.not_equal(values[1:], values[:-1], out=starts[1:])
+        starts &= values != reset_code
+        found = np.flatnonzero(starts)
+        onsets.append(found + start)
+        codes.append(values[found])
+        previous = values[-1]
+    if not onsets:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(onsets), np.concatenate(codes)
+
+def load_event_list(filename, sample_rate):
+    # (onset sample, code) from a CSV with a code column and a sample or time column
+    with open(filename, newline='') as events_file:
+        rows = list(csv.DictReader(events_file))
+    codes = np.array([int(float(row['code'])) for row in rows], dtype=np.int64)
+    if rows and 'sample' in rows[0]:
+        onsets = np.array([int(float(row['sample'])) for row in rows], dtype=np.int64)
+    else:
+        onsets = np.round(np.array([float(row['time']) for row in rows]) * sample_rate).astype(np.int64)
+    return onsets, codes
+
+def code_kinds_of(codes):
+    kinds = np.full(len(codes), -1, dtype=np.int64)
+    in_range = (codes >= 0) & (codes < 256)
+    kinds[in_range] = kind_of_code[codes[in_range]]
+    return kinds
+
+def segment_trials(onsets, codes):
+    # Recorded trials as (n_trials, 8) arrays of codes and onsets by kind (-1 where missing),
+    # plus the trial each known code went to (-1 for codes outside the scheme)
+    kinds = code_kinds_of(codes)
+    known = np.flatnonzero(kinds >= 0)
+    k = kinds[known]
+    new_trial = np.ones(len(k), dtype=bool)
+    new_trial[1:] = k[1:] <= k[:-1]
+    trial_of = np.full(len(codes), -1, dtype=np.int64)
+    trial_of[known] = np.cumsum(new_trial) - 1
+    n_trials = int(new_trial.sum())
+    trial_codes = np.full((n_trials, len(code_kinds)), -1, dtype=np.int64)
+    trial_onsets = np.full((n_trials, len(code_kinds)), -1, dtype=np.int64)
+    trial_codes[trial_of[known], k] = codes[known]
+    trial_onsets[trial_of[known], k] = onsets[known]
+    return trial_codes, trial_onsets, trial_of
+
+def code_values(trial_codes):
+    # What each code says (block number, trial number, set size, ...), -1 where missing
+    return np.where(trial_codes >= 0, trial_codes - code_bases, -1)
+
+def fill_numbers(values):
+    # A trial with no block code is in the block of the trial before; one with no trial
+    # code follows the trial before it in the same block
+    block, trial = values[:, 1].copy(), values[:, 2].copy()
+    index = np.where(block >= 0, np.arange(len(block)), 0)
+    np.maximum.accumulate(index, out=index)
+    block = np.where(block >= 0, block, block[index])
+    follows = np.flatnonzero(trial[1:] < 0) + 1
+    follows = follows[(trial[follows - 1] >= 0) & (block[follows] == block[follows - 1])]
+    trial[follows] = trial[follows - 1] + 1
+    return block, trial
+
+def trial_keys(block, trial):
+    return block.astype(np.int64) * 10000 + trial
+
+def load_flip_times(filename):
+    # {kind: (block, trial, time) arrays} for the flips that send codes
+    found = {kind: ([], [], []) for kind in flip_kinds}
+    with open(filename, newline='') as flips_file:
+        for row in csv.DictReader(flips_file):
+            if row['event'] in found:
+                columns = found[row['event']]
+                columns[0].append(int(row['block']))
+                columns[1].append(int(row['trial']))
+                columns[2].append(float(row['flip_time']))
+    return {kind: tuple(np.array(values) for values in columns) for kind, columns in found.items()}
+
+def load_behaviour(stem):
+    # Experimental trials of a saved session, with their code flip times when the timeline was saved
+    columns = Session_Columns.load_columns(stem + '_columns', ['block', 'trial', 'set_size', 'choice', 'accuracy'])
+    experimental = np.asarray(columns['block']) > 0  # Practice sends no codes
+    behaviour = {name: np.asarray(values)[experimental].astype(np.int64) for name, values in columns.items()}
+    flips_file = stem + '_timeline_flips.csv'
+    if os.path.exists(flips_file):
+        keys = trial_keys(behaviour['block'], behaviour['trial'])
+        for kind, (block, trial, times) in load_flip_times(flips_file).items():
+            behaviour[kind] = np.full(len(keys), np.nan)
+            flip_keys = trial_keys(block, trial)
+            order = np.argsort(flip_keys)
+            i = np.minimum(np.searchsorted(flip_keys[order], keys), len(order) - 1)
+            matched = flip_keys[order][i] == keys if len(order) else np.zeros(len(keys), bool)
+            behaviour[kind][matched] = times[order][i[matched]]
+    return behaviour
+
+def fit_clock(flip_times, recorded_times, outlier_mads=5.0):
+    # recorded = offset + (1 + drift) * flip, fitted twice: the second time without
+    # points more than outlier_mads median absolute deviations off the first line
+    keep = np.ones(len(flip_times), dtype=bool)
+    for _ in range(2):
+        slope, offset = np.polyfit(flip_times[keep], recorded_times[keep], 1)
+        residuals = recorded_times - (offset + slope * flip_times)
+        deviation = np.abs(residuals - np.median(residuals[keep]))
+        keep = deviation <= outlier_mads * max(np.median(deviation[keep]), 1e-6)
+    return slope, offset, residuals, keep
+
+def merged_pairs(unknown_code, expected):
+    # Pairs of a trial's expected codes that OR together to unknown_code
+    return [(a, b) for i, a in enumerate(expected) for b in expected[i + 1:] if a | b == unknown_code]
+
+def verify(onsets, codes, sample_rate, behaviour, spacing=min_spacing):
+    # Returns (report, trials): report is a dict of counts and estimates, trials a dict of
+    # per-trial columns for the recorded trials
+    onsets, codes = np.asarray(onsets, dtype=np.int64), np.asarray(codes, dtype=np.int64)
+    report = {'n_codes': len(codes), 'duration': float(onsets[-1] - onsets[0]) / sample_rate if len(onsets) else 0.0}
+    trial_codes, trial_onsets, trial_of = segment_trials(onsets, codes)
+    values = code_values(trial_codes)
+    block, trial = fill_numbers(values)
+    recorded_keys = trial_keys(block, trial)
+
+    # Lining recorded trials up with behaviour rows by (block, trial)
+    expected_keys = trial_keys(behaviour['block'], behaviour['trial'])
+    order = np.argsort(expected_keys, kind='stable')
+    position = np.minimum(np.searchsorted(expected_keys[order], recorded_keys), max(len(order) - 1, 0))
+    matched = (expected_keys[order][position] == recorded_keys) if len(order) else np.zeros(len(recorded_keys), bool)
+    matched &= (block >= 0) & (trial >= 0)
+    row = np.where(matched, order[position] if len(order) else -1, -1)
+    unique_rows, counts = np.unique(row[matched], return_counts=True)
+    missing_rows = np.setdiff1d(np.arange(len(expected_keys)), unique_rows)
+    report.update({
+        'n_trials_expected': len(expected_keys),
+        'n_trials_recorded': len(trial_codes),
+        'n_trials_matched': len(unique_rows),
+        'n_trials_missing': len(missing_rows),
+        'missing_trials': [(int(behaviour['block'][i]), int(behaviour['trial'][i])) for i in missing_rows[:10]],
+        'n_trials_unmatched': int((~matched).sum()),
+        'n_trials_duplicated': int((counts > 1).sum()),
+        })
+    missing_codes = trial_codes < 0
+    report.update({'missing_' + kind: int(missing_codes[:, i].sum()) for i, kind in enumerate(code_kinds)})
+
+    # Codes that disagree with the behaviour (missing ones aren't counted again here)
+    rows = row[matched]
+    for name, kind in [('set_size', 3), ('set_size', 4), ('choice', 6), ('accuracy', 7)]:
+        present = values[matched, kind] >= 0
+        wrong = present & (values[matched, kind] != behaviour[name][rows])
+        report['wrong_' + code_kinds[kind]] = int(wrong.sum())
+
+    # Codes outside the scheme, and whether they are two of their trial's missing codes merged
+    unknown = np.flatnonzero(trial_of < 0)
+    known = np.flatnonzero(trial_of >= 0)
+    n_merged = 0
+    for i in unknown:
+        before = np.searchsorted(known, i) - 1
+        t = trial_of[known[before]] if before >= 0 else -1
+        if t >= 0 and row[t] >= 0:
+            r = row[t]
+            expected = EEG_Triggers.trial_codes(int(block[t]), int(trial[t]), int(behaviour['set_size'][r]),
+                                                int(behaviour['choice'][r]), int(behaviour['accuracy'][r]))
+            expected = [c for kind, c in enumerate(expected) if missing_codes[t, kind]]
+            n_merged += bool(merged_pairs(int(codes[i]), expected))
+    close = np.diff(onsets) < spacing * sample_rate
+    report.update({
+        'n_unknown_codes': len(unknown) - n_merged,
+        'n_merged_codes': n_merged,
+        'unknown_code_values': sorted(set(codes[unknown].tolist()))[:20],
+        'n_close_codes': int(close.sum()),
+        })
+
+    # Clock offset (which includes any latency common to all codes), drift and jitter from the codes sent on flips
+    trials = {'block': block, 'trial': trial, 'row': row, 'codes': trial_codes, 'onsets': trial_onsets}
+    if all(kind in behaviour for kind in flip_kinds) and matched.any():
+        flips, recorded, kinds_used = [], [], []
+        for kind in flip_kinds:
+            k = code_kinds.index(kind)
+            use = matched & (trial_onsets[:, k] >= 0)
+            use[use] &= np.isfinite(behaviour[kind][row[use]])
+            flips.append(behaviour[kind][row[use]])
+            recorded.append(trial_onsets[use, k] / float(sample_rate))
+            kinds_used.append(np.full(use.sum(), k))
+        flips, recorded, kinds_used = np.concatenate(flips), np.concatenate(recorded), np.concatenate(kinds_used)
+        if len(flips) >= 3:
+            slope, offset, residuals, keep = fit_clock(flips, recorded)
+            report.update({
+                'clock_offset': float(offset),
+                'clock_drift_ppm': float((slope - 1) * 1e6),
+                'latency_jitter_ms': float(np.std(residuals[keep]) * 1000),
+                'latency_jitter_max_ms': float(np.abs(residuals[keep]).max() * 1000),
+                'n_latency_outliers': int((~keep).sum()),
+                })
+            # Relative to the fitted line, so they show how the kinds differ, e.g. a later probe code
+            for kind in flip_kinds:
+                k = code_kinds.index(kind)
+                of_kind = keep & (kinds_used == k)
+                if of_kind.any():
+                    report['relative_latency_%s_ms' % kind] = float(np.median(residuals[of_kind]) * 1000)
+    return report, trials
+
+def write_trials(filename, trials, sample_rate):
+    # One row per recorded trial: its numbers, behaviour row and each code with its time
+    with open(filename, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['block', 'trial', 'behaviour_row'] + ['%s_code' % kind for kind in code_kinds]
+                        + ['%s_time' % kind for kind in code_kinds])
+        times = np.where(trials['onsets'] >= 0, trials['onsets'] / float(sample_rate), np.nan)
+        for i in range(len(trials['block'])):
+            writer.writerow([trials['block'][i], trials['trial'][i], trials['row'][i]]
+                            + trials['codes'][i].tolist() + times[i].tolist())
+
+# ---- Synthetic sessions and recordings, for checking the verifier ----
+
+def synthetic_behaviour(n_blocks, trials_per_block, rng, set_sizes=(1, 2, 3, 4, 5, 6, 7, 8), start_time=10.0,
+                        fixation=1.0, encoding=0.5, retention=1.0, probe=2.0, gap=(1.0, 3.0)):
+    # Behaviour columns and code flip times for a made-up session, with gap s (uniformly
+    # drawn) between trials for the participant to continue
+    n = n_blocks * trials_per_block
+    change = rng.integers(0, 2, n)
+    choice = rng.choice([0, 1, 2], n, p=[0.45, 0.45, 0.1])
+    trial_start = start_time + np.cumsum(fixation + encoding + retention + probe + rng.uniform(*gap, n))
+    return {'block': np.repeat(np.arange(1, n_blocks + 1), trials_per_block),
+            'trial': np.tile(np.arange(1, trials_per_block + 1), n_blocks),
+            'set_size': rng.choice(set_sizes, n),
+            'choice': choice,
+            'accuracy': ((choice == change) & (choice < 2)).astype(np.int64),
+            'trial_start': trial_start,
+            'stimuli': trial_start + fixation,
+            'retention': trial_start + fixation + encoding,
+            'probe': trial_start + fixation + encoding + retention,
+            'end': trial_start + fixation + encoding + retention + probe}
+
+def sent_codes(behaviour, pulse_duration=0.1):
+    # (time, code) of every code run_trial sends, on the experiment clock
+    n = len(behaviour['block'])
+    times = np.column_stack([behaviour['trial_start'][:, None] + pulse_duration * np.arange(3),
+                             behaviour['stimuli'], behaviour['retention'], behaviour['probe'],
+                             behaviour['end'], behaviour['end'] + pulse_duration])
+    codes = np.array([EEG_Triggers.trial_codes(*numbers) for numbers in zip(
+        behaviour['block'].tolist(), behaviour['trial'].tolist(), behaviour['set_size'].tolist(),
+        behaviour['choice'].tolist(), behaviour['accuracy'].tolist())]).reshape(n, len(code_kinds))
+    return times.ravel(), codes.ravel()
+
+def synthetic_recording(times, codes, sample_rate, rng, offset=3.0, drift_ppm=40.0, latency=0.004,
+                        jitter=0.001, drop_rate=0.002, merge_rate=0.002):
+    # (onset sample, code) as an amplifier would record them: on its own clock (offset and
+    # drift), late by latency with jitter, with some codes dropped and some neighbours merged
+    recorded = offset + (1 + drift_ppm * 1e-6) * times + latency + rng.normal(0, jitter, len(times))
+    onsets = np.round(recorded * sample_rate).astype(np.int64)
+    codes = codes.copy()
+    merge = np.flatnonzero(rng.random(len(codes) - 1) < merge_rate)
+    merge = merge[np.diff(np.concatenate([[-2], merge])) > 1]  # Not two merges in a row
+    codes[merge] |= codes[merge + 1]
+    keep = rng.random(len(codes)) >= drop_rate
+    keep[merge + 1] = False
+    return onsets[keep], codes[keep]
+
+def write_channel(filename, onsets, codes, n_samples, pulse_samples, dtype='int16', n_channels=1, channel=0):
+    # Raw file of interleaved channels with the codes on one of them as pulse_samples-long
+    # pulses (cut short by the next code), written a chunk at a time through a memory map
+    data = np.memmap(filename, dtype=dtype, mode='w+', shape=(n_samples, n_channels))
+    for start in range(0, n_samples, chunk_samples):
+        samples = np.arange(start, min(start + chunk_samples, n_samples))
+        last = np.searchsorted(onsets, samples, side='right') - 1
+        on = (last >= 0) & (samples - onsets[np.maximum(last, 0)] < pulse_samples)
+        data[start:start + len(samples), channel] = np.where(on, codes[np.maximum(last, 0)], 0)
+    data.flush()
+    del data
+
+def print_report(report):
+    for name, value in report.items():
+        if isinstance(value, float):
+            value = '%.4f' % value
+        print('%-30s %s' % (name, value))
+
+if __name__ == '__main__':
+    import time
+    parser = argparse.ArgumentParser(description='Check recorded EEG triggers against the behavioural data.')
+    parser.add_argument('recording', nargs='?', help='raw channel file, .npy, or .csv event list')
+    parser.add_argument('session', nargs='?', help='session file stem (data/ID_*/<id>_Change_Detection_<date>)')
+    parser.add_argument('--sample-rate', type=float, default=1000.0)
+    parser.add_argument('--dtype', default='int16', help='sample type of a raw file')
+    parser.add_argument('--channels', type=int, default=1, help='channels interleaved in a raw file')
+    parser.add_argument('--channel', type=int, default=0, help='index of the trigger channel')
+    parser.add_argument('--header-bytes', type=int, default=0)
+    parser.add_argument('--mask', type=lambda value: int(value, 0), default=None, help='trigger bits, e.g. 0xFF')
+    parser.add_argument('--reset-code', type=int, default=0, help='channel value between codes')
+    parser.add_argument('--output', default=None, help='CSV of the recorded trials')
+    parser.add_argument('--synthetic', default=None, help='folder to write and check a synthetic session in')
+    parser.add_argument('--hours', type=float, default=1.0, help='length of the synthetic session')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        trials_per_block = 30
+        n_blocks = max(1, int(args.hours * 3600 / 6.5 / trials_per_block))  # About 6.5 s per trial
+        behaviour = synthetic_behaviour(n_blocks, trials_per_block, rng)
+        onsets, codes = synthetic_recording(*sent_codes(behaviour), args.sample_rate, rng)
+        if not os.path.exists(args.synthetic):
+            os.makedirs(args.synthetic)
+        recording = os.path.join(args.synthetic, 'triggers.dat')
+        n_samples = int(onsets[-1] + 10 * args.sample_rate)
+        write_channel(recording, onsets, codes, n_samples, int(0.01 * args.sample_rate))
+        print('%s: %d samples, %d trials, made with offset 3.0 s + latency 4 ms, drift 40 ppm, jitter 1 ms'
+              % (recording, n_samples, len(behaviour['block'])))
+    elif args.recording and args.session:
+        recording = args.recording
+        behaviour = load_behaviour(args.session)
+    else:
+        parser.error('give a recording and a session, or --synthetic')
+
+    started = time.perf_counter()
+    if recording.endswith('.csv'):
+        onsets, codes = load_event_list(recording, args.sample_rate)
+    else:
+        channel = open_channel(recording, args.dtype, args.channels, args.channel, args.header_bytes)
+        onsets, codes = decode_channel(channel, args.reset_code, args.mask)
+    report, trials = verify(onsets, codes, args.sample_rate, behaviour)
+    print_report(report)
+    print('%-30s %.2f s' % ('checked in', time.perf_counter() - started))
+    if args.output:
+        write_trials(args.output, trials, args.sample_rate)
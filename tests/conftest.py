@@ -0,0 +1,26 @@
+# Tests import the task's modules from the repository root. Anything that needs PsychoPy
+# is skipped when it isn't installed.
+
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PYGLET_HEADLESS', '1')
+
+@pytest.fixture(scope='session')
+def headless_session(tmp_path_factory):
+    # One full simulated session, saved by the real ExperimentHandler; returns its data file name
+    pytest.importorskip('psychopy.data')
+    import Headless_Session
+    window, observer = Headless_Session.setup_headless(seed=1)
+    data_folder = str(tmp_path_factory.mktemp('data'))
+    data_file_name, overheads = Headless_Session.run_headless_session(1, 1, data_folder, observer)
+    return data_file_name
+
+@pytest.fixture
+def headless_window():
+    # Single_Trial_Change_Detection pointed at Headless_Session's stand-ins, on a virtual clock
+    pytest.importorskip('psychopy.core')
+    import Headless_Session
+    window, observer = Headless_Session.setup_headless(seed=0)
+    return window
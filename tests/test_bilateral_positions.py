@@ -0,0 +1,34 @@
+import numpy as np
+import Bilateral_Positions
+
+def test_feasible_mask_excludes_points_exactly_min_distance_away():
+    d = int(Bilateral_Positions.min_distance)
+    assert d == Bilateral_Positions.min_distance  # So the boundary points are on the grid
+    values = np.arange(0, 2*d + 100)
+    centre = d + 20
+    feasible = Bilateral_Positions.feasible_mask(values, values, [(centre, centre)])
+    row, col = centre, centre
+    for offset in (-d, d):
+        assert not feasible[row, col + offset]
+        assert not feasible[row + offset, col]
+    for offset in (-d - 1, d + 1):
+        assert feasible[row, col + offset]
+        assert feasible[row + offset, col]
+
+def test_feasible_mask_matches_distance_rule():
+    values = np.arange(-300, 301, 3)
+    near = [(0, 0), (150, -90), (-200, 210)]
+    feasible = Bilateral_Positions.feasible_mask(values, values, near)
+    y, x = np.meshgrid(values, values, indexing='ij')
+    expected = np.ones_like(feasible)
+    for near_x, near_y in near:
+        expected &= (x - near_x)**2 + (y - near_y)**2 > Bilateral_Positions.min_distance**2
+    assert (feasible == expected).all()
+
+def test_layouts_keep_min_distance():
+    rng = np.random.default_rng(0)
+    for stim_number in range(1, 9):
+        for trial in range(50):
+            pos = np.array(Bilateral_Positions.create_n_pos(stim_number, 640, 360, rng))
+            distances = np.hypot(*(pos[:, None] - pos[None, :]).transpose(2, 0, 1))
+            assert (distances[np.triu_indices(stim_number, 1)] > Bilateral_Positions.min_distance).all()
@@ -0,0 +1,23 @@
+import json, os
+import Capacity_Analysis
+
+def test_reads_experiment_handler_csv(headless_session):
+    participant, trials = Capacity_Analysis.read_trials(headless_session + '.csv')
+    assert participant == '1'
+    assert len(trials['block']) == 90  # 3 blocks of 30; practice left out
+    assert set(trials['block'].tolist()) == {1, 2, 3}
+
+def test_summary_is_not_empty(headless_session):
+    data_folder = os.path.dirname(os.path.dirname(headless_session))
+    summary = Capacity_Analysis.summarize(Capacity_Analysis.collect_aggregates(data_folder, use_cache=False))
+    assert len(summary) > 0
+
+def test_rereads_cache_from_older_version(headless_session):
+    data_folder = os.path.dirname(os.path.dirname(headless_session))
+    filename = headless_session + '.csv'
+    info = os.stat(filename)
+    stale = {filename: {'mtime': info.st_mtime, 'size': info.st_size, 'participant': '', 'rows': []}}
+    with open(os.path.join(data_folder, Capacity_Analysis.cache_name), 'w') as cache_file:
+        json.dump(stale, cache_file)
+    aggregates = Capacity_Analysis.collect_aggregates(data_folder)
+    assert aggregates[filename][1]
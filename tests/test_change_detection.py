@@ -0,0 +1,20 @@
+import pytest
+
+def test_adaptive_stop_ends_the_block_loop(tmp_path, monkeypatch, headless_window):
+    import Change_Detection, Headless_Session, Single_Trial_Change_Detection
+    monkeypatch.setattr(Change_Detection, 'adaptive', True)
+    monkeypatch.setattr(Change_Detection, 'adaptive_target_sd', float('inf'))  # Every block stops after one trial
+    open_loops = []
+    next_entry = Change_Detection.data.ExperimentHandler.nextEntry
+
+    def recording_next_entry(exp):
+        open_loops.append([loop.name for loop in exp.loopsUnfinished])
+        next_entry(exp)
+
+    monkeypatch.setattr(Change_Detection.data.ExperimentHandler, 'nextEntry', recording_next_entry)
+    observer = Headless_Session.KSlotObserver(headless_window.clock.getTime)
+    Single_Trial_Change_Detection.response_device = observer
+    Headless_Session.run_headless_session(1, 1, str(tmp_path), observer)
+    block_entries = [loops for loops in open_loops if 'block_loop' in loops]
+    assert len(block_entries) == 3
+    assert all(len(loops) == 2 for loops in block_entries)  # The block loop and this block's trials only
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import Color_Palette
+
+colors = [(255, 0, 0), (0, 255, 0), (1, 1, 1), (255, 128, 0)]
+
+def test_rows_come_from_the_converted_table():
+    palette = Color_Palette.Palette(colors)
+    rows = palette.rows([(1, 1, 1), (255, 0, 0)], 'rgb')
+    table = palette.lookup('rgb')
+    assert np.array_equal(rows, table[[2, 0]])
+    assert np.allclose(table[3], [1, 128/127.5 - 1, -1])
+    assert palette.lookup('rgb') is table  # Converted once
+    assert np.allclose(palette.rows([(255, 128, 0)], 'rgb1'), [[1, 128/255.0, 0]])
+
+def test_rows_convert_colours_outside_the_table():
+    palette = Color_Palette.Palette(colors)
+    assert np.allclose(palette.rows([(0, 0, 255)], 'rgb'), [[-1, -1, 1]])
+    with pytest.raises(ValueError):
+        palette.lookup('hsv')
+
+def test_pool_squares_get_window_colour_space_rows(headless_window):
+    import Single_Trial_Change_Detection
+    palette = Single_Trial_Change_Detection.palette
+    pool = Single_Trial_Change_Detection.stimulus_pool
+    trial_colors = [palette.color(3), palette.color(5)]
+    pool.set_trial([(-200, 100), (200, -100)], trial_colors)
+    assert pool.squares[0].colorSpace == headless_window.colorSpace == 'rgb'
+    assert np.array_equal(pool.squares[0].fillColor, palette.lookup('rgb')[3])
+    assert np.array_equal(pool.squares[1].fillColor, palette.lookup('rgb')[5])
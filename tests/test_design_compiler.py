@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pytest
+
+import Design_Compiler
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+max_run = {'change': 3, 'number_of_stim': 3}
+
+def trial_design():
+    return Design_Compiler.load_design(os.path.join(root, 'cd_trial_conditions.csv'))
+
+def check_order(design, order, n_reps, limits):
+    assert np.array_equal(np.bincount(order, minlength=len(design)), np.full(len(design), n_reps))
+    for name, limit in limits.items():
+        assert Design_Compiler.max_runs(design[name][order]) <= limit
+
+def test_every_row_n_reps_times_within_run_limits():
+    design = trial_design()
+    for seed in range(20):
+        order = Design_Compiler.constrained_order(design, 5, np.random.default_rng(seed), max_run)
+        check_order(design, order, 5, max_run)
+
+def test_runs_across_chunk_boundaries_are_counted():
+    # The chunk's first two trials make a run of 4 with the two before it
+    candidate = np.array([[1, 1, 0, 1]])
+    assert not Design_Compiler.run_violations(candidate, 3).any()
+    assert Design_Compiler.run_violations(candidate, 3, np.array([0, 1, 1])).all()
+    assert not Design_Compiler.run_violations(candidate, 3, np.array([1, 0, 1])).any()
+    # Orders many chunks long, with tight limits, keep them at the joins too
+    design = trial_design()
+    n_reps = 4 * Design_Compiler.chunk_size // len(design) + 1
+    for seed in range(20):
+        order = Design_Compiler.constrained_order(design, n_reps, np.random.default_rng(seed), {'change': 2})
+        assert len(order) > 3 * Design_Compiler.chunk_size
+        check_order(design, order, n_reps, {'change': 2})
+
+def test_many_repetitions_take_the_with_replacement_path(monkeypatch):
+    design = trial_design()
+    n_reps = 2 * Design_Compiler.chunk_size**2 // len(design) + 50
+    draw_chunks = Design_Compiler.draw_chunks
+    with_replacement = []
+    def counting_draw_chunks(rng, n_left, chunk, batch):
+        with_replacement.append(n_left > 2 * chunk * chunk)
+        return draw_chunks(rng, n_left, chunk, batch)
+    monkeypatch.setattr(Design_Compiler, 'draw_chunks', counting_draw_chunks)
+    order = Design_Compiler.constrained_order(design, n_reps, np.random.default_rng(4), max_run)
+    assert any(with_replacement) and not all(with_replacement)
+    check_order(design, order, n_reps, max_run)
+
+def test_same_seed_same_order():
+    design = trial_design()
+    first = Design_Compiler.constrained_order(design, 5, np.random.default_rng(7), max_run)
+    second = Design_Compiler.constrained_order(design, 5, np.random.default_rng(7), max_run)
+    other = Design_Compiler.constrained_order(design, 5, np.random.default_rng(8), max_run)
+    assert np.array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+def test_unsatisfiable_design_raises():
+    # Every trial is a change trial, so any order has a run of them longer than 3
+    design = np.array([(2, 1), (5, 1), (6, 1)], dtype=[('number_of_stim', np.int64), ('change', np.int64)])
+    with pytest.raises(ValueError):
+        Design_Compiler.constrained_order(design, 5, np.random.default_rng(0), {'change': 3})
+
+def test_no_limits_is_a_plain_shuffle():
+    design = trial_design()
+    order = Design_Compiler.constrained_order(design, 3, np.random.default_rng(0), {'change': 0})
+    check_order(design, order, 3, {})
+
+def test_max_runs():
+    assert Design_Compiler.max_runs([]) == 0
+    assert Design_Compiler.max_runs([1, 1, 0, 0, 0, 1]) == 3
+    assert Design_Compiler.max_runs([2]) == 1
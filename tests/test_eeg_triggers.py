@@ -0,0 +1,59 @@
+import os, time
+import pytest
+import EEG_Triggers
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'openpty'), reason='FakeSerialDevice needs a pseudo-terminal')
+
+pulse_duration = 0.03
+
+@pytest.fixture
+def device():
+    device = EEG_Triggers.FakeSerialDevice()
+    yield device
+    device.close()
+
+def wait_for_codes(device, n, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while len(device.received) < n and time.perf_counter() < deadline:
+        time.sleep(0.005)
+
+def test_dispatcher_keeps_order_and_spacing(device):
+    expected = EEG_Triggers.trial_codes(2, 17, 6, 1, 0)
+    dispatcher = EEG_Triggers.TriggerDispatcher(device, pulse_duration=pulse_duration)
+    for code in expected:
+        dispatcher.send(code)
+    dispatcher.close()
+    wait_for_codes(device, len(expected))
+    assert EEG_Triggers.check_sequence(device.received, expected, pulse_duration) == []
+
+def test_check_sequence_reports_order_and_spacing():
+    received = [(98, 0.0), (201, 0.1), (101, 0.11)]
+    problems = EEG_Triggers.check_sequence(received, [98, 101, 201], 0.1)
+    assert len(problems) == 2
+    assert 'expected codes' in problems[0]
+    assert 'arrived' in problems[1]
+
+def test_trial_sends_codes_in_order(device, headless_window):
+    import Single_Trial_Change_Detection
+    dispatcher = EEG_Triggers.TriggerDispatcher(device, pulse_duration=pulse_duration)
+    Single_Trial_Change_Detection.triggers = dispatcher
+    try:
+        choice, accuracy, rt, timeline = Single_Trial_Change_Detection.run_trial(4, 1, 2, 7)
+    finally:
+        Single_Trial_Change_Detection.triggers = None
+        dispatcher.close()
+    expected = EEG_Triggers.trial_codes(2, 7, 4, choice, accuracy)
+    wait_for_codes(device, len(expected))
+    assert EEG_Triggers.check_sequence(device.received, expected, pulse_duration) == []
+
+def test_practice_sends_no_codes(device, headless_window):
+    import Single_Trial_Change_Detection
+    dispatcher = EEG_Triggers.TriggerDispatcher(device, pulse_duration=pulse_duration)
+    Single_Trial_Change_Detection.triggers = dispatcher
+    try:
+        Single_Trial_Change_Detection.run_trial(4, 1, 0, 1)
+    finally:
+        Single_Trial_Change_Detection.triggers = None
+        dispatcher.close()
+    time.sleep(0.05)
+    assert device.received == []
@@ -0,0 +1,92 @@
+import time
+import numpy as np
+import pytest
+
+import Gaze_Gating
+
+def samples_at(times, x=0.0, y=0.0):
+    return np.column_stack([times, np.full(len(times), x), np.full(len(times), y)])
+
+def test_ring_buffer_reads_across_wrap_point():
+    buffer = Gaze_Gating.GazeRingBuffer(10)
+    buffer.write(samples_at(np.arange(7.0)))
+    buffer.write(samples_at(np.arange(7.0, 13.0)))  # Wraps: 7-9 at the end, 10-12 at the start
+    assert buffer.n_written == 13
+    assert list(buffer.between(-np.inf, np.inf)[:, 0]) == list(np.arange(3.0, 13.0))
+    assert list(buffer.between(8, 11)[:, 0]) == [8, 9, 10]  # t0 <= t < t1, over the wrap point
+    assert list(buffer.between(10.5, 12)[:, 0]) == [11]
+    assert len(buffer.between(0, 3)) == 0  # Overwritten
+
+def test_ring_buffer_keeps_newest_of_an_oversized_block():
+    buffer = Gaze_Gating.GazeRingBuffer(4)
+    buffer.write(samples_at(np.arange(2.0)))
+    buffer.write(samples_at(np.arange(2.0, 12.0)))
+    assert list(buffer.between(-np.inf, np.inf)[:, 0]) == [8, 9, 10, 11]
+
+def test_saccade_samples_threshold_and_span():
+    t = np.arange(10) / 1000.0
+    samples = samples_at(t)
+    samples[5:, 1] = 2.0  # A 2 pixel step in 1 ms: 50 degrees/s at 40 pixels per degree
+    fast = Gaze_Gating.saccade_samples(samples, 40.0, 30.0)
+    assert list(np.flatnonzero(fast)) == [5]
+    assert not Gaze_Gating.saccade_samples(samples, 40.0, 60.0).any()
+    # Measured over 4 samples the same step is 12.5 degrees/s
+    assert not Gaze_Gating.saccade_samples(samples, 40.0, 30.0, span=4).any()
+    assert not Gaze_Gating.saccade_samples(samples[:1], 40.0, 30.0).any()
+
+def test_saccade_samples_ignore_lost_samples():
+    samples = samples_at(np.arange(6) / 1000.0)
+    samples[2:4, 1:] = np.nan
+    assert not Gaze_Gating.saccade_samples(samples, 40.0, 30.0).any()
+
+def stream(samples):
+    # Plays samples through serve_replay into a SocketTracker, stamped with time.perf_counter,
+    # and waits until all of them are in the buffer
+    buffer = Gaze_Gating.GazeRingBuffer(len(samples))
+    address = Gaze_Gating.serve_replay(samples, time.perf_counter)
+    tracker = Gaze_Gating.SocketTracker(address, buffer)
+    monitor = Gaze_Gating.GazeMonitor(tracker, buffer, radius=72, rate=1000.0)
+    deadline = time.perf_counter() + 5
+    while buffer.n_written < len(samples) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    tracker.close()
+    assert buffer.n_written == len(samples)
+    return monitor, buffer.data[0, 0]
+
+def test_socket_replay_passes_clean_fixation():
+    samples = Gaze_Gating.synthetic_gaze(0.5, rng=np.random.default_rng(1), saccade_rate=0)
+    monitor, start = stream(samples)
+    assert monitor.fixating(time.perf_counter())
+    flags = monitor.interval_flags(start + 0.1, start + 0.4)
+    assert (flags['saccade'], flags['outside']) == (0, 0)
+    assert flags['lost'] == pytest.approx(0, abs=1e-9)
+
+def test_socket_replay_flags_saccade_during_encoding():
+    samples = Gaze_Gating.synthetic_gaze(0.7, rng=np.random.default_rng(2), saccade_rate=0)
+    t = samples[:, 0]
+    samples[:, 1] += 200 * np.clip((t - 0.15) / 0.03, 0, 1) - 200 * np.clip((t - 0.25) / 0.03, 0, 1)
+    monitor, start = stream(samples)
+    encoding = monitor.interval_flags(start + 0.1, start + 0.35)
+    assert encoding['saccade'] == 1 and encoding['outside'] == 1
+    assert encoding['lost'] < 0.01
+    after = monitor.interval_flags(start + 0.35, start + 0.7)
+    assert (after['saccade'], after['outside']) == (0, 0)
+    assert monitor.fixating(time.perf_counter())  # The last gate_duration is clean again
+
+class NeverFixating:
+    gate_timeout = 60.0
+
+    def fixating(self, now):
+        return False
+
+def test_escape_exits_while_gate_holds_trial(headless_window, monkeypatch):
+    Single_Trial_Change_Detection = pytest.importorskip('Single_Trial_Change_Detection')
+    import Response_Devices
+    device = Response_Devices.SimulatedDevice(headless_window.clock.getTime)
+    device.press('escape', headless_window.clock.getTime() + 0.5)
+    monkeypatch.setattr(Single_Trial_Change_Detection, 'response_device', device)
+    monkeypatch.setattr(Single_Trial_Change_Detection, 'gaze_monitor', NeverFixating())
+    started = headless_window.clock.getTime()
+    with pytest.raises(SystemExit):
+        Single_Trial_Change_Detection.run_trial(4, 1, 1, 1)
+    assert headless_window.clock.getTime() - started < 1.0  # Long before the gate times out
@@ -0,0 +1,67 @@
+import gc, os, threading
+import pytest
+import Realtime_Mode
+
+class FakeTimeline:
+    def __init__(self, flips):
+        self.flips = flips
+
+def test_collector_is_off_only_during_trials():
+    mode = Realtime_Mode.RealtimeMode()
+    mode.start()
+    try:
+        assert gc.isenabled()
+        mode.before_trial()
+        assert not gc.isenabled()
+        frame = 1/60.0
+        stats = mode.after_trial(FakeTimeline([('trial_start', 0.0, 0), ('', frame, 1), ('stimuli', 3*frame, 3)]))
+        assert gc.isenabled()
+    finally:
+        mode.stop()
+    assert gc.get_freeze_count() == 0
+    assert stats['realtime_gc_count'] == 0
+    assert stats['realtime_missed_frames'] == 1
+    assert stats['realtime_frame_max_ms'] == pytest.approx(2000/60.0)
+
+def test_session_error_puts_collector_back(tmp_path, monkeypatch, headless_window):
+    import Change_Detection, Headless_Session, Single_Trial_Change_Detection
+    monkeypatch.setattr(Change_Detection, 'realtime', True)
+    monkeypatch.setattr(Change_Detection, 'realtime_nice', None)
+    real_run_trial = Single_Trial_Change_Detection.run_trial
+    calls = []
+
+    def failing_run_trial(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError('stopped mid-session')
+        return real_run_trial(*args, **kwargs)
+
+    monkeypatch.setattr(Single_Trial_Change_Detection, 'run_trial', failing_run_trial)
+    hooks_before = list(Single_Trial_Change_Detection.idle_hooks)
+    observer = Headless_Session.KSlotObserver(headless_window.clock.getTime)
+    Single_Trial_Change_Detection.response_device = observer
+    with pytest.raises(RuntimeError):
+        Headless_Session.run_headless_session(1, 1, str(tmp_path), observer)
+    assert gc.isenabled()
+    assert gc.get_freeze_count() == 0
+    assert Single_Trial_Change_Detection.idle_hooks == hooks_before
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity') or len(os.sched_getaffinity(0)) < 2,
+                    reason='needs Linux and more than one CPU')
+def test_cpu_pinning_only_reaches_the_calling_thread():
+    cpus = os.sched_getaffinity(0)
+    running = threading.Event()
+    done = threading.Event()
+    helper = threading.Thread(target=lambda: (running.set(), done.wait()))
+    helper.start()
+    running.wait()
+    mode = Realtime_Mode.RealtimeMode(cpu=min(cpus))
+    try:
+        assert mode.start() == []
+        assert os.sched_getaffinity(0) == {min(cpus)}
+        assert os.sched_getaffinity(helper.native_id) == cpus  # Already running, so left alone
+    finally:
+        mode.stop()
+        done.set()
+        helper.join()
+    assert os.sched_getaffinity(0) == cpus
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('psychopy.core')
+import Response_Devices
+import Single_Trial_Change_Detection
+
+class ProbeLockedDevice(Response_Devices.SimulatedDevice):
+    # Presses key at delay after the probe's flip (run_trial clears the device on that flip)
+    def __init__(self, get_time, key, delay, early_key=None):
+        Response_Devices.SimulatedDevice.__init__(self, get_time)
+        self.key, self.delay = key, delay
+        self.probe_time = None
+        if early_key is not None:
+            self.press(early_key, get_time() + 0.5)  # During fixation, so it must be dropped
+
+    def clear(self):
+        Response_Devices.SimulatedDevice.clear(self)
+        self.probe_time = self.get_time()
+        if self.key is not None:
+            self.press(self.key, self.probe_time + self.delay)
+
+def run_scripted_trial(window, key, delay, is_changed=1, early_key=None):
+    device = ProbeLockedDevice(window.clock.getTime, key, delay, early_key)
+    Single_Trial_Change_Detection.response_device = device
+    choice, accuracy, rt, timeline = Single_Trial_Change_Detection.run_trial(4, is_changed, 1, 1)
+    return device, choice, accuracy, rt, timeline
+
+def test_rt_is_measured_from_probe_flip(headless_window):
+    device, choice, accuracy, rt, timeline = run_scripted_trial(headless_window, '4', 0.4321)
+    assert device.probe_time == timeline.events['probe']
+    assert rt == pytest.approx(0.4321, abs=1e-9)
+    assert (choice, accuracy) == (1, 1)
+
+def test_no_change_answer(headless_window):
+    device, choice, accuracy, rt, timeline = run_scripted_trial(headless_window, '3', 0.8, is_changed=1)
+    assert rt == pytest.approx(0.8, abs=1e-9)
+    assert (choice, accuracy) == (0, 0)
+
+def test_presses_before_probe_are_dropped(headless_window):
+    device, choice, accuracy, rt, timeline = run_scripted_trial(headless_window, None, 0, early_key='4')
+    assert (choice, accuracy, rt) == (2, 0, 0)
+
+def test_incomplete_device_fails_when_created():
+    class NoResponses(Response_Devices.ResponseDevice):
+        def clear(self):
+            pass
+    with pytest.raises(TypeError):
+        NoResponses()
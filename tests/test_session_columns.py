@@ -0,0 +1,28 @@
+import os
+import numpy as np
+import Session_Columns
+
+def save_session(data_folder, participant, set_sizes, max_set_size):
+    n = len(set_sizes)
+    arrays = {name: np.zeros(n, dtype=dtype) for name, dtype in Session_Columns.column_types.items()}
+    arrays['set_size'][:] = set_sizes
+    arrays['positions'] = np.zeros((n, max_set_size, 2), dtype=Session_Columns.column_types['positions'])
+    arrays['colors'] = np.zeros((n, max_set_size, 3), dtype=Session_Columns.column_types['colors'])
+    arrays['probe_color'] = np.zeros((n, 3), dtype=Session_Columns.column_types['probe_color'])
+    for i, set_size in enumerate(set_sizes):
+        arrays['positions'][i, :set_size] = participant
+        arrays['colors'][i, :set_size] = participant
+    folder = os.path.join(data_folder, 'ID_%d' % participant, '%d_Change_Detection_columns' % participant)
+    Session_Columns.save_columns(folder, arrays, {'Participant_ID': participant})
+
+def test_load_study_pads_sessions_with_different_set_sizes(tmp_path):
+    save_session(str(tmp_path), 1, [2, 4], 4)  # A fixed session
+    save_session(str(tmp_path), 2, [8, 3, 6], 8)  # An adaptive one, with larger set sizes
+    study = Session_Columns.load_study(str(tmp_path), ['set_size', 'positions', 'colors'])
+    assert study['positions'].shape == (5, 8, 2)
+    assert study['colors'].shape == (5, 8, 3)
+    assert study['positions'].dtype == Session_Columns.column_types['positions']
+    for i, set_size in enumerate(study['set_size']):
+        participant = study['session'][i] + 1
+        assert (study['positions'][i, :set_size] == participant).all()
+        assert (study['positions'][i, set_size:] == 0).all()
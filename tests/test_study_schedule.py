@@ -0,0 +1,18 @@
+import numpy as np
+import Study_Schedule
+
+palette = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255),
+           (0, 255, 255), (255, 255, 255), (1, 1, 1), (255, 128, 0)]
+
+def test_color_runs_continue_across_blocks_and_participants():
+    block_sizes = [6, 30, 30, 30]
+    starts = [Study_Schedule.color_run_starts(p, block_sizes) for p in range(3)]
+    assert starts[0] == [0, 0, 30, 60]
+    assert starts[1] == [6, 90, 120, 150]
+    assert starts[2] == [12, 180, 210, 240]
+
+def test_study_colors_are_equally_frequent():
+    # 8 participants x 90 experimental trials = 720 = 80 per colour
+    study = Study_Schedule.compile_study(8, 3, 640, 360, palette, workers=1)
+    counts = Study_Schedule.balance_report(study, palette)['colors']
+    assert counts == [80] * len(palette)
@@ -0,0 +1,70 @@
+import threading
+from collections import namedtuple
+import pytest
+
+import Trial_Prefetch
+
+Spec = namedtuple('Spec', ['positions', 'colors'])
+
+class FakePool:
+    # Records what set_trial loaded into it
+    def __init__(self, name):
+        self.name = name
+        self.loaded = []
+
+    def set_trial(self, positions, colors):
+        self.loaded.append((positions, colors))
+
+def spec(n):
+    return Spec([(n, 0)], [(n, n, n)])
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = Trial_Prefetch.TrialPrefetcher(FakePool('first'), FakePool('second'))
+    yield prefetcher
+    prefetcher.close()
+
+def ready(prefetcher, key, made_spec):
+    prefetcher.request(key, lambda: made_spec)
+    prefetcher.future.result()
+    prefetcher.prepare()
+
+def test_take_returns_spare_pool_and_pools_swap(prefetcher):
+    first, second = prefetcher.pools
+    ready(prefetcher, 1, spec(1))
+    bundle = prefetcher.take(1)
+    assert bundle.pool is second and bundle.spec == spec(1) and bundle.key == 1
+    assert second.loaded == [(spec(1).positions, spec(1).colors)]
+    assert prefetcher.pools == [second, first]
+    ready(prefetcher, 2, spec(2))
+    assert prefetcher.take(2).pool is first
+    assert (prefetcher.n_taken, prefetcher.n_late) == (2, 0)
+
+def test_bundle_not_ready_is_finished_in_take(prefetcher):
+    release = threading.Event()
+    prefetcher.request(5, lambda: release.wait() and spec(5))
+    prefetcher.prepare()  # Spec not built yet: nothing to load
+    assert prefetcher.bundle is None and prefetcher.pools[1].loaded == []
+    release.set()
+    bundle = prefetcher.take(5)
+    assert bundle.spec == spec(5) and bundle.pool.loaded == [(spec(5).positions, spec(5).colors)]
+    assert (prefetcher.n_taken, prefetcher.n_late) == (1, 1)
+
+def test_taking_another_trial_raises(prefetcher):
+    with pytest.raises(ValueError):
+        prefetcher.take(1)  # Nothing requested
+    ready(prefetcher, 1, spec(1))
+    with pytest.raises(ValueError):
+        prefetcher.take(2)
+
+def test_prepare_never_touches_the_pool_in_use(prefetcher):
+    ready(prefetcher, 1, spec(1))
+    in_use = prefetcher.take(1).pool
+    loaded = list(in_use.loaded)
+    prefetcher.request(2, lambda: spec(2))
+    prefetcher.future.result()
+    for i in range(5):  # As the idle hook would, after every flip of trial 1
+        prefetcher.prepare()
+    assert in_use.loaded == loaded
+    assert prefetcher.pools[1] is not in_use and prefetcher.pools[1].loaded[-1][0] == spec(2).positions
+    assert len(prefetcher.pools[1].loaded) == 1
@@ -0,0 +1,56 @@
+import csv, os, shutil
+import pytest
+
+import Trial_Writer
+
+def read_csv(filename):
+    with open(filename, newline='', encoding='utf-8-sig') as csv_file:
+        return list(csv.reader(csv_file))
+
+def cut_last_line(filename):
+    # As a crash in the middle of writing the last row would leave it
+    with open(filename, 'rb+') as log:
+        size = log.seek(0, os.SEEK_END)
+        log.truncate(size - 10)
+
+def test_recovery_drops_cut_off_row_and_keeps_column_order(tmp_path):
+    log_filename = str(tmp_path / 'session_trials.jsonl')
+    writer = Trial_Writer.TrialWriter(log_filename, fsync_every=2)
+    columns = ['number_of_stim', 'change', 'trials.thisN', 'choice', 'rt', 'Participant_ID']
+    for n in range(4):
+        row = {'choice': n % 2, 'rt': 0.5 + n, 'trials.thisN': n, 'Participant_ID': 7,
+               'number_of_stim': 2 + n, 'change': n % 2}
+        if n == 3:
+            row['late_column'] = 'x'
+        writer.add(row, columns)
+        writer.write()
+    writer.close()
+    cut_last_line(log_filename)
+
+    rows, logged_columns = Trial_Writer.read_log(log_filename)
+    assert len(rows) == 3 and logged_columns == columns
+    recovered = read_csv(Trial_Writer.recover_wide_text(log_filename))
+    assert recovered[0] == columns
+    assert recovered[1:] == [[str(2 + n), str(n % 2), str(n), str(n % 2), str(0.5 + n), '7'] for n in range(3)]
+
+def test_columns_are_logged_only_when_they_change(tmp_path):
+    log_filename = str(tmp_path / 'session_trials.jsonl')
+    writer = Trial_Writer.TrialWriter(log_filename)
+    writer.add({'a': 1}, ['a'])
+    writer.add({'a': 2}, ['a'])
+    writer.add({'a': 3, 'b': 4}, ['a', 'b'])
+    writer.close()
+    with open(log_filename, encoding='utf-8') as log:
+        assert sum(Trial_Writer.columns_key in line for line in log) == 2
+    assert read_csv(Trial_Writer.recover_wide_text(log_filename))[0] == ['a', 'b']
+
+def test_recovered_file_matches_experiment_handler(headless_session, tmp_path):
+    # A crash during the last trial's write: everything else comes back, in the handler's columns
+    log_filename = str(tmp_path / 'crashed_trials.jsonl')
+    shutil.copy(headless_session + '_trials.jsonl', log_filename)
+    cut_last_line(log_filename)
+    handler_rows = read_csv(headless_session + '.csv')
+    recovered = read_csv(Trial_Writer.recover_wide_text(log_filename))
+    handler_columns = handler_rows[0][:-1]  # Its lines end with a delimiter
+    assert recovered[0] == handler_columns
+    assert recovered[1:] == [row[:-1] for row in handler_rows[1:-1]]
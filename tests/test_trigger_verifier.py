@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import Trigger_Verifier
+
+sample_rate = 1000.0
+
+def make_session(drop_rate, merge_rate, seed=0, n_blocks=6):
+    rng = np.random.default_rng(seed)
+    behaviour = Trigger_Verifier.synthetic_behaviour(n_blocks, 30, rng)
+    times, codes = Trigger_Verifier.sent_codes(behaviour)
+    onsets, recorded = Trigger_Verifier.synthetic_recording(times, codes, sample_rate, rng, offset=3.0, drift_ppm=40.0,
+        latency=0.004, jitter=0.001, drop_rate=drop_rate, merge_rate=merge_rate)
+    return behaviour, codes, onsets, recorded
+
+def test_clean_recording():
+    behaviour, sent, onsets, codes = make_session(0, 0)
+    report, trials = Trigger_Verifier.verify(onsets, codes, sample_rate, behaviour)
+    assert report['n_trials_matched'] == report['n_trials_expected'] == len(behaviour['block'])
+    assert report['n_trials_missing'] == report['n_trials_unmatched'] == report['n_trials_duplicated'] == 0
+    assert sum(report['missing_' + kind] for kind in Trigger_Verifier.code_kinds) == 0
+    assert report['n_unknown_codes'] == report['n_merged_codes'] == 0
+    assert report['clock_drift_ppm'] == pytest.approx(40.0, abs=2.0)
+    assert report['clock_offset'] == pytest.approx(3.004, abs=0.002)  # Offset plus the common latency
+    assert report['latency_jitter_ms'] == pytest.approx(1.0, abs=0.3)
+
+def test_dropped_codes_are_counted_by_kind():
+    behaviour, sent, onsets, codes = make_session(0.02, 0)
+    n_dropped = len(sent) - len(codes)
+    assert n_dropped > 0
+    report, trials = Trigger_Verifier.verify(onsets, codes, sample_rate, behaviour)
+    assert sum(report['missing_' + kind] for kind in Trigger_Verifier.code_kinds) == n_dropped
+    assert report['clock_drift_ppm'] == pytest.approx(40.0, abs=2.0)
+
+def test_merged_codes_are_found():
+    behaviour, sent, onsets, codes = make_session(0, 0.01, seed=3)
+    n_merged = len(sent) - len(codes)  # Each merge folds a code into the one before it
+    assert n_merged > 0
+    report, trials = Trigger_Verifier.verify(onsets, codes, sample_rate, behaviour)
+    # Some merges land on another valid code and show up as wrong or extra trials instead
+    assert 0 < report['n_merged_codes'] <= n_merged
+    assert report['n_merged_codes'] + report['n_unknown_codes'] <= n_merged
+    assert report['clock_drift_ppm'] == pytest.approx(40.0, abs=2.0)
+
+def test_channel_decodes_to_the_same_codes(tmp_path, monkeypatch):
+    behaviour, sent, onsets, codes = make_session(0.01, 0.01)
+    monkeypatch.setattr(Trigger_Verifier, 'chunk_samples', 4096)  # Many chunk boundaries
+    filename = str(tmp_path / 'triggers.dat')
+    n_samples = int(onsets[-1] + sample_rate)
+    Trigger_Verifier.write_channel(filename, onsets, codes, n_samples, 10, n_channels=3, channel=2)
+    channel = Trigger_Verifier.open_channel(filename, 'int16', 3, 2)
+    decoded_onsets, decoded_codes = Trigger_Verifier.decode_channel(channel)
+    assert (decoded_onsets == onsets).all()
+    assert (decoded_codes == codes).all()
+
+def test_missing_trials_are_listed():
+    behaviour, sent, onsets, codes = make_session(0, 0)
+    keep = np.ones(len(codes), dtype=bool)
+    keep[8*10:8*11] = False  # Every code of the eleventh trial
+    report, trials = Trigger_Verifier.verify(onsets[keep], codes[keep], sample_rate, behaviour)
+    assert report['n_trials_missing'] == 1
+    assert report['missing_trials'] == [(1, 11)]